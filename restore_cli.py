@@ -4,6 +4,7 @@ Command-line interface for point-in-time recovery operations
 """
 
 import argparse
+import os
 import sys
 from datetime import datetime
 from pathlib import Path
@@ -16,6 +17,7 @@ from services.PITRRestoreManager import PITRRestoreManager
 from services.PITRBackupManager import PITRBackupManager
 from services.EnhancedRestoreManager import EnhancedPITRRestoreManager
 from services.TransactionLogManager import TransactionLogManager
+from services.LSN import format_lsn
 from services.pitr_config import DB_CONFIG
 
 
@@ -36,6 +38,21 @@ def check_file_type(file_path: str) -> tuple[str, str, str]:
     path = Path(file_path)
     if not path.exists():
         return "error", "File not found", ""
+    
+    if path.is_dir():
+        if (path / 'manifest.json').exists():
+            return (
+                "CDC COPY Base Snapshot",
+                "Restored with restore_cli.py restore: schema.dump via pg_restore, table files via parallel COPY.",
+                f"pg_restore -h {DB_CONFIG['host']} -p {DB_CONFIG['port']} -U {DB_CONFIG['user']} -d {DB_CONFIG['dbname']} --clean --if-exists --section=pre-data \"{path / 'schema.dump'}\""
+            )
+        if not (path / 'toc.dat').exists():
+            return "error", "Directory is not a pg_dump directory archive (no toc.dat)", ""
+        return (
+            "PostgreSQL Directory Archive",
+            "Use pg_restore with parallel jobs to restore this archive.",
+            f"pg_restore -h {DB_CONFIG['host']} -p {DB_CONFIG['port']} -U {DB_CONFIG['user']} -d {DB_CONFIG['dbname']} --clean --if-exists -j {os.cpu_count() or 1} \"{file_path}\""
+        )
 
     # Check header
     try:
@@ -145,7 +162,7 @@ def cmd_list_recovery_points(args):
         table_data.append([
             point['txid'],
             format_timestamp(point['timestamp']),
-            point['lsn'],
+            format_lsn(point['lsn']),
             point['changes_count'],
             ', '.join(point.get('tables_affected', []))[:50]
         ])
@@ -174,7 +191,7 @@ def cmd_preview_restore(args):
     print()
     print(f"Target timestamp:        {format_timestamp(preview['target_timestamp'])}")
     print(f"Actual restore time:     {format_timestamp(preview['actual_restore_timestamp'])}")
-    print(f"Recovery point LSN:      {preview['recovery_point']['lsn']}")
+    print(f"Recovery point LSN:      {format_lsn(preview['recovery_point']['lsn'])}")
     print(f"Recovery point TxID:     {preview['recovery_point']['txid']}")
     print()
     print(f"Backups to process:      {preview['backups_to_process']}")
@@ -216,7 +233,8 @@ def cmd_restore(args):
         target_timestamp=target_timestamp,
         target_db=args.target_db,
         tables=args.tables,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        workers=args.workers
     )
     
     if result['success']:
@@ -258,7 +276,8 @@ def cmd_restore_lsn(args):
         target_lsn=args.lsn,
         target_db=args.target_db,
         tables=args.tables,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        workers=args.workers
     )
     
     if result['success']:
@@ -365,18 +384,46 @@ def cmd_base_backup(args):
     try:
         metadata = backup_manager.create_base_backup(
             target_db=args.db,
-            output_path=args.output
+            output_path=args.output,
+            backup_format=args.format,
+            jobs=args.jobs
         )
         print(f"\n✅ Base backup created successfully!")
         print(f"  Filename: {metadata['filename']}")
         print(f"  Path:     {metadata['path']}")
         print(f"  Time:     {format_timestamp(metadata['timestamp'])}")
+        print(f"  Size:     {metadata['size_bytes']:,} bytes")
+        if 'tables' in metadata:
+            print(f"  Tables:   {len(metadata['tables'])} data files ({metadata['jobs']} jobs)")
+        if 'rows' in metadata:
+            print(f"  Rows:     {metadata['rows']:,}")
+        if metadata.get('snapshot_lsn'):
+            print(f"  Snapshot: LSN {metadata['snapshot_lsn']}")
         return 0
     except Exception as e:
         print(f"\n❌ Base backup failed: {e}")
         return 1
 
 
+def cmd_compact(args):
+    """Write a compacted copy of a backup segment"""
+    backup_manager = PITRBackupManager()
+    
+    print(f"Compacting backup: {args.backup_id}")
+    print("-" * 60)
+    
+    try:
+        result = backup_manager.compact_backup(args.backup_id, output_path=args.output)
+        saved = result['changes_in'] - result['changes_out']
+        print("\n✅ Compacted backup written!")
+        print(f"  Path:     {result['path']}")
+        print(f"  Changes:  {result['changes_in']} -> {result['changes_out']} ({saved} folded away)")
+        return 0
+    except Exception as e:
+        print(f"\n❌ Compaction failed: {e}")
+        return 1
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='PITR Restore CLI - Point-in-Time Recovery for CDC Backups',
@@ -401,11 +448,21 @@ Examples:
   # Restore specific tables only
   python restore_cli.py restore --timestamp "2024-01-15 14:30:00" --target-db test_restore --tables users orders
   
+  # Apply non-conflicting transactions on 8 connections
+  python restore_cli.py restore --timestamp "2024-01-15 14:30:00" --target-db test_restore --workers 8 --yes
+  
   # Restore to specific LSN
   python restore_cli.py restore-lsn --lsn "0/12345678" --target-db test_restore
   
   # Show statistics
   python restore_cli.py stats
+  
+  # Write a copy of a backup with one net change per row
+  python restore_cli.py compact --backup-id 20240115_143000
+  
+  # Base snapshot dumped (and later restored) with parallel jobs
+  python restore_cli.py base-backup --db test --format directory --jobs 8
+  python restore_cli.py base-backup --db test --format copy --jobs 8
         """
     )
     
@@ -414,7 +471,10 @@ Examples:
     # Base backup command
     base_parser = subparsers.add_parser('base-backup', help='Create a full base snapshot using pg_dump')
     base_parser.add_argument('--db', required=True, help='Database to back up')
-    base_parser.add_argument('--output', help='Optional output path for the SQL file')
+    base_parser.add_argument('--output', help='Optional output path for the snapshot file (directory)')
+    base_parser.add_argument('--format', choices=['custom', 'directory', 'plain', 'copy'],
+                             help='Snapshot format (default base_backup_format); directory dumps and restores in parallel, copy includes table data via parallel COPY')
+    base_parser.add_argument('--jobs', type=int, help='pg_dump jobs of a directory snapshot, COPY workers of a copy one (default base_backup_jobs)')
     
     # List backups command
     list_backups_parser = subparsers.add_parser('list-backups', help='List available backups')
@@ -437,6 +497,7 @@ Examples:
     restore_parser.add_argument('--tables', nargs='+', help='Specific tables to restore (optional)')
     restore_parser.add_argument('--dry-run', action='store_true', help='Simulate restore without making changes')
     restore_parser.add_argument('--yes', '-y', action='store_true', help='Skip confirmation prompt')
+    restore_parser.add_argument('--workers', type=int, help='Connections to apply changes on in parallel (default: restore_workers)')
     
     # Chain restore command (uses backup chain and verification)
     restore_chain_parser = subparsers.add_parser('restore-chain', help='Perform a chain-based restore using backup lineage and verification')
@@ -449,15 +510,21 @@ Examples:
     
     # Restore to LSN command
     restore_lsn_parser = subparsers.add_parser('restore-lsn', help='Restore to a specific LSN')
-    restore_lsn_parser.add_argument('--lsn', required=True, help='Target LSN')
+    restore_lsn_parser.add_argument('--lsn', required=True, help='Target LSN in pg_lsn form (hex, e.g. 0/3000060)')
     restore_lsn_parser.add_argument('--target-db', required=True, help='Target database name')
     restore_lsn_parser.add_argument('--tables', nargs='+', help='Specific tables to restore (optional)')
     restore_lsn_parser.add_argument('--dry-run', action='store_true', help='Simulate restore without making changes')
     restore_lsn_parser.add_argument('--yes', '-y', action='store_true', help='Skip confirmation prompt')
+    restore_lsn_parser.add_argument('--workers', type=int, help='Connections to apply changes on in parallel (default: restore_workers)')
     
     # Statistics command
     stats_parser = subparsers.add_parser('stats', help='Show backup and transaction statistics')
 
+    # Compact command
+    compact_parser = subparsers.add_parser('compact', help='Write a compacted copy of a backup (one net change per row)')
+    compact_parser.add_argument('--backup-id', required=True, help='Backup ID to compact')
+    compact_parser.add_argument('--output', help='Optional output path for the compacted file')
+    
     # Check file command
     check_parser = subparsers.add_parser('check-file', help='Check a backup file type and get restore command')
     check_parser.add_argument('file', help='Path to backup file to check')
@@ -488,6 +555,8 @@ Examples:
             return cmd_statistics(args)
         elif args.command == 'check-file':
             return cmd_check_file(args)
+        elif args.command == 'compact':
+            return cmd_compact(args)
     
     except Exception as e:
         print(f"\n❌ Error: {e}")
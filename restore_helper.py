@@ -7,15 +7,37 @@ from pathlib import Path
 # Add services to path
 sys.path.insert(0, str(Path(__file__).parent))
 from services.pitr_config import DB_CONFIG
+from services.SqlReplay import SqlSegmentReplayer, SqlReplayError, is_cdc_segment
+from services.LSN import format_lsn
 
-def run_restore(file_path):
+def run_restore(file_path, resume_lsn=None):
     path = Path(file_path)
     if not path.exists():
         print(f"Error: File not found: {file_path}")
         return
     
     # Identify type by extension/content
-    is_sql = path.suffix.lower() == '.sql'
+    is_sql = path.name.lower().endswith(('.sql', '.sql.gz'))
+    
+    if is_sql and is_cdc_segment(path):
+        print(f"[*] Detected SQL Incremental Backup: {path.name}")
+        print("[*] Replaying statements in-process...")
+        replayer = SqlSegmentReplayer(DB_CONFIG['dbname'])
+        
+        def progress(transactions, lsn):
+            print(f"\r    {transactions} transactions applied (LSN {format_lsn(lsn) if lsn else '-'})", end='')
+        
+        try:
+            result = replayer.replay(path, start_lsn=resume_lsn, progress=progress)
+            print(f"\n\n✅ Restore successful! {result['statements']} statements applied.")
+        except SqlReplayError as e:
+            print("\n\n❌ Restore failed!")
+            print(e)
+            if e.last_lsn is not None:
+                print(f"Resume with: python restore_helper.py \"{path}\" {format_lsn(e.last_lsn)}")
+        finally:
+            replayer.close()
+        return
     
     # Prepare environment with password
     env = os.environ.copy()
@@ -23,7 +45,7 @@ def run_restore(file_path):
         env['PGPASSWORD'] = DB_CONFIG['password']
     
     if is_sql:
-        print(f"[*] Detected SQL Incremental Backup: {path.name}")
+        print(f"[*] Detected SQL Script: {path.name}")
         print("[*] Using 'psql' to apply changes...")
         cmd = [
             'psql',
@@ -60,7 +82,7 @@ def run_restore(file_path):
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python restore_helper.py <path_to_backup_file>")
+        print("Usage: python restore_helper.py <path_to_backup_file> [resume_after_lsn]")
         sys.exit(1)
     
-    run_restore(sys.argv[1])
+    run_restore(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
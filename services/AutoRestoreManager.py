@@ -15,6 +15,8 @@ from .pitr_config import PITR_CONFIG, DB_CONFIG
 from .PITRBackupManager import PITRBackupManager
 from .EnhancedRestoreManager import EnhancedPITRRestoreManager
 from .EnhancedBackupManager import BackupChainBuilder
+from .SqlReplay import SqlSegmentReplayer, is_cdc_segment
+from .BaseSnapshot import BaseSnapshotLoader, is_copy_snapshot
 
 
 class AutoRestoreManager:
@@ -39,6 +41,8 @@ class AutoRestoreManager:
         self.logger = self._configure_logger()
         self.backup_manager = PITRBackupManager()
         self.restore_manager = EnhancedPITRRestoreManager(self.backup_manager)
+        # Replays CDC SQL segments over pooled connections to the test database
+        self.replayer = SqlSegmentReplayer(self.test_db_name)
         
         self.running = False
         self.thread = None
@@ -79,6 +83,7 @@ class AutoRestoreManager:
         self.running = False
         if self.thread:
             self.thread.join(timeout=5)
+        self.replayer.close()
         self.logger.info("AutoRestoreManager stopped")
     
     def _monitor_loop(self):
@@ -99,14 +104,9 @@ class AutoRestoreManager:
         if not self.processed_backups:
             self._restore_latest_base_snapshot()
         
-        # Reload catalog to pick up new backups
+        # Query the catalog to pick up backups finalized by the capture process
         try:
-            catalog_path = self.metadata_dir / 'backup_catalog.json'
-            if catalog_path.exists():
-                with open(catalog_path, 'r') as f:
-                    catalog = json.load(f)
-            else:
-                return  # No catalog yet
+            catalog = self.backup_manager.backup_catalog.list_range()
         except Exception as e:
             self.logger.warning(f"Could not read backup catalog: {e}")
             return
@@ -175,7 +175,7 @@ class AutoRestoreManager:
         
         # Restore the file directly
         try:
-            if str(backup_path).endswith('.dump'):
+            if str(backup_path).endswith('.dump') or backup_path.is_dir():
                 self._restore_custom_backup(backup_path)
             elif str(backup_path).endswith('.sql') or str(backup_path).endswith('.sql.gz'):
                 self._restore_sql_backup(backup_path)
@@ -228,7 +228,7 @@ class AutoRestoreManager:
                 else:
                     self.logger.info(f"  [{i+1}/{len(chain)}] Applying incremental: {chain_id}")
                 
-                if str(backup_file).endswith('.dump'):
+                if str(backup_file).endswith('.dump') or backup_file.is_dir():
                     self._restore_custom_backup(backup_file)
                 elif str(backup_file).endswith('.sql') or str(backup_file).endswith('.sql.gz'):
                     self._restore_sql_backup(backup_file)
@@ -245,7 +245,7 @@ class AutoRestoreManager:
         chain = []
         
         # Find and add base backup
-        base_backup = next((b for b in catalog if b['backup_id'] == base_backup_id), None)
+        base_backup = catalog.get(base_backup_id)
         if not base_backup:
             self.logger.warning(f"Base backup {base_backup_id} not found in catalog")
             return []
@@ -256,11 +256,7 @@ class AutoRestoreManager:
         # Follow the chain to target
         while current_id != target_backup_id:
             # Find next backup in chain (has current as parent)
-            next_backup = next(
-                (b for b in catalog 
-                 if b.get('parent_backup_id') == current_id),
-                None
-            )
+            next_backup = next(iter(catalog.children(current_id)), None)
             
             if not next_backup:
                 self.logger.warning(f"Could not find next backup in chain after {current_id}")
@@ -303,8 +299,8 @@ class AutoRestoreManager:
             # Ensure the test database exists first
             self._create_test_database()
             
-            # Use pg_restore for .dump files
-            if str(backup_path).endswith('.dump'):
+            # Use pg_restore for .dump files and directory archives
+            if str(backup_path).endswith('.dump') or backup_path.is_dir():
                 self._restore_custom_backup(backup_path)
             elif str(backup_path).endswith('.sql') or str(backup_path).endswith('.sql.gz'):
                 self._restore_sql_backup(backup_path)
@@ -354,7 +350,15 @@ class AutoRestoreManager:
             self.logger.warning(f"Error creating test database: {e}")
     
     def _restore_sql_backup(self, file_path: Path):
-        """Restore SQL backup using psql"""
+        """Restore SQL backup: CDC segments in-process, other scripts with psql"""
+        if is_cdc_segment(file_path):
+            result = self.replayer.replay(file_path)
+            self.logger.info(
+                f"Replayed {file_path.name}: {result['transactions']} transactions "
+                f"(last LSN {result['last_lsn']})"
+            )
+            return
+        
         import subprocess
         import os
         
@@ -380,10 +384,15 @@ class AutoRestoreManager:
             raise RuntimeError(f"psql restore failed: {err}")
     
     def _restore_custom_backup(self, file_path: Path):
-        """Restore custom format backup using pg_restore"""
+        """Restore custom / directory format backup using parallel pg_restore"""
         import subprocess
         import os
         
+        if is_copy_snapshot(file_path):
+            # Schema with pg_restore, table data with parallel COPY
+            BaseSnapshotLoader(self.test_db_name).restore(file_path)
+            return
+        
         cmd = [
             'pg_restore',
             '-h', DB_CONFIG['host'],
@@ -392,6 +401,7 @@ class AutoRestoreManager:
             '-d', self.test_db_name,
             '--clean',
             '--if-exists',
+            '-j', str(PITR_CONFIG.get('base_restore_jobs') or os.cpu_count() or 1),
             str(file_path)
         ]
         
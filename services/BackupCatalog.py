@@ -0,0 +1,311 @@
+"""
+Backup Catalog
+SQLite-backed catalog of CDC backup segments with indexed time, LSN,
+lineage and table lookups, replacing the rewritten backup_catalog.json
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+from .pitr_config import PITR_CONFIG
+from .LSN import to_lsn
+
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    backup_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    format TEXT,
+    backup_type TEXT,
+    start_us INTEGER,
+    end_us INTEGER,
+    start_lsn INTEGER,
+    end_lsn INTEGER,
+    parent_backup_id TEXT,
+    base_backup_id TEXT,
+    chain_depth INTEGER,
+    changes_count INTEGER NOT NULL DEFAULT 0,
+    size_bytes INTEGER,
+    metadata TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backups_start ON backups (start_us);
+CREATE INDEX IF NOT EXISTS backups_end ON backups (end_us);
+CREATE INDEX IF NOT EXISTS backups_lsn ON backups (start_lsn, end_lsn);
+CREATE INDEX IF NOT EXISTS backups_type ON backups (backup_type, end_us);
+CREATE INDEX IF NOT EXISTS backups_base ON backups (base_backup_id, start_us);
+CREATE INDEX IF NOT EXISTS backups_parent ON backups (parent_backup_id);
+
+CREATE TABLE IF NOT EXISTS backup_tables (
+    table_name TEXT NOT NULL,
+    backup_id TEXT NOT NULL REFERENCES backups (backup_id) ON DELETE CASCADE,
+    PRIMARY KEY (table_name, backup_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS backup_tables_backup ON backup_tables (backup_id);
+
+CREATE TABLE IF NOT EXISTS catalog_info (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# A base segment has no parent; entries written before backup_type existed
+# only carry the lineage columns
+_IS_BASE = "(backup_type = 'base' OR parent_backup_id IS NULL)"
+_IS_INCREMENTAL = "(backup_type = 'incremental' OR parent_backup_id IS NOT NULL)"
+
+
+def _to_us(value) -> Optional[int]:
+    """Microseconds since 1970 for an ISO string or naive datetime"""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - _EPOCH) // _ONE_MICROSECOND
+
+
+class BackupCatalog:
+    """
+    Catalog of finalized backup segments.
+
+    Every segment is one row: the full metadata dict is kept as JSON and the
+    fields used for lookups (time and LSN range, type, lineage) are indexed
+    columns, with the affected tables in a separate indexed table. Adding a
+    segment is a single-row upsert instead of a rewrite of the whole catalog.
+
+    Iterating the catalog yields metadata dicts ordered by start time, so it
+    can stand in for the list the JSON catalog used to be loaded into.
+    """
+
+    def __init__(self, path: str = None, metadata_dir: str = None):
+        """
+        Args:
+            path: SQLite database file
+            metadata_dir: Directory holding backup_catalog.json and the
+                per-segment *_metadata.json files to migrate
+        """
+        self.metadata_dir = Path(metadata_dir or PITR_CONFIG['metadata_dir'])
+        self.path = Path(path or PITR_CONFIG.get('catalog_db') or self.metadata_dir / 'backup_catalog.db')
+        self.logger = logging.getLogger("BackupCatalog")
+        self.lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Shared by the capture, flush and CLI threads; access is serialized by lock
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL lets restore tools read while the capture process appends
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.executescript(_SCHEMA)
+
+        self._migrate_json()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # Writes
+
+    def add(self, metadata: dict):
+        """Insert or replace the catalog entry of a segment"""
+        row = self._row(metadata)
+        with self.lock, self.conn:
+            self._upsert(row, metadata.get('tables_affected') or [])
+
+    def add_many(self, entries: List[dict]) -> int:
+        """Insert several entries in one transaction"""
+        with self.lock, self.conn:
+            for metadata in entries:
+                self._upsert(self._row(metadata), metadata.get('tables_affected') or [])
+        return len(entries)
+
+    def remove(self, backup_id: str) -> bool:
+        """Remove a segment's entry (its tables go with it)"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM backups WHERE backup_id = ?", (backup_id,))
+        return cursor.rowcount > 0
+
+    def _row(self, metadata: dict) -> tuple:
+        return (
+            metadata['backup_id'],
+            metadata['filename'],
+            metadata.get('format'),
+            metadata.get('backup_type'),
+            _to_us(metadata.get('start_time')),
+            _to_us(metadata.get('end_time')),
+            # Metadata written before LSNs were stored as ints carries decimal 'hi/lo' text
+            to_lsn(metadata.get('start_lsn'), legacy=True),
+            to_lsn(metadata.get('end_lsn'), legacy=True),
+            metadata.get('parent_backup_id'),
+            metadata.get('base_backup_id'),
+            metadata.get('chain_depth'),
+            metadata.get('changes_count') or 0,
+            metadata.get('size_bytes'),
+            json.dumps(metadata, default=list, separators=(',', ':'))
+        )
+
+    def _upsert(self, row: tuple, tables: List[str]):
+        self.conn.execute("DELETE FROM backups WHERE backup_id = ?", (row[0],))
+        self.conn.execute(
+            "INSERT INTO backups VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            row
+        )
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO backup_tables (table_name, backup_id) VALUES (?, ?)",
+            [(table, row[0]) for table in tables]
+        )
+
+    # Lookups
+
+    def _query(self, where: str = "1", params: tuple = (), order: str = "start_us", limit: int = None) -> List[dict]:
+        sql = f"SELECT metadata FROM backups WHERE {where} ORDER BY {order}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [json.loads(row['metadata']) for row in rows]
+
+    def _query_one(self, where: str, params: tuple = (), order: str = "start_us") -> Optional[dict]:
+        rows = self._query(where, params, order, limit=1)
+        return rows[0] if rows else None
+
+    def get(self, backup_id: str) -> Optional[dict]:
+        """Metadata of one segment"""
+        return self._query_one("backup_id = ?", (backup_id,))
+
+    def list_range(self, start_time: datetime = None, end_time: datetime = None) -> List[dict]:
+        """Segments that started within [start_time, end_time], oldest first"""
+        clauses, params = [], []
+        if start_time is not None:
+            clauses.append("start_us >= ?")
+            params.append(_to_us(start_time))
+        if end_time is not None:
+            clauses.append("start_us <= ?")
+            params.append(_to_us(end_time))
+        return self._query(" AND ".join(clauses) or "1", tuple(params))
+
+    def list_lsn_range(self, start_lsn=None, end_lsn=None) -> List[dict]:
+        """Segments whose LSN range overlaps [start_lsn, end_lsn], oldest first"""
+        clauses, params = ["start_lsn IS NOT NULL"], []
+        if start_lsn is not None:
+            clauses.append("end_lsn >= ?")
+            params.append(to_lsn(start_lsn))
+        if end_lsn is not None:
+            clauses.append("start_lsn <= ?")
+            params.append(to_lsn(end_lsn))
+        return self._query(" AND ".join(clauses), tuple(params))
+
+    def list_for_table(self, table: str, start_time: datetime = None, end_time: datetime = None) -> List[dict]:
+        """Segments containing changes to a table, oldest first"""
+        where = "backup_id IN (SELECT backup_id FROM backup_tables WHERE table_name = ?)"
+        params = [table]
+        if start_time is not None:
+            where += " AND start_us >= ?"
+            params.append(_to_us(start_time))
+        if end_time is not None:
+            where += " AND start_us <= ?"
+            params.append(_to_us(end_time))
+        return self._query(where, tuple(params))
+
+    def list_older_than(self, cutoff: datetime) -> List[dict]:
+        """Segments that started before cutoff"""
+        return self._query("start_us < ?", (_to_us(cutoff),))
+
+    def latest(self) -> Optional[dict]:
+        """Most recently ended segment"""
+        return self._query_one("1", order="COALESCE(end_us, start_us) DESC")
+
+    def latest_base_before(self, before_time: datetime) -> Optional[dict]:
+        """Most recent base segment that ended before before_time"""
+        return self._query_one(f"{_IS_BASE} AND end_us < ?", (_to_us(before_time),), order="end_us DESC")
+
+    def next_incremental(self, after_time: datetime, base_backup_id: str) -> Optional[dict]:
+        """Earliest incremental of a chain that started at or after after_time"""
+        return self._query_one(
+            f"base_backup_id = ? AND {_IS_INCREMENTAL} AND start_us >= ?",
+            (base_backup_id, _to_us(after_time))
+        )
+
+    def children(self, parent_backup_id: str) -> List[dict]:
+        """Segments whose parent is parent_backup_id"""
+        return self._query("parent_backup_id = ?", (parent_backup_id,))
+
+    def totals(self) -> dict:
+        """Segment count, change count and size of the whole catalog"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(changes_count), 0), COALESCE(SUM(size_bytes), 0) FROM backups"
+            ).fetchone()
+        return {'backups': row[0], 'changes': row[1], 'size_bytes': row[2]}
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM backups").fetchone()[0]
+
+    def __iter__(self) -> Iterator[dict]:
+        return iter(self._query())
+
+    # Migration
+
+    def _migrate_json(self):
+        """
+        Import backup_catalog.json and per-segment metadata files once
+
+        The JSON catalog is renamed to backup_catalog.json.migrated afterwards
+        so it is not mistaken for the live catalog.
+        """
+        with self.lock:
+            done = self.conn.execute(
+                "SELECT value FROM catalog_info WHERE key = 'json_migrated'"
+            ).fetchone()
+        if done:
+            return
+
+        entries = {}
+        catalog_file = self.metadata_dir / 'backup_catalog.json'
+        if catalog_file.exists():
+            try:
+                with open(catalog_file, 'r') as f:
+                    for entry in json.load(f):
+                        entries[entry['backup_id']] = entry
+            except Exception as e:
+                self.logger.error(f"Error reading {catalog_file.name} for migration: {e}")
+                return
+
+        # Segments finalized but missing from the JSON catalog (e.g. a crash
+        # between writing their metadata file and rewriting the catalog)
+        for metadata_file in self.metadata_dir.glob('*_metadata.json'):
+            try:
+                with open(metadata_file, 'r') as f:
+                    entry = json.load(f)
+                if entry.get('backup_id') and entry.get('filename') and entry.get('end_time'):
+                    entries.setdefault(entry['backup_id'], entry)
+            except Exception as e:
+                self.logger.warning(f"Skipping unreadable metadata file {metadata_file.name}: {e}")
+
+        imported = 0
+        with self.lock, self.conn:
+            for entry in entries.values():
+                try:
+                    self._upsert(self._row(entry), entry.get('tables_affected') or [])
+                    imported += 1
+                except Exception as e:
+                    self.logger.warning(f"Skipping catalog entry {entry.get('backup_id')}: {e}")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO catalog_info (key, value) VALUES ('json_migrated', ?)",
+                (datetime.now().isoformat(),)
+            )
+
+        if catalog_file.exists():
+            catalog_file.replace(catalog_file.with_name(catalog_file.name + '.migrated'))
+        if imported:
+            self.logger.info(f"Migrated {imported} backups into {self.path.name}")
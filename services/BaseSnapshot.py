@@ -0,0 +1,392 @@
+"""
+Base Snapshot
+Full-data base snapshots taken with COPY: worker connections share one
+exported snapshot and copy tables out in parallel, one (optionally
+block-compressed) file per table, next to a pg_dump of the schema
+"""
+
+import gzip
+import json
+import logging
+import os
+import queue
+import subprocess
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import psycopg2
+
+from .pitr_config import PITR_CONFIG, DB_CONFIG
+from .SegmentWriter import SegmentWriter
+
+
+# Files of a 'copy' snapshot directory
+SCHEMA_FILE = 'schema.dump'
+MANIFEST_FILE = 'manifest.json'
+
+
+def is_copy_snapshot(path) -> bool:
+    """Whether path is a 'copy' base snapshot directory"""
+    path = Path(path)
+    return path.is_dir() and (path / MANIFEST_FILE).exists()
+
+
+def _connect(target_db: str):
+    conn_params = DB_CONFIG.copy()
+    conn_params['dbname'] = target_db
+    return psycopg2.connect(**conn_params)
+
+
+def _run_parallel(worker: Callable[[object], None], connections: List, items: 'queue.Queue'):
+    """
+    Run worker(connection) on a thread per connection until items is empty
+
+    The first error stops every worker (they drain no more items) and is
+    raised once all threads have finished.
+    """
+    errors = []
+
+    def run(conn):
+        try:
+            worker(conn)
+        except BaseException as e:
+            errors.append(e)
+            # Leave nothing for the others to start
+            while True:
+                try:
+                    items.get_nowait()
+                except queue.Empty:
+                    break
+
+    threads = [
+        threading.Thread(target=run, args=(conn,), name=f"base-snapshot-{n}", daemon=True)
+        for n, conn in enumerate(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+class _CopySink:
+    """File-like target of COPY ... TO STDOUT counting rows and bytes"""
+
+    def __init__(self, writer: SegmentWriter):
+        self.writer = writer
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.writer.write_bytes(data)
+        # Text format: one row per line, newlines in values are escaped
+        self.rows += data.count(b'\n')
+        self.bytes += len(data)
+
+
+class BaseSnapshotDumper:
+    """
+    Copies every user table out of one snapshot on several connections.
+
+    Each worker connection opens a read-only REPEATABLE READ transaction
+    and adopts the same exported snapshot (SET TRANSACTION SNAPSHOT), so
+    all tables are read as of a single point, however long the copy takes.
+    Tables are handed out largest first and written in COPY text format,
+    one file per table, block-compressed with base_copy_compression. The
+    manifest next to them records each table's file, rows and bytes, and
+    the value of every sequence. Sequences are not transactional, so like
+    pg_dump they are read when the copy starts rather than as of the
+    snapshot. Large objects are not copied: a database holding any is
+    rejected, use the 'custom' or 'directory' format for it.
+
+    The snapshot is the one exported by a replication slot, which ties the
+    base to an LSN; it must stay exported until dump() returns.
+    """
+
+    def __init__(self, target_db: str, output_dir, workers: int = None, compressed: bool = None):
+        """
+        Args:
+            target_db: Database to copy
+            output_dir: Snapshot directory (created if missing)
+            workers: Worker connections (default base_backup_jobs)
+            compressed: Block-compress table files (default base_copy_compression)
+        """
+        self.target_db = target_db
+        self.output_dir = Path(output_dir)
+        self.workers = workers or PITR_CONFIG.get('base_backup_jobs', 4)
+        self.compressed = compressed if compressed is not None else PITR_CONFIG.get('base_copy_compression', True)
+        self.logger = logging.getLogger("BaseSnapshotDumper")
+
+        # Sequence values read by the last dump()
+        self.sequences: Dict[str, dict] = {}
+
+    def dump(self, snapshot_name: str) -> Dict[str, dict]:
+        """
+        Copy all tables as of a snapshot
+
+        Args:
+            snapshot_name: Exported snapshot to read
+
+        Returns:
+            {"schema.table": {"file", "relation", "rows", "bytes", "raw_bytes"}};
+            bytes is the size of the file, raw_bytes that of the COPY data
+
+        Raises:
+            RuntimeError: The database has large objects
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        connections = []
+        try:
+            for _ in range(max(1, self.workers)):
+                conn = _connect(self.target_db)
+                connections.append(conn)
+                conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+                with conn.cursor() as cur:
+                    # Must be the first statement of the transaction
+                    cur.execute("SET TRANSACTION SNAPSHOT %s", (snapshot_name,))
+
+            self._check_large_objects(connections[0])
+            tables = self._list_tables(connections[0])
+            self.sequences = sequences = self._read_sequences(connections[0])
+            suffix = '.copy.gz' if self.compressed else '.copy'
+            work = queue.Queue()
+            for n, (table, relation) in enumerate(tables, 1):
+                work.put((table, relation, f"{n:04d}{suffix}"))
+
+            copied: Dict[str, dict] = {}
+            lock = threading.Lock()
+
+            def worker(conn):
+                with conn.cursor() as cur:
+                    while True:
+                        try:
+                            table, relation, filename = work.get_nowait()
+                        except queue.Empty:
+                            return
+                        entry = self._copy_table(cur, relation, filename)
+                        with lock:
+                            copied[table] = entry
+
+            _run_parallel(worker, connections[:max(1, len(tables))], work)
+        finally:
+            for conn in connections:
+                conn.close()
+
+        # Largest first, as they were copied
+        copied = {table: copied[table] for table, _ in tables}
+        manifest = {
+            'snapshot': snapshot_name,
+            'compressed': self.compressed,
+            'tables': copied,
+            'sequences': sequences
+        }
+        with open(self.output_dir / MANIFEST_FILE, 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        self.logger.info(
+            f"Copied {len(copied)} tables, {sum(entry['rows'] for entry in copied.values())} rows, "
+            f"{len(sequences)} sequences on {min(len(connections), max(1, len(tables)))} connections"
+        )
+        return copied
+
+    def _list_tables(self, conn) -> List[tuple]:
+        """("schema.table", quoted relation) of the user tables, largest first"""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT n.nspname || '.' || c.relname,
+                       quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind = 'r'
+                  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                  AND n.nspname NOT LIKE 'pg_toast%'
+                  AND n.nspname NOT LIKE 'pg_temp%'
+                ORDER BY pg_relation_size(c.oid) DESC, 1
+            """)
+            return [tuple(row) for row in cur.fetchall()]
+
+    def _check_large_objects(self, conn):
+        """Refuse a database with large objects: COPY of its tables leaves them out"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM pg_largeobject_metadata")
+            count = cur.fetchone()[0]
+        if count:
+            raise RuntimeError(
+                f"Database {self.target_db} has {count} large objects, which the 'copy' format "
+                f"does not back up; use the 'custom' or 'directory' format"
+            )
+
+    def _read_sequences(self, conn) -> Dict[str, dict]:
+        """{"schema.sequence": {"relation", "last_value", "is_called"}} of the user sequences"""
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT n.nspname || '.' || c.relname,
+                       quote_ident(n.nspname) || '.' || quote_ident(c.relname)
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind = 'S'
+                  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+                  AND n.nspname NOT LIKE 'pg_temp%'
+                ORDER BY 1
+            """)
+            names = [tuple(row) for row in cur.fetchall()]
+            sequences = {}
+            for name, relation in names:
+                cur.execute(f"SELECT last_value, is_called FROM {relation}")
+                last_value, is_called = cur.fetchone()
+                sequences[name] = {'relation': relation, 'last_value': last_value, 'is_called': is_called}
+        return sequences
+
+    def _copy_table(self, cur, relation: str, filename: str) -> dict:
+        path = self.output_dir / filename
+        writer = SegmentWriter(path, compressed=self.compressed)
+        sink = _CopySink(writer)
+        try:
+            cur.copy_expert(f"COPY {relation} TO STDOUT", sink)
+        finally:
+            writer.close()
+        self.logger.debug(f"Copied {relation}: {sink.rows} rows, {sink.bytes} bytes")
+        return {
+            'file': filename,
+            'relation': relation,
+            'rows': sink.rows,
+            'bytes': writer.size,
+            'raw_bytes': sink.bytes
+        }
+
+
+class BaseSnapshotLoader:
+    """
+    Restores a 'copy' base snapshot.
+
+    The schema dump is restored in two passes around the data: tables and
+    types first (pg_restore --section=pre-data), then the table files are
+    loaded with COPY ... FROM STDIN on several connections, largest first,
+    each table in its own transaction, the sequences are set to their
+    recorded values (setval), and finally indexes, constraints and
+    triggers are built (--section=post-data, with pg_restore -j).
+    """
+
+    def __init__(self, target_db: str, workers: int = None):
+        """
+        Args:
+            target_db: Database to restore into
+            workers: Loading connections and pg_restore jobs (default base_restore_jobs)
+        """
+        self.target_db = target_db
+        self.workers = workers or PITR_CONFIG.get('base_restore_jobs') or os.cpu_count() or 1
+        self.logger = logging.getLogger("BaseSnapshotLoader")
+
+    def restore(self, path) -> dict:
+        """
+        Restore schema and data of a snapshot directory
+
+        Returns:
+            Dictionary with the tables and rows loaded
+        """
+        path = Path(path)
+        with open(path / MANIFEST_FILE, 'r') as f:
+            manifest = json.load(f)
+
+        self._pg_restore(path / SCHEMA_FILE, ['--clean', '--if-exists', '--section=pre-data'])
+        rows = self.load(path, manifest)
+        sequences = self.set_sequences(manifest)
+        self._pg_restore(path / SCHEMA_FILE, ['--section=post-data', '-j', str(self.workers)])
+
+        self.logger.info(
+            f"Restored {len(manifest['tables'])} tables, {rows} rows, {sequences} sequences from {path.name}"
+        )
+        return {'tables': len(manifest['tables']), 'rows': rows, 'sequences': sequences}
+
+    def load(self, path: Path, manifest: dict) -> int:
+        """
+        COPY the table files of a snapshot into existing, empty tables
+
+        Returns:
+            Number of rows loaded
+        """
+        tables = sorted(manifest['tables'].values(), key=lambda entry: entry['bytes'], reverse=True)
+        work = queue.Queue()
+        for entry in tables:
+            work.put(entry)
+
+        loaded = [0]
+        lock = threading.Lock()
+
+        def worker(conn):
+            conn.autocommit = False
+            with conn.cursor() as cur:
+                # A failed restore is re-run, not recovered: don't wait for the WAL flush at each commit
+                cur.execute("SET synchronous_commit TO off")
+                while True:
+                    try:
+                        entry = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    file_path = path / entry['file']
+                    opener = gzip.open if file_path.suffix == '.gz' else open
+                    with opener(file_path, 'rb') as f:
+                        cur.copy_expert(f"COPY {entry['relation']} FROM STDIN", f)
+                    conn.commit()
+                    if cur.rowcount not in (-1, entry['rows']):
+                        self.logger.warning(
+                            f"{entry['relation']}: loaded {cur.rowcount} rows, snapshot has {entry['rows']}"
+                        )
+                    with lock:
+                        loaded[0] += entry['rows']
+
+        connections = []
+        try:
+            for _ in range(max(1, min(self.workers, len(tables)))):
+                connections.append(_connect(self.target_db))
+            _run_parallel(worker, connections, work)
+        finally:
+            for conn in connections:
+                conn.close()
+        return loaded[0]
+
+    def set_sequences(self, manifest: dict) -> int:
+        """
+        Set the sequences to the values recorded in the manifest
+
+        Returns:
+            Number of sequences set
+        """
+        # Snapshots taken before sequences were recorded have none
+        sequences = manifest.get('sequences', {})
+        if not sequences:
+            return 0
+        conn = _connect(self.target_db)
+        try:
+            with conn.cursor() as cur:
+                for entry in sequences.values():
+                    cur.execute(
+                        "SELECT setval(%s, %s, %s)",
+                        (entry['relation'], entry['last_value'], entry['is_called'])
+                    )
+            conn.commit()
+        finally:
+            conn.close()
+        return len(sequences)
+
+    def _pg_restore(self, archive: Path, options: List[str]):
+        cmd = [
+            'pg_restore',
+            '-h', DB_CONFIG['host'],
+            '-p', str(DB_CONFIG['port']),
+            '-U', DB_CONFIG['user'],
+            '-d', self.target_db
+        ] + options + [str(archive)]
+
+        env = os.environ.copy()
+        if DB_CONFIG.get('password'):
+            env['PGPASSWORD'] = DB_CONFIG['password']
+
+        try:
+            subprocess.run(cmd, env=env, check=True, capture_output=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"pg_restore {' '.join(options)} failed: {e.stderr.decode(errors='replace')}")
@@ -0,0 +1,450 @@
+"""
+Block-indexed Binary Segment Format
+Compact, length-prefixed change records in fixed-size blocks with a footer
+index, so restores can seek to the blocks covering an LSN or time range
+
+Layout:
+    header   MAGIC, block size (u32)
+    blocks   block_size bytes each (zero padded); a record never spans two
+             blocks, a record larger than a block gets a block of its own
+    footer   JSON index: tables and per-block offset / LSN / time / table ranges
+    trailer  footer offset (u64), footer length (u32), TRAILER_MAGIC
+
+Every record is a u32 length followed by the payload. The first payload
+byte is the record kind: a table definition ('T') that assigns a table ID
+the first time a table appears, or a change ('C'). Table definitions are
+inline so a segment that was never sealed can still be read by scanning.
+
+A segment can also be block-compressed (see BlockCompression). Each binary
+block then starts a new gzip block, so reading a selected block only
+decompresses the gzip blocks that hold it.
+"""
+
+import json
+import logging
+import mmap
+import struct
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from .pitr_config import PITR_CONFIG
+from .BlockCompression import BlockCompressedReader, is_block_compressed
+from .LSN import parse_lsn
+
+
+MAGIC = b'CDCBSEG1'
+TRAILER_MAGIC = b'CDCBIDX1'
+
+_HEADER = struct.Struct('<8sI')
+_LENGTH = struct.Struct('<I')
+_TABLE = struct.Struct('<cH')
+# kind, lsn, timestamp (us since 1970-01-01, naive), txid, table id, operation
+_CHANGE = struct.Struct('<cQqIHB')
+_TRAILER = struct.Struct('<QI8s')
+
+_KIND_TABLE = b'T'
+_KIND_CHANGE = b'C'
+
+OPERATIONS = ('UNKNOWN', 'INSERT', 'UPDATE', 'DELETE', 'TRUNCATE')
+_OPERATION_CODES = {name: code for code, name in enumerate(OPERATIONS)}
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _timestamp_to_us(value) -> int:
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - _EPOCH) // _ONE_MICROSECOND
+
+
+def _us_to_timestamp(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def _new_block(offset: int) -> dict:
+    return {
+        'offset': offset,
+        'length': 0,
+        'count': 0,
+        'min_lsn': 0,
+        'max_lsn': 0,
+        'min_ts': 0,
+        'max_ts': 0,
+        'tables': []
+    }
+
+
+def _add_to_block(block: dict, lsn: int, timestamp: int, table_id: int):
+    """Extend a block's index entry with one change"""
+    if block['count'] == 0:
+        block['min_lsn'] = block['max_lsn'] = lsn
+        block['min_ts'] = block['max_ts'] = timestamp
+    else:
+        # Changes are in commit order, so LSNs and times are not monotonic
+        if lsn < block['min_lsn']:
+            block['min_lsn'] = lsn
+        elif lsn > block['max_lsn']:
+            block['max_lsn'] = lsn
+        if timestamp < block['min_ts']:
+            block['min_ts'] = timestamp
+        elif timestamp > block['max_ts']:
+            block['max_ts'] = timestamp
+    block['count'] += 1
+    if table_id not in block['tables']:
+        block['tables'].append(table_id)
+
+
+class BinarySegmentWriter:
+    """
+    Encodes change records into a binary segment through a SegmentWriter.
+
+    Records go straight to the underlying writer, so a flushed or fsynced
+    segment is always a readable prefix. The block index is kept in memory
+    and written as the footer by seal().
+    """
+
+    def __init__(self, segment_writer, block_size: int = None):
+        """
+        Args:
+            segment_writer: Open SegmentWriter for the segment file
+            block_size: Block size in bytes
+        """
+        self.writer = segment_writer
+        self.block_size = block_size or PITR_CONFIG.get('binary_block_size', 64 * 1024)
+
+        self.tables: Dict[str, int] = {}
+        self.blocks: List[dict] = []
+        self.block: Optional[dict] = None
+        self.sealed = False
+
+        if not self.writer.is_new:
+            raise ValueError(f"Binary segment {self.writer.path.name} already exists")
+        self.writer.write_bytes(_HEADER.pack(MAGIC, self.block_size))
+        self.writer.end_block()
+        self.position = _HEADER.size
+
+    def append(self, change: dict):
+        """Encode and append one change record"""
+        table_name = change['table']
+        table_id = self.tables.get(table_name)
+        if table_id is None:
+            table_id = len(self.tables)
+            self.tables[table_name] = table_id
+            self._append_record(_TABLE.pack(_KIND_TABLE, table_id) + table_name.encode('utf-8'))
+
+        lsn = parse_lsn(change['lsn'])
+        timestamp = _timestamp_to_us(change['timestamp'])
+        payload = _CHANGE.pack(
+            _KIND_CHANGE,
+            lsn,
+            timestamp,
+            change['txid'] & 0xFFFFFFFF,
+            table_id,
+            _OPERATION_CODES.get(change['operation'], 0)
+        ) + json.dumps([change['data'], change.get('old_data')], separators=(',', ':')).encode('utf-8')
+
+        _add_to_block(self._append_record(payload), lsn, timestamp, table_id)
+
+    def _append_record(self, payload: bytes) -> dict:
+        """Write a length-prefixed record, starting a new block if it does not fit"""
+        record_size = _LENGTH.size + len(payload)
+        block = self.block
+
+        if block is None or block['length'] + record_size > self.block_size:
+            if block is not None:
+                self._close_block()
+            block = self.block = _new_block(self.position)
+
+        self.writer.write_bytes(_LENGTH.pack(len(payload)) + payload)
+        block['length'] += record_size
+        self.position += record_size
+        return block
+
+    def _close_block(self):
+        """Pad the current block to the next block boundary"""
+        block = self.block
+        used = block['length']
+        padded = max(self.block_size, -(-used // self.block_size) * self.block_size)
+        if padded > used:
+            self.writer.write_bytes(bytes(padded - used))
+            self.position += padded - used
+        self.blocks.append(block)
+        self.block = None
+        # Keep compressed blocks aligned with binary blocks
+        self.writer.end_block()
+
+    def seal(self):
+        """Write the footer index and trailer; no records may follow"""
+        if self.sealed:
+            return
+        if self.block is not None:
+            # The last block is not padded, the footer follows it directly
+            self.blocks.append(self.block)
+            self.block = None
+
+        footer = json.dumps({
+            'block_size': self.block_size,
+            'tables': sorted(self.tables, key=self.tables.get),
+            'blocks': self.blocks
+        }, separators=(',', ':')).encode('utf-8')
+
+        footer_offset = self.position
+        self.writer.write_bytes(footer + _TRAILER.pack(footer_offset, len(footer), TRAILER_MAGIC))
+        self.position += len(footer) + _TRAILER.size
+        self.sealed = True
+
+
+class BinarySegmentReader:
+    """
+    Reads a binary segment through mmap.
+
+    With a footer only the blocks overlapping the requested LSN / time /
+    table range are decoded. Segments without a footer (still open, or not
+    sealed because of a crash) are indexed by scanning the blocks once.
+    Block-compressed segments are read through a BlockCompressedReader:
+    selected blocks are decompressed in parallel batches, unsealed ones are
+    decompressed in full before scanning.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.logger = logging.getLogger("BinarySegmentReader")
+        self.tables: List[str] = []
+        self.blocks: List[dict] = []
+        self.sealed = False
+        self.mmap = None
+        self.compressed_reader: Optional[BlockCompressedReader] = None
+
+        if is_block_compressed(self.path):
+            self.compressed_reader = BlockCompressedReader(self.path)
+            size = self.compressed_reader.size
+            header = self.compressed_reader.read_range(0, _HEADER.size)
+        else:
+            with open(self.path, 'rb') as f:
+                size = f.seek(0, 2)
+                if size >= _HEADER.size:
+                    self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            header = self.mmap
+
+        if size < _HEADER.size:
+            # Created but nothing written yet
+            self.buffer = memoryview(b'')
+            self.size = 0
+            return
+
+        self.size = size
+        self.buffer = memoryview(self.mmap) if self.mmap is not None else None
+        magic, self.block_size = _HEADER.unpack_from(header, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{self.path.name} is not a binary CDC segment")
+
+        if not self._load_footer():
+            if self.buffer is None:
+                self.buffer = memoryview(self.compressed_reader.read_all())
+            self._scan()
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.release()
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.compressed_reader is not None:
+            self.compressed_reader.close()
+            self.compressed_reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _read(self, offset: int, length: int):
+        """Uncompressed bytes of the segment"""
+        if self.buffer is not None:
+            return self.buffer[offset:offset + length]
+        return self.compressed_reader.read_range(offset, length)
+
+    def _load_footer(self) -> bool:
+        size = self.size
+        if size < _HEADER.size + _TRAILER.size:
+            return False
+
+        footer_offset, footer_length, magic = _TRAILER.unpack_from(self._read(size - _TRAILER.size, _TRAILER.size), 0)
+        if magic != TRAILER_MAGIC or footer_offset + footer_length + _TRAILER.size != size:
+            return False
+
+        footer = json.loads(bytes(self._read(footer_offset, footer_length)))
+        self.tables = footer['tables']
+        self.blocks = footer['blocks']
+        self.sealed = True
+        return True
+
+    def _scan(self):
+        """Rebuild the table dictionary and block index from the records"""
+        for block in self._scan_blocks():
+            self.blocks.append(block)
+        self.logger.info(f"Indexed unsealed segment {self.path.name} ({len(self.blocks)} blocks)")
+
+    def _scan_blocks(self) -> Iterator[dict]:
+        buf = self.buffer
+        end = len(buf)
+        offset = _HEADER.size
+        block_size = self.block_size
+        block = None
+        block_end = offset
+
+        while offset + _LENGTH.size <= end:
+            if offset >= block_end:
+                if block is not None:
+                    yield block
+                block = _new_block(offset)
+                block_end = offset + block_size
+
+            if block_end - offset < _LENGTH.size:
+                # Padding too short to hold a length prefix
+                offset = block_end
+                continue
+            (length,) = _LENGTH.unpack_from(buf, offset)
+            if length == 0:
+                # Padding: the rest of this block is empty
+                offset = block_end
+                continue
+            if offset + _LENGTH.size + length > end:
+                # Torn tail of an unsealed segment
+                break
+
+            payload_offset = offset + _LENGTH.size
+            kind = bytes(buf[payload_offset:payload_offset + 1])
+            if kind == _KIND_TABLE:
+                _, table_id = _TABLE.unpack_from(buf, payload_offset)
+                name = bytes(buf[payload_offset + _TABLE.size:payload_offset + length]).decode('utf-8')
+                while len(self.tables) <= table_id:
+                    self.tables.append(None)
+                self.tables[table_id] = name
+            elif kind == _KIND_CHANGE:
+                _, lsn, timestamp, _, table_id, _ = _CHANGE.unpack_from(buf, payload_offset)
+                _add_to_block(block, lsn, timestamp, table_id)
+            else:
+                raise ValueError(f"Unknown record kind {kind!r} at offset {offset}")
+
+            offset = payload_offset + length
+            # An oversized record owns its block; the next record starts on a boundary
+            if offset > block_end:
+                block_end = block['offset'] + -(-(offset - block['offset']) // block_size) * block_size
+            block['length'] = offset - block['offset']
+
+        if block is not None and block['length']:
+            yield block
+
+    def select_blocks(
+        self,
+        start_lsn: int = None,
+        end_lsn: int = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        tables: List[str] = None
+    ) -> List[dict]:
+        """Get the index entries of blocks that may contain matching changes"""
+        start_ts = _timestamp_to_us(start_time) if start_time else None
+        end_ts = _timestamp_to_us(end_time) if end_time else None
+        table_ids = None
+        if tables:
+            table_ids = {table_id for table_id, name in enumerate(self.tables) if name in tables}
+
+        selected = []
+        for block in self.blocks:
+            if not block['count']:
+                continue
+            if start_lsn is not None and block['max_lsn'] < start_lsn:
+                continue
+            if end_lsn is not None and block['min_lsn'] > end_lsn:
+                continue
+            if start_ts is not None and block['max_ts'] < start_ts:
+                continue
+            if end_ts is not None and block['min_ts'] > end_ts:
+                continue
+            if table_ids is not None and table_ids.isdisjoint(block['tables']):
+                continue
+            selected.append(block)
+        return selected
+
+    def read_changes(
+        self,
+        start_lsn: int = None,
+        end_lsn: int = None,
+        start_time: datetime = None,
+        end_time: datetime = None,
+        tables: List[str] = None
+    ) -> Iterator[dict]:
+        """
+        Yield change records within the given ranges, in file order
+
+        Args:
+            start_lsn: Lowest LSN to return (inclusive)
+            end_lsn: Highest LSN to return (inclusive)
+            start_time: Earliest change timestamp (inclusive)
+            end_time: Latest change timestamp (inclusive)
+            tables: Only return changes of these tables
+        """
+        start_ts = _timestamp_to_us(start_time) if start_time else None
+        end_ts = _timestamp_to_us(end_time) if end_time else None
+        filters = (start_lsn, end_lsn, start_ts, end_ts, tables)
+        selected = self.select_blocks(start_lsn, end_lsn, start_time, end_time, tables)
+
+        if self.buffer is not None:
+            for block in selected:
+                yield from self._decode_block(self.buffer, block['offset'], block['length'], filters)
+            return
+
+        # Decompress a bounded batch of blocks at a time, in parallel
+        batch_size = max(1, self.compressed_reader.workers * 4)
+        for batch_start in range(0, len(selected), batch_size):
+            batch = selected[batch_start:batch_start + batch_size]
+            ranges = [(block['offset'], block['length']) for block in batch]
+            for data in self.compressed_reader.read_ranges(ranges):
+                yield from self._decode_block(data, 0, len(data), filters)
+
+    def _decode_block(self, buf, offset: int, size: int, filters: tuple) -> Iterator[dict]:
+        """Decode the matching change records of one block held in buf"""
+        start_lsn, end_lsn, start_ts, end_ts, tables = filters
+        table_names = self.tables
+        block_end = offset + size
+
+        while offset < block_end:
+            (length,) = _LENGTH.unpack_from(buf, offset)
+            if length == 0:
+                break
+            payload_offset = offset + _LENGTH.size
+            offset = payload_offset + length
+
+            if buf[payload_offset] != _KIND_CHANGE[0]:
+                continue
+
+            _, lsn, timestamp, txid, table_id, operation = _CHANGE.unpack_from(buf, payload_offset)
+            if start_lsn is not None and lsn < start_lsn:
+                continue
+            if end_lsn is not None and lsn > end_lsn:
+                continue
+            if start_ts is not None and timestamp < start_ts:
+                continue
+            if end_ts is not None and timestamp > end_ts:
+                continue
+            table_name = table_names[table_id]
+            if tables and table_name not in tables:
+                continue
+
+            data, old_data = json.loads(bytes(buf[payload_offset + _CHANGE.size:offset]))
+            yield {
+                'lsn': lsn,
+                'txid': txid,
+                'timestamp': _us_to_timestamp(timestamp),
+                'table': table_name,
+                'operation': OPERATIONS[operation],
+                'data': data,
+                'old_data': old_data
+            }
@@ -0,0 +1,356 @@
+"""
+Binary Transaction Log
+Fixed-width records of completed transactions, appended in commit order
+next to the JSON transaction log, so lookups by commit LSN or commit time
+are binary searches over an mmap with no JSON parsing
+
+Layout of transactions_YYYYMMDD.txb:
+    header   MAGIC, record size (u32), reserved (u32), size of the JSON log
+             the records cover (u64, updated when the writer closes)
+    records  txid, start LSN, end LSN, start / end time (us since
+             1970-01-01, naive), change count, table set ID, status
+
+Sets of affected tables are interned per file: each new set is appended to
+transactions_YYYYMMDD.txb.tables as a JSON line [id, [tables]] before the
+first record that uses it. ID 0 is the empty set.
+"""
+
+import json
+import logging
+import mmap
+import struct
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .pitr_config import PITR_CONFIG
+from .LSN import INVALID_LSN, to_lsn
+
+
+MAGIC = b'CDCTXLG1'
+TABLES_SUFFIX = '.tables'
+
+_HEADER = struct.Struct('<8sIIQ')
+_LOG_SIZE_OFFSET = 16
+# txid, start lsn, end lsn, start us, end us, changes, table set id, status
+_RECORD = struct.Struct('<qQQqqIIB7x')
+_END_LSN = struct.Struct('<Q')
+_END_LSN_OFFSET = 16
+_END_TIME = struct.Struct('<q')
+_END_TIME_OFFSET = 32
+
+STATUSES = ('ACTIVE', 'COMMITTED', 'ROLLED_BACK')
+_STATUS_CODES = {name: code for code, name in enumerate(STATUSES)}
+_COMMITTED = _STATUS_CODES['COMMITTED']
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def _timestamp_to_us(value) -> int:
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - _EPOCH) // _ONE_MICROSECOND
+
+
+def _us_to_timestamp(value: int) -> str:
+    return (_EPOCH + timedelta(microseconds=value)).isoformat()
+
+
+def tables_path(path: Path) -> Path:
+    """Path of the table set file of a binary transaction log"""
+    path = Path(path)
+    return path.with_name(path.name + TABLES_SUFFIX)
+
+
+def _load_table_sets(path: Path) -> Dict[int, List[str]]:
+    table_sets = {0: []}
+    if path.exists():
+        with open(path, 'r') as f:
+            for line in f:
+                if line.endswith('\n'):
+                    table_set_id, tables = json.loads(line)
+                    table_sets[table_set_id] = tables
+    return table_sets
+
+
+class BinaryTransactionLogWriter:
+    """
+    Appends completed transactions to a binary transaction log.
+
+    Records are packed into a batch and written batch_records at a time;
+    flush() writes a partial batch. A batch lost in a crash is detected by
+    the log size in the header and re-appended from the JSON log (see
+    TransactionLogManager).
+    """
+
+    def __init__(self, path: Path, batch_records: int = None):
+        """
+        Args:
+            path: Binary log file (appended to if it already exists)
+            batch_records: Records buffered per write
+        """
+        self.path = Path(path)
+        self.batch_records = batch_records or PITR_CONFIG.get('transaction_log_batch_records', 64)
+        self.logger = logging.getLogger("BinaryTransactionLogWriter")
+
+        table_sets = _load_table_sets(tables_path(self.path))
+        self.table_set_ids: Dict[Tuple[str, ...], int] = {
+            tuple(tables): table_set_id for table_set_id, tables in table_sets.items()
+        }
+        self.tables_file = open(tables_path(self.path), 'a')
+
+        self.file = open(self.path, 'ab')
+        size = self.file.tell()
+        if size < _HEADER.size:
+            self.file.truncate(0)
+            self.file.write(_HEADER.pack(MAGIC, _RECORD.size, 0, 0))
+            size = _HEADER.size
+        else:
+            with open(self.path, 'rb') as f:
+                magic, record_size, _, _ = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC or record_size != _RECORD.size:
+                self.file.close()
+                self.tables_file.close()
+                raise ValueError(f"{self.path.name} is not a binary transaction log")
+        self.records = (size - _HEADER.size) // _RECORD.size
+        torn = (size - _HEADER.size) % _RECORD.size
+        if torn:
+            # Torn last record of a crashed writer
+            self.file.truncate(size - torn)
+
+        self.pending = bytearray()
+        self.pending_records = 0
+        self.closed = False
+
+    def __len__(self) -> int:
+        return self.records + self.pending_records
+
+    def _table_set_id(self, tables) -> int:
+        key = tuple(sorted(tables or ()))
+        table_set_id = self.table_set_ids.get(key)
+        if table_set_id is None:
+            table_set_id = len(self.table_set_ids)
+            self.table_set_ids[key] = table_set_id
+            # Written ahead of any record that refers to it
+            self.tables_file.write(json.dumps([table_set_id, list(key)]) + '\n')
+            self.tables_file.flush()
+        return table_set_id
+
+    def append(self, record: dict):
+        """
+        Add a completed transaction to the current batch
+
+        Args:
+            record: COMMITTED or ROLLED_BACK transaction log record
+        """
+        self.pending += _RECORD.pack(
+            record['txid'],
+            to_lsn(record.get('start_lsn'), legacy=True) or INVALID_LSN,
+            to_lsn(record.get('end_lsn'), legacy=True) or INVALID_LSN,
+            _timestamp_to_us(record['start_timestamp']),
+            _timestamp_to_us(record['end_timestamp']),
+            record.get('changes_count', 0),
+            self._table_set_id(record.get('tables_affected')),
+            _STATUS_CODES[record['status']]
+        )
+        self.pending_records += 1
+        if self.pending_records >= self.batch_records:
+            self.flush()
+
+    def flush(self):
+        """Write the pending batch"""
+        if self.pending:
+            self.file.write(self.pending)
+            self.file.flush()
+            self.records += self.pending_records
+            self.pending.clear()
+            self.pending_records = 0
+
+    def close(self, log_size: int = None):
+        """
+        Flush and close the log
+
+        Args:
+            log_size: Size of the JSON log the records now cover; recorded in
+                the header so readers can tell the binary log is complete
+        """
+        if self.closed:
+            return
+        self.flush()
+        self.file.close()
+        self.tables_file.close()
+        if log_size is not None:
+            with open(self.path, 'r+b') as f:
+                f.seek(_LOG_SIZE_OFFSET)
+                f.write(struct.pack('<Q', log_size))
+        self.closed = True
+
+
+class BinaryTransactionLog:
+    """
+    Reads a binary transaction log through mmap.
+
+    Records are in commit order, so they are sorted by commit LSN and
+    lookups by LSN are exact binary searches. Lookups by commit time
+    binary-search the same order, as PostgreSQL's recovery_target_time
+    does: commit timestamps of concurrent transactions can be out of order
+    by a few microseconds. The txid hash is built on the first get().
+
+    Offers the query methods of TransactionIndex, with record numbers as
+    positions.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.mmap = None
+        self.count = 0
+        self.log_size = 0
+        self.by_txid: Optional[Dict[int, int]] = None
+
+        with open(self.path, 'rb') as f:
+            size = f.seek(0, 2)
+            if size >= _HEADER.size:
+                self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap is None:
+            return
+
+        magic, record_size, _, self.log_size = _HEADER.unpack_from(self.mmap, 0)
+        if magic != MAGIC or record_size != _RECORD.size:
+            self.close()
+            raise ValueError(f"{self.path.name} is not a binary transaction log")
+        self.count = (size - _HEADER.size) // _RECORD.size
+        self.table_sets = _load_table_sets(tables_path(self.path))
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _unpack(self, position: int) -> tuple:
+        return _RECORD.unpack_from(self.mmap, _HEADER.size + position * _RECORD.size)
+
+    def _bisect_right(self, field: struct.Struct, field_offset: int, value: int) -> int:
+        """Number of leading records whose field is <= value"""
+        low, high = 0, self.count
+        base = _HEADER.size + field_offset
+        while low < high:
+            middle = (low + high) // 2
+            if field.unpack_from(self.mmap, base + middle * _RECORD.size)[0] <= value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _last_commit_in(self, end: int) -> Optional[int]:
+        """Last committed record before record number end"""
+        for position in range(end - 1, -1, -1):
+            if self._unpack(position)[7] == _COMMITTED:
+                return position
+        return None
+
+    # Lookups
+
+    def record(self, position: int) -> dict:
+        """Transaction log record of a position"""
+        txid, start_lsn, end_lsn, start_us, end_us, changes, table_set_id, status = self._unpack(position)
+        return {
+            'txid': txid,
+            'start_lsn': start_lsn or None,
+            'start_timestamp': _us_to_timestamp(start_us),
+            'status': STATUSES[status],
+            'changes_count': changes,
+            'tables_affected': list(self.table_sets.get(table_set_id, [])),
+            'end_lsn': end_lsn,
+            'end_timestamp': _us_to_timestamp(end_us)
+        }
+
+    def get(self, txid: int) -> Optional[dict]:
+        """Record of a completed transaction"""
+        if self.by_txid is None:
+            self.by_txid = {
+                record[0]: position
+                for position, record in enumerate(_RECORD.iter_unpack(
+                    self.mmap[_HEADER.size:_HEADER.size + self.count * _RECORD.size]
+                ))
+            } if self.count else {}
+        position = self.by_txid.get(txid)
+        return self.record(position) if position is not None else None
+
+    def commits_in_time_range(self, start_time: datetime = None, end_time: datetime = None) -> List[int]:
+        """Positions of commits with start_time <= commit time <= end_time, in commit order"""
+        low = self._bisect_right(_END_TIME, _END_TIME_OFFSET, _timestamp_to_us(start_time) - 1) if start_time is not None else 0
+        high = self._bisect_right(_END_TIME, _END_TIME_OFFSET, _timestamp_to_us(end_time)) if end_time is not None else self.count
+        return [position for position in range(low, high) if self._unpack(position)[7] == _COMMITTED]
+
+    def last_commit_before(self, end_time: datetime) -> Optional[int]:
+        """Position of the last commit with commit time <= end_time"""
+        return self._last_commit_in(self._bisect_right(_END_TIME, _END_TIME_OFFSET, _timestamp_to_us(end_time)))
+
+    def last_commit_at_or_before(self, lsn: int) -> Optional[int]:
+        """Position of the last commit with commit LSN <= lsn"""
+        return self._last_commit_in(self._bisect_right(_END_LSN, _END_LSN_OFFSET, lsn))
+
+    def commit_lsns(self, max_lsn: int) -> Dict[int, int]:
+        """txid -> commit LSN of the commits with commit LSN <= max_lsn"""
+        end = self._bisect_right(_END_LSN, _END_LSN_OFFSET, max_lsn)
+        if not end:
+            return {}
+        records = _RECORD.iter_unpack(self.mmap[_HEADER.size:_HEADER.size + end * _RECORD.size])
+        return {record[0]: record[2] for record in records if record[7] == _COMMITTED}
+
+    def commit_time_us(self, position: int) -> int:
+        return self._unpack(position)[4]
+
+    def summary(self) -> dict:
+        """Time, LSN and txid ranges and counts of the day, in one pass"""
+        committed = rolled_back = changes = 0
+        first_us = last_us = first_lsn = last_lsn = min_txid = max_txid = None
+        records = _RECORD.iter_unpack(self.mmap[_HEADER.size:_HEADER.size + self.count * _RECORD.size]) if self.count else ()
+        for txid, _, end_lsn, _, end_us, changes_count, _, status in records:
+            changes += changes_count
+            if min_txid is None or txid < min_txid:
+                min_txid = txid
+            if max_txid is None or txid > max_txid:
+                max_txid = txid
+            if status != _COMMITTED:
+                rolled_back += 1
+                continue
+            committed += 1
+            if first_lsn is None:
+                first_lsn = end_lsn
+            last_lsn = end_lsn
+            if first_us is None or end_us < first_us:
+                first_us = end_us
+            if last_us is None or end_us > last_us:
+                last_us = end_us
+        return {
+            'log_size': self.log_size,
+            'transactions': self.count,
+            'committed': committed,
+            'rolled_back': rolled_back,
+            'changes': changes,
+            'first_commit_us': first_us,
+            'last_commit_us': last_us,
+            'first_commit_lsn': first_lsn,
+            'last_commit_lsn': last_lsn,
+            'min_txid': min_txid,
+            'max_txid': max_txid
+        }
+
+    def recovery_points(self, positions: Iterable[int]) -> List[dict]:
+        """Recovery point dicts for commit positions"""
+        points = []
+        for position in positions:
+            record = self.record(position)
+            points.append({
+                'txid': record['txid'],
+                'timestamp': record['end_timestamp'],
+                'lsn': record['end_lsn'],
+                'changes_count': record['changes_count'],
+                'tables_affected': record['tables_affected']
+            })
+        return points
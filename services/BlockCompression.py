@@ -0,0 +1,280 @@
+"""
+Block Compression
+BGZF-style gzip for backup segments: every block is an independent gzip
+member that records its own compressed size in a header extra field, so
+readers can seek to any block and decompress blocks in parallel. The file
+remains a valid multi-member gzip stream for gzip/zcat/psql pipelines.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .pitr_config import PITR_CONFIG
+
+
+# ID1 ID2 CM FLG MTIME XFL OS XLEN | SI1 SI2 SLEN BSIZE
+_MEMBER_HEADER = struct.Struct('<BBBBIBBH2sHI')
+_MEMBER_TRAILER = struct.Struct('<II')  # CRC32, ISIZE
+_SUBFIELD_ID = b'CS'
+_FLAG_EXTRA = 0x04
+
+INDEX_SUFFIX = '.idx'
+
+
+def compress_block(data: bytes, level: int = None) -> bytes:
+    """
+    Compress one block into a self-describing gzip member
+
+    Args:
+        data: Uncompressed block
+        level: zlib compression level
+
+    Returns:
+        Complete gzip member with its total size in the 'CS' extra subfield
+    """
+    if level is None:
+        level = PITR_CONFIG.get('compression_level', 6)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    body = compressor.compress(data) + compressor.flush()
+    member_size = _MEMBER_HEADER.size + len(body) + _MEMBER_TRAILER.size
+    header = _MEMBER_HEADER.pack(
+        0x1F, 0x8B, 8, _FLAG_EXTRA, 0, 0, 255, 8,
+        _SUBFIELD_ID, 4, member_size
+    )
+    trailer = _MEMBER_TRAILER.pack(zlib.crc32(data), len(data) & 0xFFFFFFFF)
+    return header + body + trailer
+
+
+def read_member_size(buf, offset: int) -> Optional[int]:
+    """Get the total size of the block member at offset, or None if it is not one"""
+    if offset + _MEMBER_HEADER.size > len(buf):
+        return None
+    id1, id2, method, flags, _, _, _, xlen, subfield, slen, size = _MEMBER_HEADER.unpack_from(buf, offset)
+    if id1 != 0x1F or id2 != 0x8B or method != 8 or not flags & _FLAG_EXTRA:
+        return None
+    if xlen != 8 or subfield != _SUBFIELD_ID or slen != 4:
+        return None
+    return size
+
+
+def is_block_compressed(path: Path) -> bool:
+    """True if the file starts with a block-compressed gzip member"""
+    try:
+        with open(path, 'rb') as f:
+            return read_member_size(f.read(_MEMBER_HEADER.size), 0) is not None
+    except OSError:
+        return False
+
+
+def index_path(path: Path) -> Path:
+    """Path of the block index written next to a sealed segment"""
+    path = Path(path)
+    return path.with_name(path.name + INDEX_SUFFIX)
+
+
+class BlockIndex:
+    """
+    Offsets of the blocks in a block-compressed file
+
+    Each entry is (compressed offset, uncompressed offset); sizes follow from
+    the next entry and the totals.
+    """
+
+    def __init__(self):
+        self.compressed_offsets: List[int] = []
+        self.uncompressed_offsets: List[int] = []
+        self.compressed_size = 0
+        self.uncompressed_size = 0
+
+    def add(self, compressed_length: int, uncompressed_length: int):
+        self.compressed_offsets.append(self.compressed_size)
+        self.uncompressed_offsets.append(self.uncompressed_size)
+        self.compressed_size += compressed_length
+        self.uncompressed_size += uncompressed_length
+
+    def __len__(self) -> int:
+        return len(self.compressed_offsets)
+
+    def block_range(self, index: int) -> Tuple[int, int]:
+        """Compressed (offset, length) of a block"""
+        start = self.compressed_offsets[index]
+        end = self.compressed_offsets[index + 1] if index + 1 < len(self) else self.compressed_size
+        return start, end - start
+
+    def blocks_for(self, offset: int, length: int) -> range:
+        """Indices of the blocks holding uncompressed bytes [offset, offset + length)"""
+        first = max(0, bisect_right(self.uncompressed_offsets, offset) - 1)
+        last = max(first, bisect_right(self.uncompressed_offsets, offset + max(length, 1) - 1) - 1)
+        return range(first, last + 1)
+
+    def save(self, path: Path):
+        """Write the index atomically"""
+        tmp_path = Path(str(path) + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'compressed_size': self.compressed_size,
+                'uncompressed_size': self.uncompressed_size,
+                'blocks': list(zip(self.compressed_offsets, self.uncompressed_offsets))
+            }, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'BlockIndex':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        index = cls()
+        for compressed_offset, uncompressed_offset in data['blocks']:
+            index.compressed_offsets.append(compressed_offset)
+            index.uncompressed_offsets.append(uncompressed_offset)
+        index.compressed_size = data['compressed_size']
+        index.uncompressed_size = data['uncompressed_size']
+        return index
+
+    @classmethod
+    def scan(cls, buf) -> 'BlockIndex':
+        """Rebuild the index by walking member headers (ISIZE gives block sizes)"""
+        index = cls()
+        offset = 0
+        end = len(buf)
+        while offset < end:
+            size = read_member_size(buf, offset)
+            if size is None or offset + size > end:
+                # Torn tail of a segment that was never sealed
+                break
+            _, uncompressed_length = _MEMBER_TRAILER.unpack_from(buf, offset + size - _MEMBER_TRAILER.size)
+            index.add(size, uncompressed_length)
+            offset += size
+        return index
+
+
+class BlockCompressedReader:
+    """
+    Random access and parallel decompression over a block-compressed file
+    """
+
+    def __init__(self, path: Path, workers: int = None):
+        """
+        Args:
+            path: Block-compressed file
+            workers: Threads used to decompress blocks (zlib releases the GIL)
+        """
+        self.path = Path(path)
+        self.workers = workers or PITR_CONFIG.get('decompress_workers') or os.cpu_count() or 1
+        self.logger = logging.getLogger("BlockCompressedReader")
+
+        with open(self.path, 'rb') as f:
+            size = f.seek(0, 2)
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        self.index = self._load_index(size)
+
+    def _load_index(self, size: int) -> BlockIndex:
+        sidecar = index_path(self.path)
+        if sidecar.exists():
+            try:
+                index = BlockIndex.load(sidecar)
+                if index.compressed_size == size:
+                    return index
+                self.logger.warning(f"Stale block index for {self.path.name}, rescanning")
+            except Exception as e:
+                self.logger.warning(f"Unreadable block index for {self.path.name}: {e}")
+        return BlockIndex.scan(self.mmap) if self.mmap is not None else BlockIndex()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @property
+    def size(self) -> int:
+        """Uncompressed size of all complete blocks"""
+        return self.index.uncompressed_size
+
+    def decompress_block(self, block: int) -> bytes:
+        """Decompress and check a single block"""
+        offset, length = self.index.block_range(block)
+        member = self.mmap[offset:offset + length]
+        data = zlib.decompress(member[_MEMBER_HEADER.size:-_MEMBER_TRAILER.size], -zlib.MAX_WBITS)
+        crc, isize = _MEMBER_TRAILER.unpack_from(member, length - _MEMBER_TRAILER.size)
+        if zlib.crc32(data) != crc or len(data) & 0xFFFFFFFF != isize:
+            raise ValueError(f"Block {block} of {self.path.name} failed its CRC check")
+        return data
+
+    def read_blocks(self, blocks) -> List[bytes]:
+        """Decompress several blocks, in parallel when there is more than one"""
+        blocks = list(blocks)
+        if len(blocks) <= 1 or self.workers <= 1:
+            return [self.decompress_block(block) for block in blocks]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(blocks))) as pool:
+            return list(pool.map(self.decompress_block, blocks))
+
+    def read_range(self, offset: int, length: int) -> bytes:
+        """Read length uncompressed bytes starting at an uncompressed offset"""
+        if length <= 0 or not len(self.index):
+            return b''
+        blocks = self.index.blocks_for(offset, length)
+        data = b''.join(self.read_blocks(blocks))
+        start = offset - self.index.uncompressed_offsets[blocks.start]
+        return data[start:start + length]
+
+    def read_ranges(self, ranges: List[Tuple[int, int]]) -> List[bytes]:
+        """
+        Read several uncompressed (offset, length) ranges
+
+        The blocks of all ranges are decompressed together in one parallel
+        batch; a block shared by two ranges is only decompressed once.
+        """
+        if not len(self.index):
+            return [b''] * len(ranges)
+        needed = sorted({block for offset, length in ranges for block in self.index.blocks_for(offset, length)})
+        decompressed = dict(zip(needed, self.read_blocks(needed)))
+        result = []
+        for offset, length in ranges:
+            if length <= 0:
+                result.append(b'')
+                continue
+            blocks = self.index.blocks_for(offset, length)
+            data = b''.join(decompressed[block] for block in blocks)
+            start = offset - self.index.uncompressed_offsets[blocks.start]
+            result.append(data[start:start + length])
+        return result
+
+    def iter_blocks(self) -> Iterator[bytes]:
+        """Yield decompressed blocks in order, a parallel batch at a time"""
+        batch_size = max(1, self.workers * 4)
+        for batch_start in range(0, len(self.index), batch_size):
+            yield from self.read_blocks(range(batch_start, min(batch_start + batch_size, len(self.index))))
+
+    def read_all(self) -> bytes:
+        """Decompress the whole file using all workers"""
+        return b''.join(self.read_blocks(range(len(self.index))))
+
+    def verify(self) -> List[str]:
+        """
+        Check every block on its own
+
+        Returns:
+            Error messages for blocks that fail to decompress or checksum
+        """
+        errors = []
+        for block in range(len(self.index)):
+            try:
+                self.decompress_block(block)
+            except Exception as e:
+                errors.append(f"Block {block}: {e}")
+        return errors
@@ -0,0 +1,329 @@
+"""
+Bulk Apply
+Replays a restore's change stream with set-based statements: runs of
+INSERTs into one table become a COPY, runs of UPDATEs or DELETEs are
+COPYed into a temporary staging table and applied with one joined
+statement, and runs of pre-generated SQL are sent in one round trip
+"""
+
+import io
+import json
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .pitr_config import PITR_CONFIG
+from .PreparedStatements import PreparedStatementCache
+from .TableKeys import TableKeyCache
+
+
+def _array_literal(values: list) -> str:
+    """PostgreSQL array literal of a (nested) list, as psycopg2 adapts lists"""
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, list):
+            items.append(_array_literal(value))
+        elif isinstance(value, bool):
+            items.append('t' if value else 'f')
+        elif isinstance(value, (int, float)):
+            items.append(str(value))
+        else:
+            if isinstance(value, dict):
+                value = json.dumps(value)
+            items.append('"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"')
+    return '{' + ','.join(items) + '}'
+
+
+def _copy_value(value) -> str:
+    """Format a value for COPY's text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        # Array columns; the row-by-row path binds lists as ARRAY[...] too
+        value = _array_literal(value)
+    elif isinstance(value, dict):
+        value = json.dumps(value)
+    else:
+        value = str(value)
+    return (
+        value.replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def _join_condition(key_columns: List[str]) -> str:
+    """Join of target t and staging table s on the key columns"""
+    return ' AND '.join(f"t.{column} = s.{column}" for column in key_columns)
+
+
+class ChangeFailed(Exception):
+    """A change failed while the applier stops on errors"""
+
+    def __init__(self, change: dict, error: Exception):
+        super().__init__(f"Error applying change to {change.get('table')}: {error}")
+        self.change = change
+        self.error = error
+
+
+class BulkApplier:
+    """
+    Applies an ordered change stream through one cursor in bulk.
+
+    Consecutive changes with the same table, operation and column list form
+    a run; a run ends wherever the next change could not be batched with it
+    without changing the outcome, i.e. at any change to another table or of
+    another kind, and inside an UPDATE run at a key already updated in it.
+    UPDATEs and DELETEs are matched on the table's key columns (see
+    TableKeyCache).
+    Order between runs is preserved, so the result matches replaying the
+    changes one by one.
+
+    Each run executes under a savepoint. If the bulk statement fails, the
+    run is rolled back and replayed change by change, skipping (and
+    logging) the changes that fail, as the per-change restore always did.
+    With stop_on_error, the first failing change raises ChangeFailed instead.
+    Runs shorter than restore_bulk_min_rows are replayed change by change,
+    through the connection's prepared statements (see
+    PreparedStatementCache). Consecutive such changes are tried together
+    under one savepoint; only if one of them fails are they replayed with a
+    savepoint per change, so the happy path costs no extra round trips.
+    """
+
+    def __init__(
+        self,
+        cursor,
+        apply_change: Callable,
+        min_rows: int = None,
+        stop_on_error: bool = False,
+        table_keys: TableKeyCache = None
+    ):
+        """
+        Args:
+            cursor: Cursor of the restore connection (inside a transaction)
+            apply_change: apply_change(cursor, change, statements) replays one change
+            min_rows: Shortest run applied in bulk
+            stop_on_error: Raise ChangeFailed instead of skipping failed changes
+            table_keys: Key columns of the target tables
+        """
+        self.cursor = cursor
+        self.apply_change = apply_change
+        self.min_rows = min_rows or PITR_CONFIG.get('restore_bulk_min_rows', 16)
+        self.stop_on_error = stop_on_error
+        self.table_keys = table_keys if table_keys is not None else TableKeyCache()
+        # Session-level: kept across the transactions of the connection
+        self.statements = PreparedStatementCache(cursor)
+        self.logger = logging.getLogger("BulkApplier")
+
+        # (table, columns) -> staging table name
+        self.staging_tables: Dict[Tuple[str, Tuple[str, ...]], str] = {}
+        self.staging_count = 0
+
+        self.stats = {
+            'copy_runs': 0,
+            'update_runs': 0,
+            'delete_runs': 0,
+            'sql_runs': 0,
+            'single_changes': 0,
+            'failed_runs': 0,
+            'failed_changes': 0
+        }
+
+    def apply(self, changes: Iterable[dict]) -> int:
+        """
+        Apply changes in order
+
+        Returns:
+            Number of changes applied
+        """
+        applied = 0
+        # Consecutive changes replayed one by one, tried under one savepoint
+        single: List[dict] = []
+        for kind, run in self._runs(changes):
+            if self._is_single(kind, run):
+                single.extend(run)
+                continue
+            if single:
+                applied += self._apply_each(single)
+                single = []
+            applied += self._apply_run(kind, run)
+        if single:
+            applied += self._apply_each(single)
+        return applied
+
+    def transaction_ended(self):
+        """Forget the staging tables, which COMMIT and ROLLBACK drop"""
+        self.staging_tables.clear()
+
+    # Run building
+
+    def _run_key(self, change: dict) -> Optional[tuple]:
+        """Changes with equal keys can share a run; None never shares"""
+        if 'sql' in change:
+            return ('sql',)
+        operation = change.get('operation')
+        if operation == 'INSERT':
+            return (change['table'], 'INSERT', tuple(change['data']))
+        if operation not in ('UPDATE', 'DELETE'):
+            return None
+        key_columns, key_values = self.table_keys.row_key(change)
+        if not key_columns or None in key_values:
+            # NULLs never match in a join
+            return None
+        if operation == 'DELETE':
+            return (change['table'], 'DELETE', key_columns)
+        if self.table_keys.new_key(change, key_columns, key_values) != key_values:
+            # Key changes are applied one by one
+            return None
+        columns = tuple(column for column in change['data'] if column not in key_columns)
+        return (change['table'], 'UPDATE', key_columns, columns) if columns else None
+
+    def _runs(self, changes: Iterable[dict]):
+        """Yield (run key, changes) for maximal runs of batchable changes"""
+        run: List[dict] = []
+        run_key = None
+        updated_rows = set()
+        for change in changes:
+            key = self._run_key(change)
+            row = None
+            if key is not None and key[1:2] == ('UPDATE',):
+                row = tuple(_copy_value(value) for value in self.table_keys.row_key(change)[1])
+            # Two updates of one row must stay in order
+            if run and (key is None or key != run_key or row in updated_rows):
+                yield run_key, run
+                run = []
+                updated_rows = set()
+            run.append(change)
+            run_key = key
+            if row is not None:
+                updated_rows.add(row)
+        if run:
+            yield run_key, run
+
+    # Run execution
+
+    def _is_single(self, key: Optional[tuple], run: List[dict]) -> bool:
+        """Whether a run is replayed change by change rather than in bulk"""
+        return key is None or (len(run) < self.min_rows and key[0] != 'sql') or len(run) == 1
+
+    def _apply_run(self, key: Optional[tuple], run: List[dict]) -> int:
+        if self._is_single(key, run):
+            return self._apply_each(run)
+
+        self.cursor.execute("SAVEPOINT cdc_bulk_run")
+        try:
+            if key[0] == 'sql':
+                self._execute_sql(run)
+                self.stats['sql_runs'] += 1
+            elif key[1] == 'INSERT':
+                self._copy_insert(key[0], list(key[2]), run)
+                self.stats['copy_runs'] += 1
+            elif key[1] == 'UPDATE':
+                self._staged_update(key[0], list(key[2]), list(key[3]), run)
+                self.stats['update_runs'] += 1
+            else:
+                self._staged_delete(key[0], list(key[2]), run)
+                self.stats['delete_runs'] += 1
+            self.cursor.execute("RELEASE SAVEPOINT cdc_bulk_run")
+            return len(run)
+        except Exception as e:
+            self.cursor.execute("ROLLBACK TO SAVEPOINT cdc_bulk_run")
+            # Staging tables created by the run are gone with it
+            self.staging_tables.clear()
+            self.stats['failed_runs'] += 1
+            self.logger.warning(f"Bulk run of {len(run)} changes failed, replaying one by one: {e}")
+            return self._apply_each(run, guarded=True)
+
+    def _apply_each(self, run: List[dict], guarded: bool = False) -> int:
+        """
+        Replay changes one by one
+
+        Unless guarded, the changes are first applied under a single
+        savepoint; a failure rolls them back and replays them guarded, with
+        a savepoint per change so failing changes can be skipped.
+        """
+        if not guarded:
+            self.cursor.execute("SAVEPOINT cdc_changes")
+            try:
+                for change in run:
+                    self.apply_change(self.cursor, change, self.statements)
+                self.cursor.execute("RELEASE SAVEPOINT cdc_changes")
+                self.stats['single_changes'] += len(run)
+                return len(run)
+            except Exception as e:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT cdc_changes")
+                self.logger.debug(f"{len(run)} changes failed together, replaying each under a savepoint: {e}")
+
+        applied = 0
+        for change in run:
+            self.cursor.execute("SAVEPOINT cdc_change")
+            try:
+                self.apply_change(self.cursor, change, self.statements)
+                self.cursor.execute("RELEASE SAVEPOINT cdc_change")
+                applied += 1
+                self.stats['single_changes'] += 1
+            except Exception as e:
+                self.cursor.execute("ROLLBACK TO SAVEPOINT cdc_change")
+                if self.stop_on_error:
+                    raise ChangeFailed(change, e) from e
+                self.stats['failed_changes'] += 1
+                self.logger.error(
+                    f"Error applying change to {change.get('table')}: {e}\n"
+                    f"Change: {change}"
+                )
+        return applied
+
+    def _execute_sql(self, run: List[dict]):
+        """Send pre-generated statements in one round trip"""
+        self.cursor.execute('\n'.join(change['sql'] for change in run))
+
+    def _copy(self, table: str, columns: List[str], rows: Iterable[list]):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(_copy_value(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        self.cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+    def _copy_insert(self, table: str, columns: List[str], run: List[dict]):
+        self._copy(table, columns, ([change['data'][column] for column in columns] for change in run))
+
+    def _staging_table(self, table: str, columns: List[str]) -> str:
+        """Empty temporary table with the types of table's columns"""
+        key = (table, tuple(columns))
+        name = self.staging_tables.get(key)
+        if name is None:
+            name = f"cdc_stage_{self.staging_count}"
+            self.staging_count += 1
+            self.cursor.execute(
+                f"CREATE TEMP TABLE {name} ON COMMIT DROP AS "
+                f"SELECT {', '.join(columns)} FROM {table} WITH NO DATA"
+            )
+            self.staging_tables[key] = name
+        else:
+            self.cursor.execute(f"TRUNCATE {name}")
+        return name
+
+    def _staged_update(self, table: str, key_columns: List[str], columns: List[str], run: List[dict]):
+        stage = self._staging_table(table, key_columns + columns)
+        self._copy(stage, key_columns + columns, (
+            list(self.table_keys.row_key(change)[1]) + [change['data'][column] for column in columns]
+            for change in run
+        ))
+        assignments = ', '.join(f"{column} = s.{column}" for column in columns)
+        self.cursor.execute(
+            f"UPDATE {table} AS t SET {assignments} FROM {stage} AS s "
+            f"WHERE {_join_condition(key_columns)}"
+        )
+
+    def _staged_delete(self, table: str, key_columns: List[str], run: List[dict]):
+        stage = self._staging_table(table, key_columns)
+        self._copy(stage, key_columns, (list(self.table_keys.row_key(change)[1]) for change in run))
+        self.cursor.execute(
+            f"DELETE FROM {table} AS t USING {stage} AS s "
+            f"WHERE {_join_condition(key_columns)}"
+        )
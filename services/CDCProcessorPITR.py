@@ -5,7 +5,6 @@ Integrates logical replication with LSN-tracked backups for Point-in-Time Recove
 
 import logging
 import json
-import os
 import re
 import signal
 import sys
@@ -16,6 +15,11 @@ from psycopg2.extras import LogicalReplicationConnection
 
 from utils.ApplicationConnection import ApplicationConnection
 from .PITRBackupManager import PITRBackupManager
+from .PgOutputDecoder import PgOutputDecoder
+from .ColumnParser import ColumnParser
+from .CapturePipeline import CapturePipeline
+from .LSNCheckpoint import LSNCheckpoint
+from .LSN import LSN, format_lsn
 from .TransactionLogManager import TransactionLogManager
 from .pitr_config import PITR_CONFIG, DB_CONFIG, REPLICATION_CONFIG
 
@@ -31,6 +35,13 @@ class CDCProcessor:
         self.slot_name = slot_name or REPLICATION_CONFIG['slot_name']
         self.output_plugin = output_plugin or REPLICATION_CONFIG['output_plugin']
         self.backup_dir = backup_dir or PITR_CONFIG['backup_dir']
+        self.publication_name = REPLICATION_CONFIG.get('publication_name', 'cdc_publication')
+        
+        # Binary protocol decoder (only used when streaming from pgoutput)
+        self.decoder = PgOutputDecoder() if self.output_plugin == 'pgoutput' else None
+        
+        # Compiled per-table column converters for test_decoding tuples
+        self.column_parser = ColumnParser()
         
         # Initialize logging
         self.logger = self._configure_logger()
@@ -47,15 +58,37 @@ class CDCProcessor:
         self.cursor = None
         self._connect_replication()
         
+        if not self.decoder and PITR_CONFIG.get('parser_preload_catalog', True):
+            try:
+                self.column_parser.load_from_catalog(self.replication_conn)
+            except Exception as e:
+                # Layouts are learned on first sight instead
+                self.logger.warning(f"Could not preload column layouts from catalog: {e}")
+        
+        # Key columns for the WHERE clauses of generated SQL; pgoutput
+        # Relation messages keep them current after schema changes
+        try:
+            self.backup_manager.table_keys.load_from_catalog(self.replication_conn)
+        except Exception as e:
+            self.logger.warning(f"Could not load table keys from catalog: {e}")
+        
         # Shutdown handling
         self.shutdown_requested = False
         signal.signal(signal.SIGINT, self._handle_shutdown)
         signal.signal(signal.SIGTERM, self._handle_shutdown)
         
+        # Durable LSN watermark, persisted on a timer and when segments are sealed
+        self.checkpoint = LSNCheckpoint(sync_fn=self.backup_manager.sync)
+        self.backup_manager.add_seal_listener(self.checkpoint.persist)
+        self.backup_manager.add_flush_listener(self._on_commit_flushed)
+        
         # State tracking
-        self.last_lsn = self._load_last_lsn()
+        self.last_lsn: LSN = self.checkpoint.persisted_lsn
         self.current_txid = None
         
+        # Reader -> parser -> writer pipeline (created when consuming starts)
+        self.pipeline: Optional[CapturePipeline] = None
+        
         self.logger.info("CDC Processor with PITR initialized")
     
     def _configure_logger(self) -> logging.Logger:
@@ -99,29 +132,6 @@ class CDCProcessor:
             self.logger.error(f"Error connecting to database: {e}")
             raise
     
-    def _load_last_lsn(self) -> Optional[str]:
-        """Load last processed LSN from disk"""
-        lsn_file = "last_lsn.txt"
-        
-        if os.path.exists(lsn_file):
-            try:
-                with open(lsn_file, 'r') as f:
-                    lsn = f.read().strip()
-                    self.logger.info(f"Loaded last LSN: {lsn}")
-                    return lsn
-            except Exception as e:
-                self.logger.error(f"Error loading last LSN: {e}")
-        
-        return None
-    
-    def _save_last_lsn(self, lsn: str):
-        """Save last processed LSN to disk"""
-        try:
-            with open("last_lsn.txt", 'w') as f:
-                f.write(lsn)
-        except Exception as e:
-            self.logger.error(f"Error saving last LSN: {e}")
-    
     def get_slot_info(self) -> dict:
         """Get information about the replication slot"""
         try:
@@ -144,8 +154,32 @@ class CDCProcessor:
             self.logger.error(f"Error checking slot info: {e}")
             return {'exists': False, 'error': str(e)}
 
+    def create_publication(self):
+        """Create the pgoutput publication if it doesn't exist"""
+        try:
+            with self.replication_conn.cursor() as cur:
+                cur.execute(
+                    "SELECT 1 FROM pg_publication WHERE pubname = %s",
+                    (self.publication_name,)
+                )
+                if cur.fetchone():
+                    self.logger.info(f"Publication '{self.publication_name}' already exists")
+                    return
+                
+                cur.execute(f'CREATE PUBLICATION "{self.publication_name}" FOR ALL TABLES')
+                self.logger.info(f"Publication '{self.publication_name}' created for all tables")
+        except psycopg2.errors.DuplicateObject:
+            self.logger.info(f"Publication '{self.publication_name}' already exists")
+        except Exception as e:
+            self.logger.error(f"Error creating publication: {e}")
+            raise
+    
     def create_replication_slot(self):
         """Create replication slot if it doesn't exist"""
+        # pgoutput only streams tables that belong to a publication
+        if self.decoder:
+            self.create_publication()
+        
         # First check if it exists logic manually to give better feedback
         slot_info = self.get_slot_info()
         
@@ -194,14 +228,32 @@ class CDCProcessor:
     def start_replication(self):
         """Start replication from last known LSN or beginning"""
         try:
-            # Start replication without explicit LSN - let it resume from slot position
-            self.cursor.start_replication(
-                slot_name=self.slot_name,
-                decode=True
-            )
+            # Resume from the checkpointed LSN; the server starts from the later of
+            # this and the slot's confirmed position
+            start_lsn = self.checkpoint.persisted_lsn
+            
+            if self.decoder:
+                # pgoutput streams binary protocol messages, decoded by PgOutputDecoder
+                self.cursor.start_replication(
+                    slot_name=self.slot_name,
+                    decode=False,
+                    start_lsn=start_lsn,
+                    options={
+                        'proto_version': str(REPLICATION_CONFIG.get('proto_version', 1)),
+                        'publication_names': self.publication_name
+                    }
+                )
+            else:
+                self.cursor.start_replication(
+                    slot_name=self.slot_name,
+                    decode=True,
+                    start_lsn=start_lsn
+                )
+            
+            self.checkpoint.start()
             
             if self.last_lsn:
-                self.logger.info(f"Resuming replication from last known LSN: {self.last_lsn}")
+                self.logger.info(f"Resuming replication from last known LSN: {format_lsn(self.last_lsn)}")
             else:
                 self.logger.info("Started replication from beginning")
         
@@ -212,43 +264,44 @@ class CDCProcessor:
     def consume_changes(self):
         """
         Consume replication stream and process changes with PITR tracking
+        
+        With the capture pipeline enabled (default), this callback only reads
+        messages and reports progress; parsing and disk writes happen on the
+        pipeline's parser and writer threads.
         """
+        if PITR_CONFIG.get('pipeline_enabled', True):
+            self.pipeline = CapturePipeline(
+                parse_fn=self._parse_message,
+                apply_fn=self._apply_event,
+                on_durable=self._on_durable_lsn
+            )
+            self.pipeline.start()
+        
         def consume(message):
-            try:
-                if self.shutdown_requested:
-                    self.logger.info("Shutdown requested, stopping replication")
-                    raise KeyboardInterrupt
-                
-                # Extract LSN
-                lsn = message.data_start
-                lsn_str = f"{lsn >> 32}/{lsn & 0xFFFFFFFF}"
-                
-                # Decode payload
-                payload = message.payload
-                if isinstance(payload, bytes):
-                    payload = payload.decode('utf-8')
-                
-                payload = payload.strip()
-                
-                # Skip empty messages
-                if not payload:
-                    message.cursor.send_feedback(flush_lsn=message.data_start)
-                    return
-                
-                # Process message
-                self._process_message(lsn_str, payload)
-                
-                # Send feedback
-                message.cursor.send_feedback(flush_lsn=message.data_start)
-                
-                # Save LSN periodically
-                self.last_lsn = lsn_str
-                self._save_last_lsn(lsn_str)
+            if self.pipeline and self.pipeline.error is not None:
+                raise RuntimeError(f"Capture pipeline failed: {self.pipeline.error}")
             
-            except KeyboardInterrupt:
-                raise
-            except Exception as e:
-                self.logger.error(f"Error processing message: {e}")
+            if self.shutdown_requested:
+                self.logger.info("Shutdown requested, stopping replication")
+                raise KeyboardInterrupt
+            
+            lsn = message.data_start
+            
+            if self.pipeline:
+                # Hand off to the parser; the writer advances the checkpoint
+                self.pipeline.submit(lsn, message.payload)
+            else:
+                # Synchronous mode: parse and write on the reader thread
+                event = self._parse_message(lsn, message.payload)
+                if event and self._apply_event(lsn, event):
+                    self._on_durable_lsn(lsn)
+            
+            # Only acknowledge what is checkpointed on disk
+            if self.checkpoint.persisted_lsn:
+                message.cursor.send_feedback(
+                    write_lsn=lsn,
+                    flush_lsn=self.checkpoint.persisted_lsn
+                )
         
         self.logger.info("Starting to consume changes...")
         
@@ -265,121 +318,228 @@ class CDCProcessor:
         finally:
             self._shutdown()
     
-    def _process_message(self, lsn: str, payload: str):
+    def _on_durable_lsn(self, lsn: LSN):
+        """Record the highest LSN whose changes are flushed to the backup file"""
+        self.last_lsn = lsn
+        self.checkpoint.advance(lsn)
+    
+    def _on_commit_flushed(self, lsn: LSN):
+        """Advance the watermark when a commit group reaches stable storage"""
+        self._on_durable_lsn(lsn)
+    
+    def _parse_message(self, lsn: LSN, payload) -> Optional[Dict[str, Any]]:
         """
-        Process a replication message and extract change data
+        Turn a raw replication message into a capture event
         
         Args:
             lsn: Log Sequence Number
-            payload: Message payload
+            payload: Message payload (text for test_decoding, bytes for pgoutput)
+        
+        Returns:
+            Event dictionary with a 'type' key, or None if there is nothing to apply
+        
+        Raises:
+            Any decode or parse error, so capture stops before the LSN is confirmed
         """
+        if self.decoder:
+            return self._parse_pgoutput_message(lsn, payload)
+        
+        # Decode payload
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        
+        payload = payload.strip()
+        
+        # Skip empty messages
+        if not payload:
+            return None
+        
         # Handle transaction control messages
         if payload.startswith('BEGIN'):
-            self._handle_begin(lsn, payload)
+            # Format: "BEGIN 12345"
+            match = re.search(r'BEGIN (\d+)', payload)
+            if match:
+                return {'type': 'BEGIN', 'txid': int(match.group(1)), 'timestamp': datetime.now()}
+            return None
         
         elif payload.startswith('COMMIT'):
-            self._handle_commit(lsn, payload)
+            return {'type': 'COMMIT', 'timestamp': datetime.now()}
         
         elif payload.startswith('ROLLBACK'):
-            self._handle_rollback(lsn, payload)
+            return {'type': 'ROLLBACK', 'timestamp': datetime.now()}
         
         # Handle data change messages
         elif payload.startswith('table'):
-            self._handle_table_change(lsn, payload)
+            # Format examples (test_decoding):
+            # table public.users: INSERT: id[integer]:1 name[text]:'John'
+            # table public.users: UPDATE: id[integer]:1 name[text]:'Jane'
+            # table public.users: DELETE: id[integer]:1
+            change_data = self._parse_change_data(payload)
+            if not change_data:
+                return None
+            
+            change_data['type'] = 'CHANGE'
+            change_data['timestamp'] = datetime.now()
+            return change_data
         
         else:
             self.logger.debug(f"Unhandled message type: {payload[:50]}")
+            return None
     
-    def _handle_begin(self, lsn: str, payload: str):
-        """Handle BEGIN transaction message"""
-        # Extract transaction ID
-        # Format: "BEGIN 12345"
-        match = re.search(r'BEGIN (\d+)', payload)
-        if match:
-            txid = int(match.group(1))
-            self.current_txid = txid
-            
-            self.transaction_manager.begin_transaction(
-                txid=txid,
-                lsn=lsn,
-                timestamp=datetime.now()
-            )
-            
-            self.logger.debug(f"Transaction {txid} started at LSN {lsn}")
+    def _parse_pgoutput_message(self, lsn: LSN, payload: bytes) -> Optional[Dict[str, Any]]:
+        """
+        Turn a binary pgoutput message into a capture event
+        
+        Args:
+            lsn: Log Sequence Number
+            payload: Raw pgoutput message bytes
+        """
+        # Decode errors propagate: capture stops before the LSN is confirmed
+        decoded = self.decoder.decode(payload)
+        
+        if not decoded:
+            return None
+        
+        msg_type = decoded['type']
+        
+        if msg_type == 'CHANGE':
+            decoded['timestamp'] = datetime.now()
+            return decoded
+        
+        elif msg_type == 'BEGIN':
+            return {'type': 'BEGIN', 'txid': decoded['txid'], 'timestamp': decoded['commit_time']}
+        
+        elif msg_type == 'COMMIT':
+            return {'type': 'COMMIT', 'timestamp': decoded['commit_time']}
+        
+        elif msg_type == 'TRUNCATE':
+            decoded['timestamp'] = datetime.now()
+            return decoded
+        
+        elif msg_type == 'RELATION':
+            self.backup_manager.table_keys.register_relation(decoded['relation'])
+        
+        # RELATION / TYPE / ORIGIN / MESSAGE otherwise only update decoder state
+        self.logger.debug(f"Processed pgoutput {msg_type} message at LSN {format_lsn(lsn)}")
+        return None
     
-    def _handle_commit(self, lsn: str, payload: str):
-        """Handle COMMIT transaction message"""
+    def _apply_event(self, lsn: LSN, event: Dict[str, Any]) -> bool:
+        """
+        Apply a capture event to the transaction log and backup manager
+        
+        Returns:
+            True if all changes up to this LSN are now persisted
+        """
+        event_type = event['type']
+        
+        if event_type == 'CHANGE':
+            self._track_change(lsn, event, event['timestamp'])
+            return False
+        
+        elif event_type == 'BEGIN':
+            self._begin_transaction(event['txid'], lsn, event['timestamp'])
+            return False
+        
+        elif event_type == 'COMMIT':
+            return self._commit_transaction(lsn, event['timestamp'])
+        
+        elif event_type == 'ROLLBACK':
+            return self._rollback_transaction(lsn, event['timestamp'])
+        
+        elif event_type == 'TRUNCATE':
+            for table_name in event['tables']:
+                self._track_change(lsn, {
+                    'table': table_name,
+                    'operation': 'TRUNCATE',
+                    'data': {},
+                    'old_data': None
+                }, event['timestamp'])
+            return False
+        
+        return False
+    
+    def _begin_transaction(self, txid: int, lsn: LSN, timestamp: datetime):
+        """Start tracking a transaction"""
+        self.current_txid = txid
+        
+        self.transaction_manager.begin_transaction(
+            txid=txid,
+            lsn=lsn,
+            timestamp=timestamp
+        )
+        
+        self.logger.debug(f"Transaction {txid} started at LSN {format_lsn(lsn)}")
+    
+    def _commit_transaction(self, lsn: LSN, timestamp: datetime) -> bool:
+        """
+        Commit the current transaction and hand it to group commit
+        
+        Returns:
+            True if the transaction's changes are already on stable storage
+        """
         if self.current_txid:
             self.transaction_manager.commit_transaction(
                 txid=self.current_txid,
                 lsn=lsn,
-                timestamp=datetime.now()
+                timestamp=timestamp
             )
             
-            self.logger.info(f"Transaction {self.current_txid} committed at LSN {lsn}")
+            self.logger.info(f"Transaction {self.current_txid} committed at LSN {format_lsn(lsn)}")
             
-            # Flush changes to disk on commit to ensure transaction-consistent backup
-            self.logger.info(f"Triggering backup flush for transaction {self.current_txid}")
-            self.backup_manager.force_flush()
+            # Close the transaction in the backup; it is written with its commit group
+            flushed = self.backup_manager.end_transaction(lsn)
             
             self.current_txid = None
+            return flushed
         else:
             self.logger.warning("COMMIT without active transaction")
+            return False
     
-    def _handle_rollback(self, lsn: str, payload: str):
-        """Handle ROLLBACK transaction message"""
+    def _rollback_transaction(self, lsn: LSN, timestamp: datetime) -> bool:
+        """
+        Roll back the current transaction
+        
+        Returns:
+            True if buffered changes are already on stable storage
+        """
         if self.current_txid:
             self.transaction_manager.rollback_transaction(
                 txid=self.current_txid,
                 lsn=lsn,
-                timestamp=datetime.now()
+                timestamp=timestamp
             )
             
-            self.logger.info(f"Transaction {self.current_txid} rolled back at LSN {lsn}")
+            self.logger.info(f"Transaction {self.current_txid} rolled back at LSN {format_lsn(lsn)}")
             
-            # Still flush to ensure transaction log is persistent
-            self.backup_manager.force_flush()
+            # Still end the transaction so its buffered changes are written
+            flushed = self.backup_manager.end_transaction(lsn)
             
             self.current_txid = None
+            return flushed
         else:
             self.logger.warning("ROLLBACK without active transaction")
+            return False
     
-    def _handle_table_change(self, lsn: str, payload: str):
-        """
-        Handle table change message
-        
-        Format examples (test_decoding):
-        table public.users: INSERT: id[integer]:1 name[text]:'John'
-        table public.users: UPDATE: id[integer]:1 name[text]:'Jane'
-        table public.users: DELETE: id[integer]:1
-        """
-        try:
-            change_data = self._parse_change_data(payload)
-            
-            if not change_data:
-                return
-            
-            # Use current transaction ID or create implicit one
-            txid = self.current_txid or hash(lsn) % (2**31)
-            
-            # Track change in backup manager
-            self.backup_manager.track_change(
-                lsn=lsn,
-                txid=txid,
-                timestamp=datetime.now(),
-                table_name=change_data['table'],
-                operation=change_data['operation'],
-                data=change_data['data'],
-                old_data=change_data.get('old_data')
-            )
-            
-            self.logger.info(
-                f"Captured {change_data['operation']} on {change_data['table']} "
-                f"(LSN: {lsn}, TxID: {txid})"
-            )
+    def _track_change(self, lsn: LSN, change_data: Dict[str, Any], timestamp: datetime = None):
+        """Hand a parsed change to the backup manager"""
+        # Use current transaction ID or create implicit one
+        txid = self.current_txid or lsn % (2**31)
+        
+        # Track change in backup manager
+        self.backup_manager.track_change(
+            lsn=lsn,
+            txid=txid,
+            timestamp=timestamp or datetime.now(),
+            table_name=change_data['table'],
+            operation=change_data['operation'],
+            data=change_data['data'],
+            old_data=change_data.get('old_data')
+        )
         
-        except Exception as e:
-            self.logger.error(f"Error handling table change: {e}\nPayload: {payload}")
+        self.logger.info(
+            f"Captured {change_data['operation']} on {change_data['table']} "
+            f"(LSN: {format_lsn(lsn)}, TxID: {txid})"
+        )
     
     def _parse_change_data(self, payload: str) -> Optional[Dict[str, Any]]:
         """
@@ -391,98 +551,73 @@ class CDCProcessor:
         Returns:
             Dictionary with parsed change data
         """
-        try:
-            # Format: "table schema.table_name: OPERATION: col1[type]:val1 ..."
-            # For UPDATEs (with options): "table ...: UPDATE: old-key: ... new-tuple: ..."
-            
-            parts = payload.split(':', 2)
-            
-            if len(parts) < 3:
-                return None
-            
-            # Extract table name
-            table_part = parts[0].strip()
-            table_match = re.search(r'table\s+(\S+)', table_part)
-            if not table_match:
-                return None
-            
-            table_name = table_match.group(1)
-            
-            # Extract operation
-            operation = parts[1].strip()
-            
-            # Extract data
-            data_part = parts[2].strip()
-            
-            data = None
-            old_data = None
+        # Format: "table schema.table_name: OPERATION: col1[type]:val1 ..."
+        # For UPDATEs (with options): "table ...: UPDATE: old-key: ... new-tuple: ..."
+        
+        parts = payload.split(':', 2)
+        
+        if len(parts) < 3:
+            return None
+        
+        # Extract table name
+        table_part = parts[0].strip()
+        table_match = re.search(r'table\s+(\S+)', table_part)
+        if not table_match:
+            return None
+        
+        table_name = table_match.group(1)
+        
+        # Extract operation
+        operation = parts[1].strip()
+        
+        # Extract data
+        data_part = parts[2].strip()
+        
+        data = None
+        old_data = None
+        
+        if operation == 'UPDATE':
+            # Check for old-key / new-tuple format
+            # This depends on REPLICA IDENTITY and plugin output
+            # Common pattern: "old-key: ... new-tuple: ..."
             
-            if operation == 'UPDATE':
-                # Check for old-key / new-tuple format
-                # This depends on REPLICA IDENTITY and plugin output
-                # Common pattern: "old-key: ... new-tuple: ..."
+            # Try to split by "new-tuple:" first
+            if "new-tuple:" in data_part:
+                segments = data_part.split("new-tuple:")
+                old_segment = segments[0].replace("old-key:", "").strip()
+                new_segment = segments[1].strip()
                 
-                # Try to split by "new-tuple:" first
-                if "new-tuple:" in data_part:
-                    segments = data_part.split("new-tuple:")
-                    old_segment = segments[0].replace("old-key:", "").strip()
-                    new_segment = segments[1].strip()
-                    
-                    old_data = self._parse_column_data(old_segment)
-                    data = self._parse_column_data(new_segment)
-                else:
-                    # Standard fallback (might merge them or only have new data)
-                    data = self._parse_column_data(data_part)
+                old_data = self._parse_column_data(old_segment, table_name)
+                data = self._parse_column_data(new_segment, table_name)
             else:
-                # INSERT / DELETE
-                data = self._parse_column_data(data_part)
-                
-                # For DELETE, the data is technically the "old key"
-                if operation == 'DELETE':
-                    old_data = data
-                    data = data  # Keep it in data as well for compatibility
+                # Standard fallback (might merge them or only have new data)
+                data = self._parse_column_data(data_part, table_name)
+        else:
+            # INSERT / DELETE
+            data = self._parse_column_data(data_part, table_name)
             
-            return {
-                'table': table_name,
-                'operation': operation,
-                'data': data,
-                'old_data': old_data
-            }
+            # For DELETE, the data is technically the "old key"
+            if operation == 'DELETE':
+                old_data = data
+                data = data  # Keep it in data as well for compatibility
         
-        except Exception as e:
-            self.logger.error(f"Error parsing change data: {e}")
-            return None
+        return {
+            'table': table_name,
+            'operation': operation,
+            'data': data,
+            'old_data': old_data
+        }
     
-    def _parse_column_data(self, data_str: str) -> Dict[str, Any]:
+    def _parse_column_data(self, data_str: str, table_name: str = None) -> Dict[str, Any]:
         """
         Parse column data from test_decoding format
         
         Format: "col1[type]:val1 col2[type]:val2"
-        """
-        data = {}
-        
-        # Split by spaces, but handle quoted values
-        pattern = r"(\w+)\[([^\]]+)\]:('(?:[^']|'')*'|[^\s]+)"
-        matches = re.findall(pattern, data_str)
         
-        for col_name, col_type, col_value in matches:
-            # Remove quotes from string values
-            if col_value.startswith("'") and col_value.endswith("'"):
-                col_value = col_value[1:-1].replace("''", "'")
-            
-            # Convert to appropriate type
-            if col_value == 'null':
-                col_value = None
-            elif col_type in ('integer', 'bigint', 'smallint'):
-                col_value = int(col_value) if col_value else None
-            elif col_type in ('numeric', 'decimal', 'real', 'double precision'):
-                col_value = float(col_value) if col_value else None
-            elif col_type == 'boolean':
-                col_value = col_value.lower() == 'true' if col_value else None
-            
-            data[col_name] = col_value
-        
-        return data
+        Uses the table's compiled layout when one is cached, so a row is
+        converted in a single pass without per-column type dispatch.
+        """
+        return self.column_parser.parse(table_name, data_str)
     
     def _handle_shutdown(self, signum, frame):
         """Handle shutdown signal"""
@@ -493,12 +628,16 @@ class CDCProcessor:
         """Graceful shutdown"""
         self.logger.info("Shutting down CDC Processor...")
         
+        # Drain parsed events into the backup manager before the final flush
+        if self.pipeline:
+            self.pipeline.stop()
+        
         # Flush backup manager
         self.backup_manager.shutdown()
+        self.transaction_manager.close()
         
-        # Save final LSN
-        if self.last_lsn:
-            self._save_last_lsn(self.last_lsn)
+        # Sync backup data and write the final LSN checkpoint
+        self.checkpoint.stop()
         
         # Close connections
         if self.cursor:
@@ -511,8 +650,11 @@ class CDCProcessor:
     def get_statistics(self) -> dict:
         """Get CDC and backup statistics"""
         return {
-            'last_lsn': self.last_lsn,
+            'last_lsn': format_lsn(self.last_lsn) if self.last_lsn else None,
             'current_txid': self.current_txid,
+            'parser_stats': self.column_parser.get_statistics(),
+            'pipeline_stats': self.pipeline.get_statistics() if self.pipeline else None,
+            'checkpoint_stats': self.checkpoint.get_statistics(),
             'backup_stats': self.backup_manager.get_statistics(),
             'transaction_stats': self.transaction_manager.get_statistics()
         }
@@ -0,0 +1,234 @@
+"""
+Capture Pipeline
+Decouples replication stream reading from parsing and disk writes using
+bounded queues, so that slow flushes never stall WAL consumption directly
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from .pitr_config import PITR_CONFIG
+from .LSN import LSN, format_lsn
+
+
+# Marks end of stream between stages
+_STOP = object()
+
+
+class StageQueue:
+    """
+    Bounded queue with backpressure accounting
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+
+        self.items_in = 0
+        self.items_out = 0
+        self.max_depth = 0
+        self.blocked_puts = 0
+        self.blocked_seconds = 0.0
+
+    def put(self, item: Any, should_abort: Callable[[], bool] = None):
+        """
+        Put an item, blocking while the queue is full
+
+        Args:
+            item: Item to enqueue
+            should_abort: Optional callable checked while blocked; when it
+                returns True the put is abandoned and False is returned
+        """
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.blocked_puts += 1
+            started = time.monotonic()
+            while True:
+                try:
+                    self.queue.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    if should_abort and should_abort():
+                        self.blocked_seconds += time.monotonic() - started
+                        return False
+            self.blocked_seconds += time.monotonic() - started
+
+        self.items_in += 1
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def get(self) -> Any:
+        item = self.queue.get()
+        self.items_out += 1
+        return item
+
+    def get_statistics(self) -> dict:
+        return {
+            'depth': self.queue.qsize(),
+            'capacity': self.maxsize,
+            'max_depth': self.max_depth,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'blocked_puts': self.blocked_puts,
+            'blocked_seconds': round(self.blocked_seconds, 3)
+        }
+
+
+class CapturePipeline:
+    """
+    Reader -> parser -> writer pipeline for CDC capture.
+
+    The reader (the replication callback) only enqueues raw messages. A
+    parser thread turns them into events and a single writer thread applies
+    events to the transaction log and backup manager in stream order. The
+    durable LSN only advances when the writer reports that a transaction
+    boundary has been persisted, and is what the reader reports back to
+    the server as flush_lsn.
+
+    A message that fails to parse or apply stops the pipeline (error is
+    set and submit() refuses further messages) rather than being skipped:
+    a later durable event would otherwise move the durable LSN past it and
+    let the server discard it.
+    """
+
+    def __init__(
+        self,
+        parse_fn: Callable[[LSN, Any], Optional[dict]],
+        apply_fn: Callable[[LSN, dict], bool],
+        on_durable: Callable[[LSN], None] = None,
+        parse_queue_size: int = None,
+        write_queue_size: int = None
+    ):
+        """
+        Args:
+            parse_fn: (lsn, payload) -> event or None; runs on the parser thread
+            apply_fn: (lsn, event) -> True if everything up to lsn is durable;
+                runs on the writer thread
+            on_durable: Optional callback invoked on the writer thread when the
+                durable LSN advances
+            parse_queue_size: Capacity of the raw message queue
+            write_queue_size: Capacity of the parsed event queue
+        """
+        self.logger = logging.getLogger("CapturePipeline")
+        self.parse_fn = parse_fn
+        self.apply_fn = apply_fn
+        self.on_durable = on_durable
+
+        self.parse_queue = StageQueue(
+            'parse', parse_queue_size or PITR_CONFIG.get('pipeline_parse_queue_size', 10000)
+        )
+        self.write_queue = StageQueue(
+            'write', write_queue_size or PITR_CONFIG.get('pipeline_write_queue_size', 10000)
+        )
+
+        self.received_lsn = 0
+        self.durable_lsn = 0
+        self.error: Optional[BaseException] = None
+
+        self.parser_thread = threading.Thread(target=self._parser_loop, name="cdc-parser", daemon=True)
+        self.writer_thread = threading.Thread(target=self._writer_loop, name="cdc-writer", daemon=True)
+        self.started = False
+
+    def start(self):
+        """Start parser and writer threads"""
+        if self.started:
+            return
+        self.started = True
+        self.parser_thread.start()
+        self.writer_thread.start()
+        self.logger.info("Capture pipeline started")
+
+    def submit(self, lsn: LSN, payload: Any) -> bool:
+        """
+        Enqueue a raw replication message (called from the reader thread)
+
+        Returns:
+            False if the pipeline has failed and the message was not accepted
+        """
+        if self.error is not None:
+            return False
+        self.received_lsn = lsn
+        return self.parse_queue.put((lsn, payload), should_abort=self._failed)
+
+    def stop(self, timeout: float = 30):
+        """Drain both stages and stop the threads"""
+        if not self.started:
+            return
+        self.parse_queue.put(_STOP, should_abort=self._failed)
+        self.parser_thread.join(timeout=timeout)
+        self.writer_thread.join(timeout=timeout)
+        self.started = False
+        self.logger.info("Capture pipeline stopped")
+
+    def _failed(self) -> bool:
+        return self.error is not None
+
+    def _parser_loop(self):
+        try:
+            self._run_parser()
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"Parser stage failed: {e}")
+            # Let the writer finish the events parsed before the failure
+            self.write_queue.put(_STOP, should_abort=lambda: not self.writer_thread.is_alive())
+
+    def _writer_loop(self):
+        try:
+            self._run_writer()
+        except Exception as e:
+            self.error = e
+            self.logger.error(f"Writer stage failed: {e}")
+
+    def _run_parser(self):
+        while True:
+            item = self.parse_queue.get()
+            if item is _STOP:
+                self.write_queue.put(_STOP, should_abort=self._failed)
+                return
+
+            lsn, payload = item
+            try:
+                event = self.parse_fn(lsn, payload)
+            except Exception as e:
+                raise RuntimeError(f"Error parsing message at LSN {format_lsn(lsn)}: {e}") from e
+
+            if event is not None:
+                if not self.write_queue.put((lsn, event), should_abort=self._failed):
+                    return
+
+    def _run_writer(self):
+        while True:
+            item = self.write_queue.get()
+            if item is _STOP:
+                return
+
+            lsn, event = item
+            try:
+                durable = self.apply_fn(lsn, event)
+            except Exception as e:
+                raise RuntimeError(f"Error applying event at LSN {format_lsn(lsn)}: {e}") from e
+
+            if durable and lsn > self.durable_lsn:
+                self.durable_lsn = lsn
+                if self.on_durable:
+                    try:
+                        self.on_durable(lsn)
+                    except Exception as e:
+                        self.logger.error(f"Error in durable LSN callback: {e}")
+
+    def get_statistics(self) -> dict:
+        """Get pipeline depth, backpressure and lag statistics"""
+        return {
+            'received_lsn': self.received_lsn,
+            'durable_lsn': self.durable_lsn,
+            'unflushed_bytes': max(0, self.received_lsn - self.durable_lsn),
+            'parse_queue': self.parse_queue.get_statistics(),
+            'write_queue': self.write_queue.get_statistics()
+        }
@@ -0,0 +1,203 @@
+"""
+Change Coalescer
+Folds the ordered change history of each row into one net change, so a
+row updated many times inside a restore window is written once
+"""
+
+import logging
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .pitr_config import PITR_CONFIG
+from .TableKeys import TableKeyCache
+
+
+def _merged(net: dict, change: dict) -> dict:
+    """net with change's column values and position applied on top"""
+    merged = dict(net)
+    merged['data'] = {**net['data'], **change['data']}
+    for field in ('lsn', 'txid', 'timestamp'):
+        if field in change:
+            merged[field] = change[field]
+    return merged
+
+
+class _Row:
+    """Net state of one row: an optional leading DELETE, then the row's net write"""
+
+    __slots__ = ('delete', 'delete_position', 'write', 'write_position')
+
+    def __init__(self):
+        self.delete: Optional[dict] = None
+        self.delete_position = 0
+        self.write: Optional[dict] = None
+        self.write_position = 0
+
+
+class ChangeCoalescer:
+    """
+    Folds an ordered change stream into one net change per row.
+
+    Changes are grouped by row (table and key values, see TableKeyCache).
+    Within a window:
+
+    - INSERT followed by UPDATEs becomes one INSERT of the final row
+    - INSERT followed by DELETE disappears
+    - repeated UPDATEs become one UPDATE with the last value of every column
+    - UPDATEs followed by DELETE become the DELETE
+    - DELETE followed by INSERT stays a DELETE and an INSERT (later UPDATEs
+      fold into the INSERT)
+
+    Net changes are emitted in the order of the change that defines them,
+    and carry the LSN, txid and timestamp of the last change folded into
+    them. Changes that cannot be folded (pre-generated SQL, TRUNCATE, and
+    UPDATEs that change the key) are barriers: everything pending is
+    emitted first, then the barrier itself, so nothing is reordered across
+    them.
+
+    Rows are assumed independent apart from the key: a non-key unique value
+    handed from one row to another inside a window can collide when the
+    intermediate states are folded away (set restore_coalesce to False for
+    such workloads).
+    """
+
+    def __init__(self, table_keys: TableKeyCache = None):
+        """
+        Args:
+            table_keys: Key columns of the tables
+        """
+        self.table_keys = table_keys if table_keys is not None else TableKeyCache()
+        self.logger = logging.getLogger("ChangeCoalescer")
+        self.rows: Dict[tuple, _Row] = {}
+        self.position = 0
+
+        self.stats = {
+            'changes_in': 0,
+            'changes_out': 0,
+            'barriers': 0
+        }
+
+    def __len__(self) -> int:
+        """Number of rows with pending net changes"""
+        return len(self.rows)
+
+    def add(self, change: dict) -> List[dict]:
+        """
+        Fold a change into the pending rows
+
+        Returns:
+            Changes that must be emitted now (non-empty only at a barrier)
+        """
+        self.stats['changes_in'] += 1
+        self.position += 1
+        key = self._row_key(change)
+        if key is None:
+            return self._barrier(change)
+
+        row = self.rows.get(key)
+        operation = change['operation']
+
+        if row is None:
+            row = self.rows[key] = _Row()
+            if operation == 'DELETE':
+                row.delete, row.delete_position = change, self.position
+            else:
+                row.write, row.write_position = change, self.position
+            return []
+
+        if operation == 'INSERT':
+            if row.write is not None:
+                # INSERT of a row that already exists would fail on replay;
+                # keep the failure where it was instead of folding it away
+                return self._barrier(change)
+            row.write, row.write_position = change, self.position
+        elif operation == 'UPDATE':
+            if row.write is not None:
+                row.write = _merged(row.write, change)
+            # else: UPDATE of a deleted row changes nothing
+        else:
+            if row.write is None:
+                # DELETE of a deleted row changes nothing
+                return []
+            if row.write['operation'] == 'INSERT' and row.delete is None:
+                # Inserted inside the window: no net change
+                del self.rows[key]
+            else:
+                row.write = None
+                if row.delete is None:
+                    row.delete, row.delete_position = change, self.position
+        return []
+
+    def _row_key(self, change: dict) -> Optional[tuple]:
+        """
+        (table, key columns, key values) of a row change
+
+        None when the change cannot be folded: generated SQL, TRUNCATE, and
+        UPDATEs that change the key.
+        """
+        operation = change.get('operation')
+        if 'sql' in change or operation not in ('INSERT', 'UPDATE', 'DELETE'):
+            return None
+        if not (change.get('old_data') or change.get('data')):
+            return None
+        columns, values = self.table_keys.row_key(change)
+        if operation == 'UPDATE' and self.table_keys.new_key(change, columns, values) != values:
+            return None
+        try:
+            hash(values)
+        except TypeError:
+            values = repr(values)
+        return change['table'], columns, values
+
+    def flush(self) -> List[dict]:
+        """Net changes of all pending rows, in order"""
+        pending = []
+        for row in self.rows.values():
+            if row.delete is not None:
+                pending.append((row.delete_position, row.delete))
+            if row.write is not None:
+                pending.append((row.write_position, row.write))
+        self.rows = {}
+        pending.sort(key=lambda item: item[0])
+        self.stats['changes_out'] += len(pending)
+        return [change for _, change in pending]
+
+    def _barrier(self, change: dict) -> List[dict]:
+        self.stats['barriers'] += 1
+        emitted = self.flush()
+        emitted.append(change)
+        self.stats['changes_out'] += 1
+        return emitted
+
+
+def coalesce(
+    changes: Iterable[dict],
+    window: int = None,
+    coalescer: ChangeCoalescer = None,
+    table_keys: TableKeyCache = None
+) -> Iterator[dict]:
+    """
+    Yield the net changes of an ordered change stream
+
+    Pending rows are flushed every window input changes, so memory is
+    bounded by the window rather than the stream.
+
+    Args:
+        changes: Changes in replay order
+        window: Input changes folded together (restore_coalesce_window)
+        coalescer: Coalescer to use, e.g. to read its stats afterwards
+        table_keys: Key columns of the tables, for a new coalescer
+    """
+    window = window or PITR_CONFIG.get('restore_coalesce_window', 100000)
+    if coalescer is None:
+        coalescer = ChangeCoalescer(table_keys)
+    in_window = 0
+    for change in changes:
+        yield from coalescer.add(change)
+        in_window += 1
+        if in_window >= window:
+            yield from coalescer.flush()
+            in_window = 0
+    yield from coalescer.flush()
+    coalescer.logger.info(
+        f"Coalesced {coalescer.stats['changes_in']} changes into {coalescer.stats['changes_out']}"
+    )
@@ -0,0 +1,277 @@
+"""
+Schema-aware Column Parser
+Compiles and caches a per-table row converter for test_decoding tuples so
+that the capture path does not re-dispatch on column types for every row
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .pitr_config import PITR_CONFIG
+
+
+# Generic tokenizer, used only the first time a layout is seen
+_GENERIC_PATTERN = re.compile(r"(\w+)\[([^\]]+)\]:('(?:[^']|'')*'|[^\s]+)")
+
+# A single test_decoding value: quoted literal or bare token
+_VALUE_PATTERN = r"('(?:[^']|'')*'|\S+)"
+
+
+def _unquote(value: str) -> str:
+    if value.startswith("'") and value.endswith("'"):
+        return value[1:-1].replace("''", "'")
+    return value
+
+
+def _convert_text(value: str) -> Optional[str]:
+    if value == 'null':
+        return None
+    return _unquote(value)
+
+
+def _convert_int(value: str) -> Optional[int]:
+    if value == 'null':
+        return None
+    value = _unquote(value)
+    return int(value) if value else None
+
+
+def _convert_float(value: str) -> Optional[float]:
+    if value == 'null':
+        return None
+    value = _unquote(value)
+    return float(value) if value else None
+
+
+def _convert_bool(value: str) -> Optional[bool]:
+    if value == 'null':
+        return None
+    value = _unquote(value)
+    return value.lower() == 'true' if value else None
+
+
+# test_decoding prints format_type() names without typmods
+_TYPE_CONVERTERS: Dict[str, Callable[[str], Any]] = {
+    'integer': _convert_int,
+    'bigint': _convert_int,
+    'smallint': _convert_int,
+    'numeric': _convert_float,
+    'decimal': _convert_float,
+    'real': _convert_float,
+    'double precision': _convert_float,
+    'boolean': _convert_bool,
+}
+
+
+def converter_for_type(type_name: str) -> Callable[[str], Any]:
+    """Get the value converter for a test_decoding type name"""
+    return _TYPE_CONVERTERS.get(type_name, _convert_text)
+
+
+class CompiledLayout:
+    """
+    A compiled row converter for one (table, column layout) combination
+    """
+
+    __slots__ = ('columns', 'types', 'signature', 'pattern', 'converters')
+
+    def __init__(self, columns: List[Tuple[str, str]]):
+        self.columns = tuple(name for name, _ in columns)
+        self.types = tuple(type_name for _, type_name in columns)
+        self.signature = tuple(columns)
+
+        # One anchored regex captures every value of the row in a single pass
+        self.pattern = re.compile(' '.join(
+            rf"{re.escape(name)}\[{re.escape(type_name)}\]:{_VALUE_PATTERN}"
+            for name, type_name in columns
+        ))
+        self.converters = tuple(converter_for_type(type_name) for _, type_name in columns)
+
+    def convert(self, data_str: str) -> Optional[Dict[str, Any]]:
+        """
+        Convert a tuple string using this layout
+
+        Returns:
+            Column dictionary, or None if the string does not fit the layout
+        """
+        match = self.pattern.fullmatch(data_str)
+        if match is None:
+            return None
+        return dict(zip(
+            self.columns,
+            [convert(value) for convert, value in zip(self.converters, match.groups())]
+        ))
+
+
+class ColumnParser:
+    """
+    Parses test_decoding column data using per-table compiled layouts.
+
+    Layouts are learned on first sight (or loaded from the catalog) and
+    cached per table. A table can have several live layouts at once, e.g.
+    the full new tuple and the old-key tuple of an UPDATE. When a row shows
+    a column with a different type than the cached layouts, the table's
+    cache is invalidated and relearned.
+    """
+
+    def __init__(self, max_layouts_per_table: int = None):
+        self.logger = logging.getLogger("ColumnParser")
+        self.max_layouts_per_table = max_layouts_per_table or PITR_CONFIG.get('parser_max_layouts_per_table', 8)
+
+        # table -> OrderedDict[signature -> CompiledLayout], most recently used last
+        self.layouts: Dict[str, "OrderedDict[tuple, CompiledLayout]"] = {}
+        self.column_types: Dict[str, Dict[str, str]] = {}
+        self.lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def parse(self, table_name: Optional[str], data_str: str) -> Dict[str, Any]:
+        """
+        Parse column data for a table
+
+        Args:
+            table_name: Qualified table name (None disables caching)
+            data_str: "col1[type]:val1 col2[type]:val2" tuple string
+
+        Returns:
+            Dictionary of column name to converted value
+        """
+        data_str = data_str.strip()
+        if not data_str:
+            return {}
+
+        if table_name is None:
+            return self._parse_generic(data_str)[0]
+
+        table_layouts = self.layouts.get(table_name)
+        if table_layouts:
+            # Try the most recently used layout first
+            candidates = list(reversed(table_layouts.values()))
+            for position, layout in enumerate(candidates):
+                row = layout.convert(data_str)
+                if row is not None:
+                    self.stats['hits'] += 1
+                    if position:
+                        with self.lock:
+                            if layout.signature in table_layouts:
+                                table_layouts.move_to_end(layout.signature)
+                    return row
+
+        self.stats['misses'] += 1
+        row, columns = self._parse_generic(data_str)
+        if columns:
+            self.register_layout(table_name, columns)
+        return row
+
+    def register_layout(self, table_name: str, columns: List[Tuple[str, str]]) -> CompiledLayout:
+        """
+        Compile and cache a layout for a table
+
+        Args:
+            table_name: Qualified table name
+            columns: Ordered list of (column name, type name)
+
+        Returns:
+            The compiled layout
+        """
+        with self.lock:
+            known_types = self.column_types.setdefault(table_name, {})
+            if any(known_types.get(name, type_name) != type_name for name, type_name in columns):
+                # Column type changed: the whole table layout is stale
+                self._invalidate_locked(table_name)
+                known_types = self.column_types.setdefault(table_name, {})
+
+            table_layouts = self.layouts.setdefault(table_name, OrderedDict())
+            signature = tuple(columns)
+            layout = table_layouts.get(signature)
+            if layout is None:
+                layout = CompiledLayout(columns)
+                table_layouts[signature] = layout
+                known_types.update(columns)
+                while len(table_layouts) > self.max_layouts_per_table:
+                    table_layouts.popitem(last=False)
+                self.logger.debug(f"Compiled layout for {table_name}: {len(columns)} columns")
+            else:
+                table_layouts.move_to_end(signature)
+
+            return layout
+
+    def invalidate(self, table_name: str = None):
+        """
+        Drop cached layouts for a table (or all tables)
+
+        Args:
+            table_name: Table to invalidate; None clears the whole cache
+        """
+        with self.lock:
+            if table_name is None:
+                self.layouts.clear()
+                self.column_types.clear()
+                self.stats['invalidations'] += 1
+            else:
+                self._invalidate_locked(table_name)
+
+    def _invalidate_locked(self, table_name: str):
+        if self.layouts.pop(table_name, None) is not None:
+            self.stats['invalidations'] += 1
+            self.logger.info(f"Invalidated cached column layouts for {table_name}")
+        self.column_types.pop(table_name, None)
+
+    def load_from_catalog(self, connection) -> int:
+        """
+        Pre-compile full-row layouts for all user tables from pg_catalog
+
+        Args:
+            connection: psycopg2 connection able to run catalog queries
+
+        Returns:
+            Number of tables loaded
+        """
+        query = """
+            SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+                   quote_ident(a.attname),
+                   format_type(a.atttypid, NULL)
+            FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind IN ('r', 'p')
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%'
+            ORDER BY 1, a.attnum
+        """
+        tables: Dict[str, List[Tuple[str, str]]] = {}
+        with connection.cursor() as cur:
+            cur.execute(query)
+            for table_name, column_name, type_name in cur.fetchall():
+                tables.setdefault(table_name, []).append((column_name, type_name))
+
+        for table_name, columns in tables.items():
+            self.register_layout(table_name, columns)
+
+        self.logger.info(f"Loaded column layouts for {len(tables)} tables from catalog")
+        return len(tables)
+
+    def get_statistics(self) -> dict:
+        """Get parser cache statistics"""
+        return {
+            'tables_cached': len(self.layouts),
+            'layouts_cached': sum(len(layouts) for layouts in self.layouts.values()),
+            **self.stats
+        }
+
+    @staticmethod
+    def _parse_generic(data_str: str) -> Tuple[Dict[str, Any], List[Tuple[str, str]]]:
+        """Tokenize a tuple without a known layout"""
+        data = {}
+        columns = []
+
+        for col_name, col_type, col_value in _GENERIC_PATTERN.findall(data_str):
+            data[col_name] = converter_for_type(col_type)(col_value)
+            columns.append((col_name, col_type))
+
+        return data, columns
@@ -17,6 +17,10 @@ import psycopg2.extensions
 
 from .pitr_config import PITR_CONFIG, DB_CONFIG
 from .TransactionLogManager import TransactionLogManager
+from .BinarySegment import BinarySegmentReader
+from .BackupCatalog import BackupCatalog
+from .LSN import LSN, PG_LSN_MARKER, to_lsn
+from .BlockCompression import BlockCompressedReader, is_block_compressed
 
 
 class EnhancedBackupMetadata:
@@ -42,8 +46,8 @@ class EnhancedBackupMetadata:
         # Standard fields
         self.start_time: str = None
         self.end_time: str = None
-        self.start_lsn: str = None
-        self.end_lsn: str = None
+        self.start_lsn: LSN = None
+        self.end_lsn: LSN = None
         self.changes_count: int = 0
         self.tables_affected: List[str] = []
         self.transactions: List[int] = []
@@ -100,21 +104,21 @@ class BackupChainBuilder:
     Builds restore chains from incremental backups
     """
     
-    def __init__(self, catalog: List[Dict]):
+    def __init__(self, catalog):
         """
         Initialize with backup catalog
         
         Args:
-            catalog: List of backup metadata dictionaries
+            catalog: BackupCatalog (queried through its indexes) or a list
+                of backup metadata dictionaries
         """
         self.catalog = catalog
-        self.backup_map = {b['backup_id']: b for b in catalog}
         self.logger = logging.getLogger("BackupChainBuilder")
     
     def build_chain_to_point(
         self,
         target_time: datetime,
-        target_lsn: Optional[str] = None
+        target_lsn: Optional[LSN] = None
     ) -> List[Dict]:
         """
         Build a restore chain to a target point in time or LSN
@@ -154,6 +158,9 @@ class BackupChainBuilder:
     
     def _find_base_backup(self, before_time: datetime) -> Optional[Dict]:
         """Find latest base backup before time"""
+        if isinstance(self.catalog, BackupCatalog):
+            return self.catalog.latest_base_before(before_time)
+        
         candidates = [
             b for b in self.catalog
             if (b.get('backup_type') == 'base' or b.get('parent_backup_id') is None) and
@@ -172,6 +179,9 @@ class BackupChainBuilder:
         base_backup_id: str
     ) -> Optional[Dict]:
         """Find next incremental backup after time in same chain"""
+        if isinstance(self.catalog, BackupCatalog):
+            return self.catalog.next_incremental(after_time, base_backup_id)
+        
         candidates = [
             b for b in self.catalog
             if (b.get('backup_type') == 'incremental' or b.get('parent_backup_id') is not None) and
@@ -219,8 +229,8 @@ class BackupChainBuilder:
     
     def _estimate_restore_time(self, changes: int) -> int:
         """Estimate restore time based on change count"""
-        # Rough estimate: ~100-200 changes per second on average hardware
-        changes_per_sec = 150
+        # Restores apply runs of similar changes in bulk (COPY / staged UPDATE / DELETE)
+        changes_per_sec = PITR_CONFIG.get('restore_changes_per_second', 20000)
         return max(10, int(changes / changes_per_sec))
 
 
@@ -259,15 +269,22 @@ class BackupIntegrityValidator:
         
         return checksums
     
-    def verify_backup_file(self, backup_id: str, metadata: EnhancedBackupMetadata) -> Tuple[bool, List[str]]:
+    def verify_backup_file(self, backup_id: str, metadata) -> Tuple[bool, List[str]]:
         """
         Verify backup file integrity
         
+        Args:
+            backup_id: Backup ID
+            metadata: Backup metadata, as a dictionary or EnhancedBackupMetadata
+        
         Returns:
             Tuple of (is_valid, error_messages)
         """
+        if isinstance(metadata, dict):
+            metadata = EnhancedBackupMetadata.from_dict(metadata)
         errors = []
-        backup_path = Path(PITR_CONFIG['backup_dir']) / metadata.filename
+        backup_dir = getattr(self.backup_manager, 'backup_dir', None) or PITR_CONFIG['backup_dir']
+        backup_path = Path(backup_dir) / metadata.filename
         
         # Check file existence
         if not backup_path.exists():
@@ -288,6 +305,14 @@ class BackupIntegrityValidator:
                     f"got {actual_checksums['sha256']}"
                 )
         
+        # Verify every compressed block on its own, so damage is localized
+        if is_block_compressed(backup_path):
+            with BlockCompressedReader(backup_path) as reader:
+                block_errors = reader.verify()
+            if block_errors:
+                errors.extend(block_errors)
+                return False, errors
+        
         # Verify file can be parsed
         try:
             self._parse_backup_sample(backup_path, metadata.format, limit=10)
@@ -310,6 +335,8 @@ class BackupIntegrityValidator:
             self._parse_sql_sample(file_path, limit)
         elif format_type in ['jsonl', 'json']:
             self._parse_json_sample(file_path, limit)
+        elif format_type == 'binary':
+            self._parse_binary_sample(file_path, limit)
     
     def _parse_sql_sample(self, file_path: Path, limit: int):
         """Parse SQL backup sample"""
@@ -353,6 +380,18 @@ class BackupIntegrityValidator:
         if count == 0:
             raise ValueError("No valid JSON records found in backup file")
     
+    def _parse_binary_sample(self, file_path: Path, limit: int):
+        """Parse binary backup sample"""
+        count = 0
+        with BinarySegmentReader(file_path) as reader:
+            for _ in reader.read_changes():
+                count += 1
+                if count >= limit:
+                    break
+        
+        if count == 0:
+            raise ValueError("No change records found in backup file")
+    
     def _verify_lsn_ordering(self, file_path: Path, format_type: str) -> bool:
         """Verify LSN ordering in backup file"""
         lsns = []
@@ -365,28 +404,33 @@ class BackupIntegrityValidator:
         if not lsns:
             return True  # Can't verify, assume OK
         
-        # Check if sorted
-        return lsns == sorted(lsns)
+        # Check if sorted (numerically; 'hi/lo' text does not sort as LSNs)
+        return all(a <= b for a, b in zip(lsns, lsns[1:]))
     
-    def _extract_lsns_from_sql(self, file_path: Path) -> List[str]:
+    def _extract_lsns_from_sql(self, file_path: Path) -> List[LSN]:
         """Extract LSNs from SQL backup file"""
         lsns = []
         open_func = gzip.open if file_path.suffix == '.gz' else open
         mode = 'rt' if file_path.suffix == '.gz' else 'r'
         
+        # Segments without the marker header wrote decimal 'hi/lo' LSNs
+        legacy = True
         with open_func(file_path, mode, encoding='utf-8', errors='ignore') as f:
             for line in f:
+                if line.strip() == PG_LSN_MARKER:
+                    legacy = False
                 # LSNs are in comments: -- LSN: 0/123456
-                if '-- LSN:' in line:
+                elif '-- LSN:' in line:
                     try:
-                        lsn = line.split('-- LSN:')[1].split(',')[0].strip()
-                        lsns.append(lsn)
+                        lsn = to_lsn(line.split('-- LSN:')[1].split(',')[0], legacy)
+                        if lsn is not None:
+                            lsns.append(lsn)
                     except:
                         pass
         
         return lsns
     
-    def _extract_lsns_from_json(self, file_path: Path) -> List[str]:
+    def _extract_lsns_from_json(self, file_path: Path) -> List[LSN]:
         """Extract LSNs from JSON backup file"""
         lsns = []
         open_func = gzip.open if file_path.suffix == '.gz' else open
@@ -396,8 +440,9 @@ class BackupIntegrityValidator:
             for line in f:
                 try:
                     data = json.loads(line)
-                    if 'lsn' in data:
-                        lsns.append(data['lsn'])
+                    lsn = to_lsn(data.get('lsn'), legacy=True)
+                    if lsn is not None:
+                        lsns.append(lsn)
                 except json.JSONDecodeError:
                     pass
         
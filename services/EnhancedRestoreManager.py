@@ -15,6 +15,7 @@ import os
 
 from .pitr_config import PITR_CONFIG, DB_CONFIG
 from .EnhancedBackupManager import BackupChainBuilder, BackupIntegrityValidator
+from .SqlReplay import SqlSegmentReplayer, is_cdc_segment
 
 
 class EnhancedPITRRestoreManager:
@@ -27,6 +28,8 @@ class EnhancedPITRRestoreManager:
         self.logger = self._configure_logger()
         self.chain_builder = None
         self.validator = None
+        # target database -> replayer of CDC SQL segments
+        self.replayers: Dict[str, SqlSegmentReplayer] = {}
         
         if backup_manager:
             self.chain_builder = BackupChainBuilder(backup_manager.backup_catalog)
@@ -241,46 +244,57 @@ class EnhancedPITRRestoreManager:
         
         applied_count = 0
         
-        for i, backup in enumerate(chain, 1):
-            backup_type = backup.get('backup_type', 'unknown')
-            
-            if show_progress:
-                print(f"      Restoring backup {i}/{len(chain)}: {backup['filename']}")
-            
-            try:
-                if backup_type == 'base':
-                    # Restore base backup
-                    self._restore_base_backup(backup, target_db)
-                else:
-                    # Apply incremental changes
-                    changes_applied = self._apply_incremental_backup(
-                        backup,
-                        target_db,
-                        tables,
-                        show_progress
-                    )
-                    applied_count += changes_applied
+        try:
+            for i, backup in enumerate(chain, 1):
+                backup_type = backup.get('backup_type', 'unknown')
                 
                 if show_progress:
-                    print(f"        ✓ Backup {i}/{len(chain)} applied")
-            
-            except Exception as e:
-                self.logger.error(f"Failed to apply backup {backup['backup_id']}: {e}")
-                if show_progress:
-                    print(f"        ✗ Failed: {e}")
+                    print(f"      Restoring backup {i}/{len(chain)}: {backup['filename']}")
+                
+                try:
+                    if backup_type == 'base':
+                        # Restore base backup
+                        self._restore_base_backup(backup, target_db)
+                    else:
+                        # Apply incremental changes
+                        changes_applied = self._apply_incremental_backup(
+                            backup,
+                            target_db,
+                            tables,
+                            show_progress
+                        )
+                        applied_count += changes_applied
+                    
+                    if show_progress:
+                        print(f"        ✓ Backup {i}/{len(chain)} applied")
                 
-                return {
-                    'success': False,
-                    'error': f'Failed to restore backup {i}/{len(chain)}: {e}',
-                    'backup_index': i,
-                    'backup_id': backup['backup_id']
-                }
+                except Exception as e:
+                    self.logger.error(f"Failed to apply backup {backup['backup_id']}: {e}")
+                    if show_progress:
+                        print(f"        ✗ Failed: {e}")
+                    
+                    return {
+                        'success': False,
+                        'error': f'Failed to restore backup {i}/{len(chain)}: {e}',
+                        'backup_index': i,
+                        'backup_id': backup['backup_id']
+                    }
+            
+            return {
+                'success': True,
+                'backups_applied': len(chain),
+                'changes_applied': applied_count
+            }
         
-        return {
-            'success': True,
-            'backups_applied': len(chain),
-            'changes_applied': applied_count
-        }
+        finally:
+            # The replayers' pooled connections end with the restore
+            self._close_replayers()
+    
+    def _close_replayers(self):
+        """Close the replayers of CDC SQL segments and their connections"""
+        for replayer in self.replayers.values():
+            replayer.close()
+        self.replayers.clear()
     
     def _restore_base_backup(self, backup: Dict, target_db: str):
         """Restore a base backup"""
@@ -298,7 +312,18 @@ class EnhancedPITRRestoreManager:
             self._restore_custom_backup(backup_path, target_db)
     
     def _restore_sql_backup(self, file_path: Path, target_db: str):
-        """Restore SQL backup using psql"""
+        """Restore SQL backup: CDC segments in-process, other scripts with psql"""
+        if is_cdc_segment(file_path):
+            replayer = self.replayers.get(target_db)
+            if replayer is None:
+                replayer = self.replayers[target_db] = SqlSegmentReplayer(target_db)
+            result = replayer.replay(file_path)
+            self.logger.info(
+                f"SQL backup replayed: {result['transactions']} transactions, "
+                f"{result['statements']} statements (last LSN {result['last_lsn']})"
+            )
+            return
+        
         cmd = [
             'psql',
             '-h', DB_CONFIG['host'],
@@ -324,7 +349,7 @@ class EnhancedPITRRestoreManager:
             raise RuntimeError(f"Restore failed: {err}")
     
     def _restore_custom_backup(self, file_path: Path, target_db: str):
-        """Restore custom format backup using pg_restore"""
+        """Restore custom / directory format backup using parallel pg_restore"""
         cmd = [
             'pg_restore',
             '-h', DB_CONFIG['host'],
@@ -333,6 +358,7 @@ class EnhancedPITRRestoreManager:
             '-d', target_db,
             '--clean',
             '--if-exists',
+            '-j', str(PITR_CONFIG.get('base_restore_jobs') or os.cpu_count() or 1),
             str(file_path)
         ]
         
@@ -0,0 +1,57 @@
+"""
+LSN
+Log Sequence Numbers are carried as 64-bit ints for ordering, range
+queries, bisect lookups and storage. Text LSNs are in PostgreSQL's pg_lsn
+form ('X/X', two hex halves, as pg_current_wal_lsn() prints them); the
+decimal-halves form CDCProcessor used to write is only read, with
+legacy=True, where old segments, logs and metadata are loaded.
+"""
+
+from typing import Optional, Union
+
+
+# Annotation alias: an LSN is a plain int
+LSN = int
+
+INVALID_LSN = 0
+
+# Above every real LSN: bound of unbounded LSN searches
+MAX_LSN = 0xFFFFFFFFFFFFFFFF
+
+# Line marking files whose text LSNs are pg_lsn: the second header line of
+# SQL segments and the first line of the checkpoint file. Files without it
+# were written with decimal halves.
+PG_LSN_MARKER = "-- LSN format: pg_lsn"
+
+
+def parse_lsn(value: Union[int, str], legacy: bool = False) -> LSN:
+    """
+    Get the 64-bit value of an LSN
+
+    Args:
+        value: An int (returned as is) or 'X/X' pg_lsn text
+        legacy: Read text as the decimal halves written by older versions
+
+    Returns:
+        LSN as an int
+    """
+    if isinstance(value, int):
+        return value
+    high, low = value.strip().split('/')
+    base = 10 if legacy else 16
+    return (int(high, base) << 32) | int(low, base)
+
+
+def to_lsn(value: Union[int, str, None], legacy: bool = False) -> Optional[LSN]:
+    """Like parse_lsn, but None and unparseable values become None"""
+    if value is None or isinstance(value, int):
+        return value
+    try:
+        return parse_lsn(value, legacy)
+    except ValueError:
+        return None
+
+
+def format_lsn(lsn: LSN) -> str:
+    """Format an LSN as pg_lsn text"""
+    return f"{lsn >> 32:X}/{lsn & 0xFFFFFFFF:X}"
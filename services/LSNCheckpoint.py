@@ -0,0 +1,169 @@
+"""
+LSN Checkpoint
+Persists the highest durably written LSN atomically, on a timer or when a
+backup segment is sealed, instead of rewriting a file for every message
+"""
+
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Optional
+
+from .pitr_config import PITR_CONFIG
+from .LSN import LSN, PG_LSN_MARKER, format_lsn, parse_lsn
+
+
+class LSNCheckpoint:
+    """
+    Tracks and persists the durable LSN watermark.
+
+    advance() is cheap and only updates memory. The watermark is written to
+    disk with a temp file + fsync + rename by the background timer or by an
+    explicit persist() (segment sealed, shutdown), never per message.
+    Before writing, the optional sync function is called so that the data
+    covered by the watermark is on stable storage first.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        interval_seconds: float = None,
+        sync_fn: Callable[[], bool] = None
+    ):
+        """
+        Args:
+            path: Checkpoint file path
+            interval_seconds: How often the timer persists a changed watermark
+            sync_fn: Called before writing the checkpoint to fsync backup data;
+                if it returns False the checkpoint is not advanced on disk
+        """
+        self.path = Path(path or PITR_CONFIG.get('lsn_checkpoint_file', 'last_lsn.txt'))
+        self.interval_seconds = interval_seconds or PITR_CONFIG.get('lsn_checkpoint_interval_seconds', 1)
+        self.sync_fn = sync_fn
+        self.logger = logging.getLogger("LSNCheckpoint")
+
+        self.lock = threading.Lock()
+        self.persist_lock = threading.Lock()
+
+        # Watermark reported by the writer (flushed, maybe not yet fsynced)
+        self.durable_lsn = 0
+        # Watermark that is on disk in the checkpoint file
+        self.persisted_lsn = 0
+        self.persist_count = 0
+
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+        loaded = self.load()
+        if loaded:
+            self.durable_lsn = self.persisted_lsn = loaded
+
+    @property
+    def persisted_lsn_str(self) -> Optional[str]:
+        return format_lsn(self.persisted_lsn) if self.persisted_lsn else None
+
+    def load(self) -> Optional[LSN]:
+        """
+        Load the persisted LSN, if any
+
+        The file holds PG_LSN_MARKER and the LSN as pg_lsn text; a file with
+        the LSN alone was written with decimal halves.
+        """
+        if not self.path.exists():
+            return None
+
+        try:
+            lines = [line.strip() for line in self.path.read_text().splitlines() if line.strip()]
+            if lines:
+                legacy = lines[0] != PG_LSN_MARKER
+                lsn = parse_lsn(lines[-1], legacy)
+                self.logger.info(f"Loaded LSN checkpoint: {format_lsn(lsn)}")
+                return lsn
+        except Exception as e:
+            self.logger.error(f"Error loading LSN checkpoint: {e}")
+
+        return None
+
+    def advance(self, lsn: LSN):
+        """Record that everything up to lsn has been written by the writer"""
+        with self.lock:
+            if lsn > self.durable_lsn:
+                self.durable_lsn = lsn
+
+    def persist(self) -> bool:
+        """
+        Sync backup data and atomically write the current watermark
+
+        Returns:
+            True if the checkpoint file is up to date
+        """
+        with self.persist_lock:
+            with self.lock:
+                target = self.durable_lsn
+
+            if target <= self.persisted_lsn:
+                return True
+
+            if self.sync_fn is not None and not self.sync_fn():
+                self.logger.warning("Backup sync failed, checkpoint not advanced")
+                return False
+
+            try:
+                self._write_atomic(f"{PG_LSN_MARKER}\n{format_lsn(target)}\n")
+            except Exception as e:
+                self.logger.error(f"Error writing LSN checkpoint: {e}")
+                return False
+
+            self.persisted_lsn = target
+            self.persist_count += 1
+            self.logger.debug(f"Checkpointed LSN {format_lsn(target)}")
+            return True
+
+    def _write_atomic(self, text: str):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, self.path)
+
+        # Make the rename itself durable (not supported on Windows)
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(self.path.parent.resolve(), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def start(self):
+        """Start the background checkpoint timer"""
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._timer_loop, name="lsn-checkpoint", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the timer and write a final checkpoint"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+            self.thread = None
+        self.persist()
+
+    def _timer_loop(self):
+        while not self.stop_event.wait(self.interval_seconds):
+            try:
+                self.persist()
+            except Exception as e:
+                self.logger.error(f"Error in checkpoint timer: {e}")
+
+    def get_statistics(self) -> dict:
+        return {
+            'durable_lsn': format_lsn(self.durable_lsn) if self.durable_lsn else None,
+            'persisted_lsn': self.persisted_lsn_str,
+            'checkpoints_written': self.persist_count
+        }
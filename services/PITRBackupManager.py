@@ -7,15 +7,26 @@ import json
 import gzip
 import logging
 import os
-from datetime import datetime
+import re
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
 from pathlib import Path
-from typing import Dict, List, Optional, Any
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Any
 import threading
 from collections import defaultdict
 import psycopg2.extensions
 
-from .pitr_config import PITR_CONFIG, DB_CONFIG
+from .pitr_config import PITR_CONFIG, DB_CONFIG, REPLICATION_CONFIG
 from .TransactionLogManager import TransactionLogManager
+from .SegmentWriter import SegmentWriter
+from .BackupCatalog import BackupCatalog
+from .BlockCompression import BlockCompressedReader, index_path, is_block_compressed
+from .LSN import LSN, PG_LSN_MARKER, format_lsn, parse_lsn, to_lsn
+from .BinarySegment import BinarySegmentWriter, BinarySegmentReader
+from .ChangeCoalescer import ChangeCoalescer, coalesce
+from .TableKeys import TableKeyCache
+from .BaseSnapshot import BaseSnapshotDumper, SCHEMA_FILE
 from .EnhancedBackupManager import (
     EnhancedBackupMetadata,
     BackupChainBuilder,
@@ -23,6 +34,71 @@ from .EnhancedBackupManager import (
 )
 
 
+# base_backup_format -> (pg_dump -F, file extension)
+BASE_BACKUP_FORMATS = {
+    'custom': ('c', '.dump'),
+    'directory': ('d', ''),
+    'plain': ('p', '.sql'),
+    # Directory of per-table COPY files; pg_dump only writes its schema.dump
+    'copy': ('c', ''),
+}
+
+# "<dump id>; <catalog oid> <oid> TABLE DATA <schema> <table> <owner>" in pg_restore -l
+TOC_TABLE_DATA = re.compile(r"^(\d+);\s+\d+\s+\d+\s+TABLE DATA\s+(\S+)\s+(.+?)\s+\S+$")
+
+
+def _iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Split a stream of byte chunks into text lines"""
+    remainder = b''
+    for chunk in chunks:
+        lines = (remainder + chunk).split(b'\n')
+        remainder = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8')
+    if remainder:
+        yield remainder.decode('utf-8')
+
+
+class TimedLock:
+    """
+    Mutex that records how long it is waited for and held
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.total_hold = 0.0
+        self.max_hold = 0.0
+        self.max_wait = 0.0
+        self._acquired_at = 0.0
+    
+    def __enter__(self):
+        started = time.perf_counter()
+        self.lock.acquire()
+        self._acquired_at = time.perf_counter()
+        waited = self._acquired_at - started
+        if waited > self.max_wait:
+            self.max_wait = waited
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        held = time.perf_counter() - self._acquired_at
+        self.acquisitions += 1
+        self.total_hold += held
+        if held > self.max_hold:
+            self.max_hold = held
+        self.lock.release()
+        return False
+    
+    def get_statistics(self) -> dict:
+        return {
+            'acquisitions': self.acquisitions,
+            'avg_hold_us': round(self.total_hold / self.acquisitions * 1e6, 1) if self.acquisitions else 0.0,
+            'max_hold_us': round(self.max_hold * 1e6, 1),
+            'max_wait_us': round(self.max_wait * 1e6, 1)
+        }
+
+
 class PITRBackupManager:
     """
     Manages CDC backups with LSN tracking for Point-in-Time Recovery.
@@ -40,14 +116,44 @@ class PITRBackupManager:
         self.logger = self._configure_logger()
         self.transaction_manager = transaction_manager or TransactionLogManager()
         
-        # Buffering for batch writes
+        # Key columns used in generated WHERE clauses (filled by the capture
+        # process from the catalog and pgoutput Relation messages)
+        self.table_keys = TableKeyCache()
+        
+        # Double buffering: producers append to the active buffer under
+        # buffer_lock, which is only held for list operations. Drains swap the
+        # active buffer out and write the sealed batch under flush_lock, so
+        # disk I/O never happens while buffer_lock is held.
         self.change_buffer: List[dict] = []
-        self.buffer_lock = threading.Lock()
+        self.buffer_lock = TimedLock()
+        self.flush_lock = threading.Lock()
         self.last_flush_time = datetime.now()
+        self.buffered_bytes = 0
+        self.flush_requested = False
+        self.producer_drains = 0
+        
+        # Group commit state: the first committed_count buffered changes belong
+        # to ended transactions that form the open commit group
+        self.commit_durability = PITR_CONFIG.get('group_commit_durability', 'window')
+        self.committed_count = 0
+        self.committed_bytes = 0
+        self.pending_commits = 0
+        self.pending_commit_lsn: Optional[LSN] = None
+        self.group_deadline: Optional[float] = None
+        self.group_stats = {'groups_flushed': 0, 'transactions_flushed': 0}
+        self.flush_event = threading.Event()
+        
+        # Callbacks run with the last commit LSN once a commit group is fsynced
+        self.flush_listeners: List[Callable[[LSN], Any]] = []
+        
+        # Callbacks run after a segment is sealed (e.g. LSN checkpointing)
+        self.seal_listeners: List[Callable[[], Any]] = []
         
         # Current backup file
         self.current_backup_file = None
         self.current_backup_metadata = None
+        self.segment_writer: Optional[SegmentWriter] = None
+        self.binary_writer: Optional[BinarySegmentWriter] = None
         self._initialize_backup_file()
         
         # Background flush thread
@@ -56,7 +162,7 @@ class PITRBackupManager:
         self.flush_thread.start()
         
         # Backup catalog
-        self.backup_catalog = self._load_backup_catalog()
+        self.backup_catalog = BackupCatalog(metadata_dir=str(self.metadata_dir))
 
         # Enhanced manager integration (optional)
         try:
@@ -93,15 +199,37 @@ class PITRBackupManager:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
         format_ext = PITR_CONFIG['backup_format']
-        filename = f"cdc_backup_{timestamp}.{format_ext}"
-        
-        if PITR_CONFIG['compression_enabled']:
-            filename += '.gz'
+        compressed = PITR_CONFIG['compression_enabled']
+        
+        if format_ext == 'binary':
+            suffix = '.cdcb.gz' if compressed else '.cdcb'
+            filename = f"cdc_backup_{timestamp}{suffix}"
+            sequence = 1
+            while (self.backup_dir / filename).exists():
+                # Binary segments are never appended to after a restart
+                filename = f"cdc_backup_{timestamp}_{sequence}{suffix}"
+                sequence += 1
+        else:
+            filename = f"cdc_backup_{timestamp}.{format_ext}"
+            if compressed:
+                filename += '.gz'
         
         self.current_backup_file = self.backup_dir / filename
         
+        # JSON arrays are patched in place and keep their own file handling;
+        # appendable formats go through a long-lived buffered writer
+        if format_ext in ('sql', 'jsonl', 'binary'):
+            self.segment_writer = SegmentWriter(
+                self.current_backup_file,
+                compressed=compressed
+            )
+        else:
+            self.segment_writer = None
+        
+        self.binary_writer = BinarySegmentWriter(self.segment_writer) if format_ext == 'binary' else None
+        
         # Write SQL headers if format is SQL and file is new
-        if format_ext == 'sql' and not self.current_backup_file.exists():
+        if format_ext == 'sql' and self.segment_writer.is_new:
             self._write_sql_header()
         
         self.current_backup_metadata = {
@@ -115,14 +243,14 @@ class PITRBackupManager:
             'tables_affected': set(),
             'transactions': set(),
             'format': PITR_CONFIG['backup_format'],
-            'compressed': PITR_CONFIG['compression_enabled']
+            'compressed': compressed
         }
         
         self.logger.info(f"Initialized new backup file: {filename}")
     
     def track_change(
         self,
-        lsn: str,
+        lsn: LSN,
         txid: int,
         timestamp: datetime,
         table_name: str,
@@ -134,7 +262,7 @@ class PITRBackupManager:
         Track a CDC change with full metadata
         
         Args:
-            lsn: Log Sequence Number
+            lsn: Log Sequence Number ('hi/lo' text is accepted and parsed)
             txid: Transaction ID
             timestamp: Change timestamp
             table_name: Affected table name
@@ -143,7 +271,7 @@ class PITRBackupManager:
             old_data: Old data (for UPDATE/DELETE)
         """
         change_record = {
-            'lsn': lsn,
+            'lsn': parse_lsn(lsn),
             'txid': txid,
             'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
             'table': table_name,
@@ -152,36 +280,175 @@ class PITRBackupManager:
             'old_data': old_data
         }
         
+        size = self._estimate_size(change_record)
+        
+        # Update transaction manager
+        self.transaction_manager.add_change_to_transaction(txid, table_name)
+        
+        max_bytes = PITR_CONFIG.get('group_commit_max_bytes', 4 * 1024 * 1024)
         with self.buffer_lock:
             self.change_buffer.append(change_record)
-            self.logger.info(f"Buffered change for {table_name}, buffer size: {len(self.change_buffer)}")
+            self.buffered_bytes += size
+            buffer_size = len(self.change_buffer)
+            buffered_bytes = self.buffered_bytes
+            open_changes = buffer_size - self.committed_count
+        
+        self.logger.info(f"Buffered change for {table_name}, buffer size: {buffer_size}")
+        
+        # Spill an open transaction that grows too large or stays open too long.
+        # Commits are flushed by end_transaction() / the commit group window.
+        should_flush = (
+            open_changes >= PITR_CONFIG['batch_size'] or
+            buffered_bytes >= max_bytes or
+            (datetime.now() - self.last_flush_time).seconds >= PITR_CONFIG['flush_interval_seconds']
+        )
+        
+        if buffered_bytes >= max_bytes * PITR_CONFIG.get('buffer_backpressure_factor', 4):
+            # The flusher is falling behind: drain here to bound memory
+            self.producer_drains += 1
+            self._drain()
+        elif should_flush:
+            self._request_flush()
+    
+    def end_transaction(self, lsn: LSN) -> bool:
+        """
+        Mark a transaction boundary (COMMIT or ROLLBACK) in the change stream
+        
+        With 'commit' durability the transaction is written and fsynced before
+        this returns. With 'window' durability it joins the open commit group,
+        which the flush thread writes and fsyncs once the window elapses or
+        the group reaches its transaction or byte limit; flush listeners are
+        told when that happens.
+        
+        Args:
+            lsn: LSN of the commit record
+        
+        Returns:
+            True if the transaction is on stable storage when this returns
+        """
+        with self.buffer_lock:
+            self.committed_count = len(self.change_buffer)
+            self.committed_bytes = self.buffered_bytes
+            self.pending_commits += 1
+            self.pending_commit_lsn = parse_lsn(lsn)
             
-            # Update metadata
-            if self.current_backup_metadata['start_lsn'] is None:
-                self.current_backup_metadata['start_lsn'] = lsn
+            if self.commit_durability == 'window':
+                if (self.pending_commits >= PITR_CONFIG.get('group_commit_max_transactions', 100) or
+                        self.buffered_bytes >= PITR_CONFIG.get('group_commit_max_bytes', 4 * 1024 * 1024)):
+                    # Group is full: close its window now
+                    self.group_deadline = 0.0
+                    wake_flusher = True
+                elif self.group_deadline is None:
+                    # Open a new group and wake the flush thread to time its window
+                    self.group_deadline = time.monotonic() + PITR_CONFIG.get('group_commit_window_ms', 10) / 1000
+                    wake_flusher = True
+                else:
+                    wake_flusher = False
+        
+        if self.commit_durability == 'commit':
+            return self._drain(committed_only=True)
+        
+        if wake_flusher:
+            self.flush_event.set()
+        return False
+    
+    def add_flush_listener(self, callback: Callable[[str], Any]):
+        """Register a callback receiving the last commit LSN of each fsynced group"""
+        self.flush_listeners.append(callback)
+    
+    def _request_flush(self):
+        """Ask the flush thread to drain the whole buffer"""
+        self.flush_requested = True
+        self.flush_event.set()
+    
+    def _drain(self, committed_only: bool = False) -> bool:
+        """
+        Swap out the buffered changes and write them to the backup segment
+        
+        The swap happens under buffer_lock; writing and fsyncing happen under
+        flush_lock only. Holding flush_lock across the swap keeps batches in
+        stream order when several threads drain.
+        
+        Args:
+            committed_only: Only write changes of ended transactions
+        
+        Returns:
+            True if the batch was written and its commit group (if any) fsynced
+        """
+        with self.flush_lock:
+            with self.buffer_lock:
+                if committed_only:
+                    count = self.committed_count
+                    batch = self.change_buffer[:count]
+                    self.change_buffer = self.change_buffer[count:]
+                    batch_bytes = self.committed_bytes
+                else:
+                    batch, self.change_buffer = self.change_buffer, []
+                    batch_bytes = self.buffered_bytes
+                    self.flush_requested = False
+                previous_committed = (self.committed_count, self.committed_bytes)
+                self.buffered_bytes -= batch_bytes
+                self.committed_count = 0
+                self.committed_bytes = 0
+                
+                group_commits = self.pending_commits
+                group_lsn = self.pending_commit_lsn
+                self.pending_commits = 0
+                self.pending_commit_lsn = None
+                self.group_deadline = None
             
-            self.current_backup_metadata['end_lsn'] = lsn
-            self.current_backup_metadata['changes_count'] += 1
-            self.current_backup_metadata['tables_affected'].add(table_name)
-            self.current_backup_metadata['transactions'].add(txid)
+            if batch and not self._write_batch(batch):
+                self._restore_batch(batch, batch_bytes, previous_committed, group_commits, group_lsn)
+                return False
             
-            # Update transaction manager
-            self.transaction_manager.add_change_to_transaction(txid, table_name)
+            if not group_commits:
+                return True
             
-            # Check if we should flush
-            should_flush = (
-                len(self.change_buffer) >= PITR_CONFIG['batch_size'] or
-                (datetime.now() - self.last_flush_time).seconds >= PITR_CONFIG['flush_interval_seconds']
-            )
+            if not self.sync():
+                return False
             
-            if should_flush:
-                self._flush_buffer()
+            self.group_stats['groups_flushed'] += 1
+            self.group_stats['transactions_flushed'] += group_commits
+        
+        for callback in self.flush_listeners:
+            try:
+                callback(group_lsn)
+            except Exception as e:
+                self.logger.error(f"Error in flush listener: {e}")
+        
+        return True
     
-    def _flush_buffer(self):
-        """Flush buffered changes to disk"""
-        if not self.change_buffer:
-            return
+    def _restore_batch(
+        self,
+        batch: List[dict],
+        batch_bytes: int,
+        previous_committed: tuple,
+        group_commits: int,
+        group_lsn: Optional[LSN]
+    ):
+        """Put a batch that failed to write back in front of the active buffer"""
+        with self.buffer_lock:
+            if self.committed_count:
+                # A commit arrived after the swap, so the whole batch precedes it
+                self.committed_count += len(batch)
+                self.committed_bytes += batch_bytes
+            else:
+                self.committed_count, self.committed_bytes = previous_committed
+            self.change_buffer[:0] = batch
+            self.buffered_bytes += batch_bytes
+            self.pending_commits += group_commits
+            self.pending_commit_lsn = self.pending_commit_lsn or group_lsn
+            if self.pending_commits and self.group_deadline is None:
+                # Retry with the next window
+                self.group_deadline = time.monotonic() + PITR_CONFIG.get('group_commit_window_ms', 10) / 1000
+    
+    def _write_batch(self, batch: List[dict]) -> bool:
+        """
+        Write a sealed batch to the current segment (called under flush_lock)
         
+        Returns:
+            True if the batch was written
+        """
         try:
             # Check if we need to rotate backup file
             if self._should_rotate_backup():
@@ -190,19 +457,44 @@ class PITRBackupManager:
             # Write changes
             format_type = PITR_CONFIG['backup_format']
             if format_type == 'jsonl':
-                self._write_jsonl(self.change_buffer)
+                self._write_jsonl(batch)
+            elif format_type == 'binary':
+                for change in batch:
+                    self.binary_writer.append(change)
             elif format_type == 'sql':
-                self._write_sql(self.change_buffer)
+                self._write_sql(batch)
             else:
-                self._write_json(self.change_buffer)
+                self._write_json(batch)
             
-            self.logger.info(f"Successfully flushed {len(self.change_buffer)} changes to disk")
+            # Segment metadata describes what is actually in this segment
+            metadata = self.current_backup_metadata
+            # Batches are in commit order, so LSNs are not monotonic
+            low = min(change['lsn'] for change in batch)
+            high = max(change['lsn'] for change in batch)
+            if metadata['start_lsn'] is None or low < metadata['start_lsn']:
+                metadata['start_lsn'] = low
+            if metadata['end_lsn'] is None or high > metadata['end_lsn']:
+                metadata['end_lsn'] = high
+            metadata['changes_count'] += len(batch)
+            metadata['tables_affected'].update(change['table'] for change in batch)
+            metadata['transactions'].update(change['txid'] for change in batch)
             
-            self.change_buffer.clear()
+            self.logger.info(f"Successfully flushed {len(batch)} changes to disk")
             self.last_flush_time = datetime.now()
+            return True
         
         except Exception as e:
             self.logger.error(f"Error flushing buffer: {e}")
+            return False
+    
+    @staticmethod
+    def _estimate_size(change: dict) -> int:
+        """Rough on-disk size of a change record, used for group byte limits"""
+        size = 64 + len(change['table'])
+        for values in (change['data'], change.get('old_data')):
+            if values:
+                size += sum(len(k) + len(str(v)) + 4 for k, v in values.items())
+        return size
 
     def _generate_sql(self, change: dict) -> str:
         """Generate an executable SQL statement from a change record"""
@@ -214,6 +506,15 @@ class PITRBackupManager:
         # Helper to format values for SQL
         def fmt(val):
             return psycopg2.extensions.adapt(val).getquoted().decode('utf-8')
+        
+        def key_condition():
+            # Match on the table's key columns as they were before the change
+            id_cols = old_data if old_data else data
+            columns = self.table_keys.key_columns(table, id_cols)
+            return columns, " AND ".join(
+                f"{col} IS NULL" if id_cols[col] is None else f"{col} = {fmt(id_cols[col])}"
+                for col in columns
+            )
 
         if op == 'INSERT':
             cols = ", ".join(data.keys())
@@ -221,24 +522,26 @@ class PITRBackupManager:
             return f"INSERT INTO {table} ({cols}) VALUES ({vals});"
             
         elif op == 'UPDATE':
-            # Identify "primary key" or identifying columns
-            # If old_data is present, we use it for the WHERE clause
-            # Otherwise, we assume the first column is the key (common for CDC)
+            # If old_data is present (the key changed), it identifies the row
             id_cols = old_data if old_data else data
-            pk_col = list(id_cols.keys())[0]
-            pk_val = id_cols[pk_col]
+            key_cols, where = key_condition()
             
-            sets = ", ".join(f"{k} = {fmt(v)}" for k, v in data.items() if k != pk_col)
-            if not sets: # Might happen if only PK changed or no other columns
+            # Key columns are only set when the update changes them
+            sets = ", ".join(
+                f"{k} = {fmt(v)}" for k, v in data.items()
+                if k not in key_cols or v != id_cols[k]
+            )
+            if not sets: # Might happen if no non-key columns are present
                 return f"-- SKIP UPDATE on {table}: No columns to set"
                 
-            return f"UPDATE {table} SET {sets} WHERE {pk_col} = {fmt(pk_val)};"
+            return f"UPDATE {table} SET {sets} WHERE {where};"
             
         elif op == 'DELETE':
-            id_cols = old_data if old_data else data
-            pk_col = list(id_cols.keys())[0]
-            pk_val = id_cols[pk_col]
-            return f"DELETE FROM {table} WHERE {pk_col} = {fmt(pk_val)};"
+            _, where = key_condition()
+            return f"DELETE FROM {table} WHERE {where};"
+        
+        elif op == 'TRUNCATE':
+            return f"TRUNCATE TABLE {table};"
             
         return f"-- UNKNOWN OPERATION: {op}"
 
@@ -246,6 +549,7 @@ class PITRBackupManager:
         """Write standard PostgreSQL headers to the SQL backup file"""
         headers = [
             "-- PostgreSQL CDC Incremental Backup",
+            PG_LSN_MARKER,
             "-- RESTORE INSTRUCTION: Use 'psql -f <filename>' to restore this file.",
             "-- DO NOT USE pg_restore.",
             f"-- Generated: {datetime.now().isoformat()}",
@@ -259,34 +563,25 @@ class PITRBackupManager:
             "\n"
         ]
         
-        open_func = gzip.open if PITR_CONFIG['compression_enabled'] else open
-        mode = 'wt' if PITR_CONFIG['compression_enabled'] else 'w'
-        
-        with open_func(self.current_backup_file, mode, encoding='utf-8') as f:
-            f.write("\n".join(headers))
+        self.segment_writer.write("\n".join(headers))
 
     def _write_sql(self, changes: List[dict]):
-        """Write changes as SQL comments and statements wrapped in a transaction"""
-        open_func = gzip.open if PITR_CONFIG['compression_enabled'] else open
-        mode = 'at' if PITR_CONFIG['compression_enabled'] else 'a'
-        
-        with open_func(self.current_backup_file, mode, encoding='utf-8') as f:
-            f.write("BEGIN;\n\n")
-            for change in changes:
+        """Write changes as SQL comments and statements, one transaction block per source transaction"""
+        parts = []
+        for _, tx_changes in groupby(changes, key=lambda c: c['txid']):
+            parts.append("BEGIN;\n\n")
+            for change in tx_changes:
                 sql = self._generate_sql(change)
                 # Combined metadata comment for PITR parsing
-                meta = f"-- LSN: {change['lsn']}, TXID: {change['txid']}, TS: {change['timestamp']}"
-                f.write(f"{meta}\n{sql}\n\n")
-            f.write("COMMIT;\n\n")
+                meta = f"-- LSN: {format_lsn(change['lsn'])}, TXID: {change['txid']}, TS: {change['timestamp']}"
+                parts.append(f"{meta}\n{sql}\n\n")
+            parts.append("COMMIT;\n\n")
+        
+        self.segment_writer.write(''.join(parts))
     
     def _write_jsonl(self, changes: List[dict]):
         """Write changes in JSON Lines format"""
-        open_func = gzip.open if PITR_CONFIG['compression_enabled'] else open
-        mode = 'at' if PITR_CONFIG['compression_enabled'] else 'a'
-        
-        with open_func(self.current_backup_file, mode, encoding='utf-8') as f:
-            for change in changes:
-                f.write(json.dumps(change) + '\n')
+        self.segment_writer.write(''.join(json.dumps(change) + '\n' for change in changes))
     
     def _write_json(self, changes: List[dict]):
         """Write changes as JSON array (Warning: inefficient for large backups)"""
@@ -360,11 +655,18 @@ class PITRBackupManager:
     
     def _should_rotate_backup(self) -> bool:
         """Check if backup file should be rotated"""
-        if not self.current_backup_file.exists():
+        if self.segment_writer is not None:
+            # The writer counts its own bytes, no stat() needed
+            if self.segment_writer.is_new:
+                return False
+            size_bytes = self.segment_writer.size
+        elif self.current_backup_file.exists():
+            size_bytes = self.current_backup_file.stat().st_size
+        else:
             return False
         
         # Check file size
-        size_mb = self.current_backup_file.stat().st_size / (1024 * 1024)
+        size_mb = size_bytes / (1024 * 1024)
         if size_mb >= PITR_CONFIG['max_backup_size_mb']:
             return True
         
@@ -378,9 +680,10 @@ class PITRBackupManager:
     
     def _rotate_backup_file(self):
         """Rotate to a new backup file"""
-        # Flush any remaining changes
-        if self.change_buffer:
-            self._flush_buffer()
+        # Called from _write_batch: the pending batch goes to the new file
+        
+        # Flush, fsync and close the segment before anything refers to it
+        self._seal_segment()
         
         # Finalize current backup metadata
         self._finalize_backup_metadata()
@@ -389,6 +692,49 @@ class PITRBackupManager:
         self._initialize_backup_file()
         
         self.logger.info("Rotated to new backup file")
+        self._notify_segment_sealed()
+    
+    def add_seal_listener(self, callback: Callable[[], Any]):
+        """Register a callback to run whenever a backup segment is sealed"""
+        self.seal_listeners.append(callback)
+    
+    def _notify_segment_sealed(self):
+        for callback in self.seal_listeners:
+            try:
+                callback()
+            except Exception as e:
+                self.logger.error(f"Error in segment seal listener: {e}")
+    
+    def _seal_segment(self):
+        """Close the current segment writer (flush + fsync)"""
+        if self.binary_writer is not None:
+            # Footer index goes in before the segment is sealed
+            self.binary_writer.seal()
+        if self.segment_writer is not None:
+            self.segment_writer.close()
+        else:
+            self.sync()
+    
+    def sync(self) -> bool:
+        """
+        fsync the current backup file so flushed changes survive a crash
+        
+        Returns:
+            True if the file is on stable storage (or does not exist yet)
+        """
+        try:
+            if self.segment_writer is not None:
+                self.segment_writer.fsync()
+                return True
+            if self.current_backup_file is None or not self.current_backup_file.exists():
+                return True
+            # Opened for append so the handle is writable on Windows as well
+            with open(self.current_backup_file, 'ab') as f:
+                os.fsync(f.fileno())
+            return True
+        except Exception as e:
+            self.logger.error(f"Error syncing backup file: {e}")
+            return False
     
     def _finalize_backup_metadata(self):
         """Finalize and save backup metadata"""
@@ -401,17 +747,14 @@ class PITRBackupManager:
         )
 
         # Populate lineage information (parent/base/chain depth)
-        if self.backup_catalog:
+        latest = self.backup_catalog.latest()
+        if latest:
             try:
-                latest = max(
-                    self.backup_catalog,
-                    key=lambda b: b.get('end_time', b.get('start_time'))
-                )
                 self.current_backup_metadata['parent_backup_id'] = latest.get('backup_id')
                 self.current_backup_metadata['base_backup_id'] = latest.get('base_backup_id', latest.get('backup_id'))
                 self.current_backup_metadata['chain_depth'] = latest.get('chain_depth', 0) + 1
             except Exception:
-                # Fallback if catalog entries lack times
+                # Fallback if catalog entries lack lineage
                 self.current_backup_metadata['parent_backup_id'] = None
                 self.current_backup_metadata['base_backup_id'] = self.current_backup_metadata['backup_id']
                 self.current_backup_metadata['chain_depth'] = 0
@@ -455,29 +798,13 @@ class PITRBackupManager:
             json.dump(self.current_backup_metadata, f, indent=2)
         
         # Update catalog
-        self.backup_catalog.append(self.current_backup_metadata.copy())
-        self._save_backup_catalog()
+        self.backup_catalog.add(self.current_backup_metadata)
         
         self.logger.info(
             f"Finalized backup {self.current_backup_metadata['backup_id']} "
             f"({self.current_backup_metadata['changes_count']} changes)"
         )
     
-    def _load_backup_catalog(self) -> List[dict]:
-        """Load backup catalog from disk"""
-        catalog_file = self.metadata_dir / "backup_catalog.json"
-        
-        if catalog_file.exists():
-            try:
-                with open(catalog_file, 'r') as f:
-                    catalog = json.load(f)
-                self.logger.info(f"Loaded backup catalog with {len(catalog)} entries")
-                return catalog
-            except Exception as e:
-                self.logger.error(f"Error loading backup catalog: {e}")
-        
-        return []
-    
     def _check_pg_tools(self):
         """Check if required PostgreSQL tools are available"""
         import subprocess
@@ -488,12 +815,13 @@ class PITRBackupManager:
         except (subprocess.CalledProcessError, FileNotFoundError):
             return False
 
-    def get_latest_base_backup(self, before_timestamp: datetime = None) -> Optional[dict]:
+    def get_latest_base_backup(self, before_timestamp: datetime = None, max_lsn: LSN = None) -> Optional[dict]:
         """
         Get the latest base backup metadata
         
         Args:
             before_timestamp: Optional timestamp to limit the search (find latest BEFORE this time)
+            max_lsn: Optional LSN; bases anchored to a later snapshot LSN are skipped
             
         Returns:
             Base backup metadata or None
@@ -515,37 +843,70 @@ class PITRBackupManager:
         # Sort by timestamp (newest first)
         base_backups.sort(key=lambda x: x['timestamp'], reverse=True)
         
-        # Filter if timestamp provided
-        if before_timestamp:
-            for backup in base_backups:
-                backup_time = datetime.fromisoformat(backup['timestamp'])
-                if backup_time < before_timestamp:
+        max_lsn = to_lsn(max_lsn)
+        for backup in base_backups:
+            if max_lsn is not None and backup.get('snapshot_lsn'):
+                # Anchored base: usable if its snapshot is not past the LSN,
+                # whenever the dump itself finished
+                if parse_lsn(backup['snapshot_lsn']) <= max_lsn:
                     return backup
-            return None
-        
-        return base_backups[0]
+            elif not before_timestamp or datetime.fromisoformat(backup['timestamp']) < before_timestamp:
+                # Filter if timestamp provided
+                return backup
+        return None
 
 
-    def create_base_backup(self, target_db: str, output_path: str = None) -> dict:
+    def create_base_backup(
+        self,
+        target_db: str,
+        output_path: str = None,
+        backup_format: str = None,
+        jobs: int = None
+    ) -> dict:
         """
         Create a full base snapshot using pg_dump
         
+        The 'directory' format dumps one file per table with jobs parallel
+        pg_dump workers, and restores with pg_restore -j; its metadata
+        records the size of each table's data file.
+        
+        The 'copy' format always includes table data: pg_dump writes the
+        schema and jobs BaseSnapshotDumper connections COPY the tables out
+        of the same snapshot, in parallel; its metadata records the rows
+        and bytes of each table.
+        
+        With base_backup_export_snapshot, the dump reads the snapshot
+        exported by a temporary replication slot, and the slot's consistent
+        point is recorded as 'snapshot_lsn': the snapshot holds exactly the
+        transactions that committed at or before it. A base with table data
+        that cannot be anchored this way is refused, since a restore would
+        replay changes its rows already hold.
+        
         Args:
             target_db: Database to back up
-            output_path: Optional path for the snapshot file
+            output_path: Optional path for the snapshot file (directory)
+            backup_format: 'custom', 'directory' or 'plain' (default base_backup_format)
+            jobs: pg_dump jobs of a 'directory' snapshot, COPY workers of a
+                'copy' one (default base_backup_jobs)
             
         Returns:
             Snapshot metadata
         """
+        import shutil
         import subprocess
         
         if not self._check_pg_tools():
             raise RuntimeError("pg_dump/psql not found. Please ensure PostgreSQL bin folder is in your PATH.")
+        
+        backup_format = backup_format or PITR_CONFIG.get('base_backup_format', 'custom')
+        if backup_format not in BASE_BACKUP_FORMATS:
+            raise ValueError(f"Unknown base backup format: {backup_format}")
+        jobs = jobs or PITR_CONFIG.get('base_backup_jobs', 4)
+        pg_format, ext = BASE_BACKUP_FORMATS[backup_format]
             
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         if not output_path:
-            ext = 'dump' if PITR_CONFIG.get('base_backup_format') == 'custom' else 'sql'
-            output_path = self.backup_dir / f"base_snapshot_{timestamp}.{ext}"
+            output_path = self.backup_dir / f"base_snapshot_{timestamp}{ext}"
         else:
             output_path = Path(output_path)
             
@@ -557,25 +918,80 @@ class PITRBackupManager:
             '-h', DB_CONFIG.get('host', '127.0.0.1'),
             '-p', str(DB_CONFIG.get('port', 5432)),
             '--clean', '--if-exists', # Add clean commands for easier restore
-            '--schema-only', # Often preferred for CDC targets, or remove for full
-            '-F', 'c' if PITR_CONFIG.get('base_backup_format') == 'custom' else 'p', # Custom format for pg_restore
-            '-f', str(output_path),
-            target_db
+            '-F', pg_format, # Custom / directory format for pg_restore
+            '-f', str(output_path / SCHEMA_FILE if backup_format == 'copy' else output_path)
         ]
+        schema_only = PITR_CONFIG.get('base_backup_schema_only')
+        if schema_only is None:
+            # Parallel jobs only split table data: directory snapshots include it
+            schema_only = backup_format != 'directory'
+        if backup_format == 'copy':
+            # Table data is copied by the workers; split the schema around it
+            schema_only = False
+            cmd.extend(['--section=pre-data', '--section=post-data'])
+        elif schema_only:
+            # Often preferred for CDC targets, or disable for full
+            cmd.append('--schema-only')
+        if backup_format == 'directory':
+            # One table per job
+            cmd.extend(['-j', str(jobs)])
+            if schema_only:
+                self.logger.warning("base_backup_schema_only is set: -j has no effect on a schema-only directory dump")
+        
+        # Dump the snapshot of a replication slot, so the base lines up with an LSN
+        slot_conn, snapshot_name, snapshot_lsn = None, None, None
+        export_error = "base_backup_export_snapshot is disabled"
+        if PITR_CONFIG.get('base_backup_export_snapshot', True):
+            try:
+                slot_conn, snapshot_name, snapshot_lsn = self._export_snapshot(target_db, timestamp)
+                cmd.append(f'--snapshot={snapshot_name}')
+            except Exception as e:
+                export_error = e
+        if snapshot_lsn is None:
+            if not schema_only:
+                # A restore would replay every change on top of rows already in the base
+                raise RuntimeError(
+                    f"Cannot anchor a base backup with table data to an LSN ({export_error}); "
+                    f"grant the REPLICATION attribute, or take a schema-only base "
+                    f"(base_backup_schema_only = True, not the 'copy' format)"
+                )
+            self.logger.warning(f"Could not export a slot snapshot, base backup will not be LSN-anchored: {export_error}")
+        
+        dumper = None
+        if backup_format == 'copy':
+            output_path.mkdir(parents=True, exist_ok=True)
+            dumper = BaseSnapshotDumper(target_db, output_path, workers=jobs)
+        cmd.append(target_db)
         
         # Note: This assumes pg_dump can access via PGPASSWORD or .pgpass
         # In a real environment, we'd handle authentication more securely
         env = os.environ.copy()
         if DB_CONFIG.get('password'):
             env['PGPASSWORD'] = DB_CONFIG['password']
+        
+        def remove_output():
+            if output_path.is_dir():
+                shutil.rmtree(output_path, ignore_errors=True)
+            elif output_path.exists():
+                output_path.unlink()
             
         try:
-            subprocess.run(cmd, env=env, check=True, capture_output=True)
+            try:
+                subprocess.run(cmd, env=env, check=True, capture_output=True)
+                if dumper is not None:
+                    tables = dumper.dump(snapshot_name)
+            finally:
+                if slot_conn is not None:
+                    # Drops the temporary slot and releases the snapshot
+                    slot_conn.close()
             
-            # Verify file size
-            if not output_path.exists() or output_path.stat().st_size == 0:
-                if output_path.exists():
-                    output_path.unlink()
+            # Verify file size (a directory archive always has a table of contents)
+            written = {
+                'directory': output_path / 'toc.dat',
+                'copy': output_path / SCHEMA_FILE
+            }.get(backup_format, output_path)
+            if not written.exists() or written.stat().st_size == 0:
+                remove_output()
                 raise RuntimeError("pg_dump created an empty file (backup failed silently?)")
                 
             snapshot_metadata = {
@@ -583,34 +999,97 @@ class PITRBackupManager:
                 'timestamp': datetime.now().isoformat(),
                 'database': target_db,
                 'filename': output_path.name,
-                'path': str(output_path)
+                'path': str(output_path),
+                'format': backup_format,
+                'schema_only': schema_only,
+                'snapshot_lsn': format_lsn(snapshot_lsn) if snapshot_lsn is not None else None
             }
+            if backup_format in ('directory', 'copy'):
+                if backup_format == 'directory':
+                    tables = self._snapshot_table_files(output_path, env)
+                else:
+                    snapshot_metadata['rows'] = sum(table['rows'] for table in tables.values())
+                    snapshot_metadata['sequences'] = dumper.sequences
+                snapshot_metadata['jobs'] = jobs
+                snapshot_metadata['tables'] = tables
+                snapshot_metadata['size_bytes'] = sum(f.stat().st_size for f in output_path.iterdir())
+            else:
+                snapshot_metadata['size_bytes'] = output_path.stat().st_size
             
             # Save metadata
             meta_file = self.metadata_dir / f"base_snapshot_{timestamp}_meta.json"
             with open(meta_file, 'w') as f:
                 json.dump(snapshot_metadata, f, indent=2)
                 
-            self.logger.info(f"Base backup created successfully: {output_path} ({output_path.stat().st_size} bytes)")
+            self.logger.info(f"Base backup created successfully: {output_path} ({snapshot_metadata['size_bytes']} bytes)")
             return snapshot_metadata
             
         except subprocess.CalledProcessError as e:
-            if output_path.exists():
-                output_path.unlink()
+            remove_output()
             error_msg = e.stderr.decode()
             self.logger.error(f"Error creating base backup: {error_msg}")
             raise RuntimeError(f"pg_dump failed: {error_msg}")
-
-    def _save_backup_catalog(self):
-        """Save backup catalog to disk"""
-        catalog_file = self.metadata_dir / "backup_catalog.json"
+        except psycopg2.Error as e:
+            remove_output()
+            self.logger.error(f"Error copying base backup tables: {e}")
+            raise RuntimeError(f"Base snapshot COPY failed: {e}")
+        except RuntimeError:
+            remove_output()
+            raise
+    
+    def _export_snapshot(self, target_db: str, timestamp: str):
+        """
+        Create a temporary logical slot that exports its snapshot
+        
+        The snapshot stays usable (pg_dump --snapshot) until the returned
+        connection is closed or used again.
+        
+        Returns:
+            (replication connection, snapshot name, consistent point LSN)
+        """
+        from psycopg2.extras import LogicalReplicationConnection
         
+        conn_params = DB_CONFIG.copy()
+        conn_params['dbname'] = target_db
+        conn = psycopg2.connect(connection_factory=LogicalReplicationConnection, **conn_params)
         try:
-            with open(catalog_file, 'w') as f:
-                json.dump(self.backup_catalog, f, indent=2)
-        except Exception as e:
-            self.logger.error(f"Error saving backup catalog: {e}")
+            cur = conn.cursor()
+            cur.execute(
+                f"CREATE_REPLICATION_SLOT cdc_base_{timestamp} TEMPORARY LOGICAL "
+                f"{REPLICATION_CONFIG.get('output_plugin', 'pgoutput')} EXPORT_SNAPSHOT"
+            )
+            _, consistent_point, snapshot_name, _ = cur.fetchone()
+        except Exception:
+            conn.close()
+            raise
+        
+        snapshot_lsn = parse_lsn(consistent_point)
+        self.logger.info(f"Exported snapshot {snapshot_name} at LSN {format_lsn(snapshot_lsn)}")
+        return conn, snapshot_name, snapshot_lsn
     
+    def _snapshot_table_files(self, archive: Path, env: dict) -> Dict[str, dict]:
+        """
+        Data file and size of each table of a directory-format archive
+        
+        Table data entries of the archive's table of contents (pg_restore -l)
+        name their dump ID, which is the stem of the table's data file.
+        """
+        import subprocess
+        
+        listing = subprocess.run(
+            ['pg_restore', '-l', str(archive)], env=env, check=True, capture_output=True
+        ).stdout.decode('utf-8', errors='replace')
+        
+        tables = {}
+        for line in listing.splitlines():
+            match = TOC_TABLE_DATA.match(line)
+            if not match:
+                continue
+            dump_id, schema, name = match.groups()
+            for data_file in archive.glob(f"{dump_id}.dat*"):
+                tables[f"{schema}.{name}"] = {'file': data_file.name, 'bytes': data_file.stat().st_size}
+        return tables
+
     def create_backup_point(self, label: str, description: str = "") -> dict:
         """
         Create a named backup point for easy recovery
@@ -623,8 +1102,10 @@ class PITRBackupManager:
             Backup point metadata
         """
         # Flush current buffer
-        with self.buffer_lock:
-            self._flush_buffer()
+        self._drain()
+        with self.flush_lock:
+            if self.segment_writer is not None:
+                self.segment_writer.flush()
         
         backup_point = {
             'label': label,
@@ -652,10 +1133,7 @@ class PITRBackupManager:
     
     def get_backup_metadata(self, backup_id: str) -> Optional[dict]:
         """Get metadata for a specific backup"""
-        for backup in self.backup_catalog:
-            if backup['backup_id'] == backup_id:
-                return backup
-        return None
+        return self.backup_catalog.get(backup_id)
     
     def list_backups_in_range(
         self, 
@@ -672,30 +1150,51 @@ class PITRBackupManager:
         Returns:
             List of backup metadata
         """
-        matching_backups = []
-        
-        for backup in self.backup_catalog:
-            backup_time = datetime.fromisoformat(backup['start_time'])
-            
-            if start_time and backup_time < start_time:
-                continue
-            if end_time and backup_time > end_time:
-                continue
-            
-            matching_backups.append(backup)
-        
-        return sorted(matching_backups, key=lambda x: x['start_time'])
+        return self.backup_catalog.list_range(start_time, end_time)
     
-    def get_changes_from_backup(self, backup_id: str) -> List[dict]:
+    def get_changes_from_backup(
+        self,
+        backup_id: str,
+        start_lsn: LSN = None,
+        end_lsn: LSN = None,
+        start_time: datetime = None,
+        end_time: datetime = None
+    ) -> List[dict]:
         """
-        Read all changes from a specific backup file
+        Read changes from a specific backup file
+        
+        Binary segments only decode the blocks that overlap the requested
+        range; text formats are read in full and filtered.
         
         Args:
             backup_id: Backup ID
+            start_lsn: Optional lowest LSN (inclusive)
+            end_lsn: Optional highest LSN (inclusive)
+            start_time: Optional earliest change timestamp (inclusive)
+            end_time: Optional latest change timestamp (inclusive)
         
         Returns:
             List of change records
         """
+        return list(self.iter_changes_from_backup(backup_id, start_lsn, end_lsn, start_time, end_time))
+    
+    def iter_changes_from_backup(
+        self,
+        backup_id: str,
+        start_lsn: LSN = None,
+        end_lsn: LSN = None,
+        start_time: datetime = None,
+        end_time: datetime = None
+    ) -> Iterator[dict]:
+        """
+        Yield changes from a specific backup file in file order
+        
+        Same ranges as get_changes_from_backup, but records are decoded as
+        they are consumed: binary segments block by block, text segments
+        line by line (compressed ones a batch of gzip blocks at a time), so
+        memory does not grow with the segment. Only the 'json' format is
+        parsed in one piece.
+        """
         metadata = self.get_backup_metadata(backup_id)
         if not metadata:
             raise ValueError(f"Backup {backup_id} not found")
@@ -704,65 +1203,180 @@ class PITRBackupManager:
         if not backup_file.exists():
             raise FileNotFoundError(f"Backup file {metadata['filename']} not found")
         
-        open_func = gzip.open if metadata['compressed'] else open
-        mode = 'rt'
-        
-        changes = []
+        if metadata['format'] == 'binary':
+            with BinarySegmentReader(backup_file) as reader:
+                yield from reader.read_changes(
+                    start_lsn=to_lsn(start_lsn),
+                    end_lsn=to_lsn(end_lsn),
+                    start_time=start_time,
+                    end_time=end_time
+                )
+            return
         
+        low = to_lsn(start_lsn)
+        high = to_lsn(end_lsn)
         try:
-            with open_func(backup_file, mode, encoding='utf-8') as f:
-                if metadata['format'] == 'jsonl':
-                    for line in f:
-                        if line.strip():
-                            changes.append(json.loads(line))
-                elif metadata['format'] == 'sql':
-                    changes = self._read_sql(f)
-                else:
-                    changes = json.load(f)
+            if metadata['compressed'] and is_block_compressed(backup_file):
+                # Decompress blocks in parallel batches instead of one gzip stream
+                with BlockCompressedReader(backup_file) as reader:
+                    changes = self._parse_changes(_iter_lines(reader.iter_blocks()), metadata['format'])
+                    yield from self._filter_changes(changes, low, high, start_time, end_time)
+            else:
+                open_func = gzip.open if metadata['compressed'] else open
+                with open_func(backup_file, 'rt', encoding='utf-8') as f:
+                    changes = self._parse_changes(f, metadata['format'])
+                    yield from self._filter_changes(changes, low, high, start_time, end_time)
         except Exception as e:
             self.logger.error(f"Error reading backup {backup_id}: {e}")
             raise
-        
-        return changes
+    
+    @staticmethod
+    def _filter_changes(
+        changes: Iterable[dict],
+        low: Optional[LSN],
+        high: Optional[LSN],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime]
+    ) -> Iterator[dict]:
+        """Yield the changes within an LSN and time range"""
+        for change in changes:
+            if low is not None and change['lsn'] < low:
+                continue
+            if high is not None and change['lsn'] > high:
+                continue
+            if start_time or end_time:
+                change_time = datetime.fromisoformat(change['timestamp'])
+                if (start_time and change_time < start_time) or (end_time and change_time > end_time):
+                    continue
+            yield change
 
-    def _read_sql(self, file_handle) -> List[dict]:
+    def compact_backup(self, backup_id: str, output_path: str = None) -> dict:
+        """
+        Write a compacted copy of a segment with one net change per row
+        
+        The segment's committed changes are folded by ChangeCoalescer
+        (insert+updates -> insert, insert+delete -> nothing, repeated
+        updates -> one update) and written in the segment's own format and
+        compression. Changes of rolled-back transactions are dropped. The
+        copy is not added to the catalog.
+        
+        Args:
+            backup_id: Backup ID
+            output_path: Output file (default: <name>_compacted next to the segment)
+        
+        Returns:
+            Dictionary with the output path and change counts
+        """
+        metadata = self.get_backup_metadata(backup_id)
+        if not metadata:
+            raise ValueError(f"Backup {backup_id} not found")
+        if metadata['format'] == 'sql':
+            # SQL segments keep statements, not row data, so rows cannot be folded
+            raise ValueError(f"Backup {backup_id} is in SQL format and cannot be compacted")
+        
+        if output_path:
+            output_file = Path(output_path)
+        else:
+            stem, _, suffix = metadata['filename'].partition('.')
+            output_file = self.backup_dir / f"{stem}_compacted.{suffix}"
+        if output_file.exists():
+            raise FileExistsError(f"{output_file} already exists")
+        
+        # A transaction commits after its last change, so the segment's last
+        # transactions commit past its end_lsn: look up the commits of the
+        # segment's own transactions, at or after its first change
+        txids = metadata.get('transactions') or {change['txid'] for change in self.iter_changes_from_backup(backup_id)}
+        commit_lsns = self.transaction_manager.get_commit_lsns_of(txids, metadata.get('start_lsn'))
+        committed = (
+            change for change in self.iter_changes_from_backup(backup_id)
+            if change['txid'] in commit_lsns
+        )
+        coalescer = ChangeCoalescer(self.table_keys)
+        
+        writer = SegmentWriter(output_file, compressed=metadata['compressed'])
+        try:
+            if metadata['format'] == 'binary':
+                binary_writer = BinarySegmentWriter(writer)
+                for change in coalesce(committed, coalescer=coalescer):
+                    binary_writer.append(change)
+                binary_writer.seal()
+            elif metadata['format'] == 'jsonl':
+                for change in coalesce(committed, coalescer=coalescer):
+                    writer.write(json.dumps(change) + '\n')
+            else:
+                separator = '[\n'
+                for change in coalesce(committed, coalescer=coalescer):
+                    writer.write(separator + json.dumps(change))
+                    separator = ',\n'
+                writer.write('[\n]' if separator == '[\n' else '\n]')
+        finally:
+            writer.close()
+        
+        self.logger.info(
+            f"Compacted backup {backup_id}: {coalescer.stats['changes_in']} -> "
+            f"{coalescer.stats['changes_out']} changes in {output_file.name}"
+        )
+        return {
+            'backup_id': backup_id,
+            'path': str(output_file),
+            'format': metadata['format'],
+            'changes_in': coalescer.stats['changes_in'],
+            'changes_out': coalescer.stats['changes_out']
+        }
+    
+    def _parse_changes(self, lines: Iterable[str], format_type: str) -> Iterator[dict]:
+        """Parse change records from the lines of a text backup file"""
+        if format_type == 'sql':
+            yield from self._read_sql(lines)
+            return
+        if format_type == 'jsonl':
+            changes = (json.loads(line) for line in lines if line.strip())
+        else:
+            changes = json.loads(''.join(lines))
+        # Segments written before LSNs were stored as ints carry decimal 'hi/lo' text
+        for change in changes:
+            change['lsn'] = parse_lsn(change['lsn'], legacy=True)
+            yield change
+    
+    def _read_sql(self, lines: Iterable[str]) -> Iterator[dict]:
         """Parse SQL file back into change records for PITR processing"""
-        changes = []
         current_meta = None
         
         import re
         # Pattern to match -- LSN: ..., TXID: ..., TS: ...
         meta_pattern = re.compile(r"-- LSN: (.*?), TXID: (.*?), TS: (.*)")
+        # Segments without the marker header wrote decimal 'hi/lo' LSNs
+        legacy = True
         
-        for line in file_handle:
+        for line in lines:
             line = line.strip()
             if not line:
                 continue
                 
-            if line.startswith("-- LSN:"):
+            if line == PG_LSN_MARKER:
+                legacy = False
+            elif line.startswith("-- LSN:"):
                 match = meta_pattern.search(line)
                 if match:
                     current_meta = {
-                        'lsn': match.group(1),
+                        'lsn': parse_lsn(match.group(1), legacy),
                         'txid': int(match.group(2)),
                         'timestamp': match.group(3)
                     }
-            elif current_meta and (line.startswith("INSERT") or line.startswith("UPDATE") or line.startswith("DELETE")):
+            elif current_meta and line.startswith(("INSERT", "UPDATE", "DELETE", "TRUNCATE")):
                 # For restoration, we mainly care about the LSN, TxID, and the SQL itself
                 # We can store the SQL in a special field 'sql' which RestoreManager can use
                 change = current_meta.copy()
                 change['sql'] = line
                 # We also try to extract the table name for filtering
-                table_match = re.search(r"(?:INSERT INTO|UPDATE|DELETE FROM)\s+(\S+)", line, re.I)
+                table_match = re.search(r"(?:INSERT INTO|UPDATE|DELETE FROM|TRUNCATE TABLE)\s+([^\s;]+)", line, re.I)
                 change['table'] = table_match.group(1) if table_match else 'unknown'
                 # operation
-                op_match = re.match(r"(INSERT|UPDATE|DELETE)", line, re.I)
+                op_match = re.match(r"(INSERT|UPDATE|DELETE|TRUNCATE)", line, re.I)
                 change['operation'] = op_match.group(1).upper() if op_match else 'UNKNOWN'
                 
-                changes.append(change)
+                yield change
                 current_meta = None # Wait for next metadata comment
-                
-        return changes
     
     def cleanup_old_backups(self, retention_days: int = None):
         """
@@ -772,82 +1386,99 @@ class PITRBackupManager:
             retention_days: Number of days to retain backups
         """
         retention_days = retention_days or PITR_CONFIG['retention_days']
-        cutoff_time = datetime.now().timestamp() - (retention_days * 86400)
+        cutoff_time = datetime.now() - timedelta(days=retention_days)
         
         removed_backups = []
         
-        for backup in self.backup_catalog[:]:
-            backup_time = datetime.fromisoformat(backup['start_time']).timestamp()
+        for backup in self.backup_catalog.list_older_than(cutoff_time):
+            # Remove backup file
+            backup_file = self.backup_dir / backup['filename']
+            if backup_file.exists():
+                backup_file.unlink()
             
-            if backup_time < cutoff_time:
-                # Remove backup file
-                backup_file = self.backup_dir / backup['filename']
-                if backup_file.exists():
-                    backup_file.unlink()
-                
-                # Remove metadata file
-                metadata_file = self.metadata_dir / f"{backup['backup_id']}_metadata.json"
-                if metadata_file.exists():
-                    metadata_file.unlink()
-                
-                removed_backups.append(backup['backup_id'])
-                self.backup_catalog.remove(backup)
+            # Remove block index of a compressed segment
+            block_index = index_path(backup_file)
+            if block_index.exists():
+                block_index.unlink()
+            
+            # Remove metadata file
+            metadata_file = self.metadata_dir / f"{backup['backup_id']}_metadata.json"
+            if metadata_file.exists():
+                metadata_file.unlink()
+            
+            removed_backups.append(backup['backup_id'])
+            self.backup_catalog.remove(backup['backup_id'])
         
         if removed_backups:
-            self._save_backup_catalog()
             self.logger.info(f"Removed {len(removed_backups)} old backups")
         
         return removed_backups
     
     def get_statistics(self) -> dict:
         """Get backup statistics"""
-        total_changes = sum(b['changes_count'] for b in self.backup_catalog)
-        total_size = sum(
-            (self.backup_dir / b['filename']).stat().st_size 
-            for b in self.backup_catalog 
-            if (self.backup_dir / b['filename']).exists()
-        )
+        totals = self.backup_catalog.totals()
         
         return {
-            'total_backups': len(self.backup_catalog),
-            'total_changes': total_changes,
-            'total_size_mb': total_size / (1024 * 1024),
+            'total_backups': totals['backups'],
+            'total_changes': totals['changes'],
+            'total_size_mb': totals['size_bytes'] / (1024 * 1024),
             'current_backup_changes': self.current_backup_metadata['changes_count'],
-            'buffered_changes': len(self.change_buffer)
+            'buffered_changes': len(self.change_buffer),
+            'buffer_lock': self.buffer_lock.get_statistics(),
+            'producer_drains': self.producer_drains,
+            'segment_writer': self.segment_writer.get_statistics() if self.segment_writer else None,
+            'group_commit': {
+                'durability': self.commit_durability,
+                'open_group_transactions': self.pending_commits,
+                **self.group_stats
+            }
         }
     
-    def force_flush(self):
-        """Force flush of buffered changes"""
-        with self.buffer_lock:
-            self._flush_buffer()
+    def force_flush(self) -> bool:
+        """
+        Force flush of buffered changes
+        
+        Returns:
+            True if all buffered changes were written
+        """
+        return self._drain()
     
     def shutdown(self):
         """Graceful shutdown - flush and finalize"""
         self.logger.info("Shutting down PITR Backup Manager")
         self.stop_requested = True
+        self.flush_event.set()
+        self.flush_thread.join(timeout=10)
         
-        with self.buffer_lock:
-            self._flush_buffer()
+        self._drain()
+        with self.flush_lock:
+            self._seal_segment()
             self._finalize_backup_metadata()
         
         self.logger.info("Shutdown complete")
 
     def _background_flush_loop(self):
-        """Background thread loop to flush changes periodically"""
-        import time
+        """Flusher thread: drains sealed batches, closes commit group windows and flushes periodically"""
         self.logger.info("Background flush thread started")
         while not self.stop_requested:
             try:
-                time.sleep(PITR_CONFIG.get('background_flush_interval', 5))
-                
-                # Check if we have data or enough time has passed
-                should_flush = False
-                with self.buffer_lock:
-                    if self.change_buffer and (datetime.now() - self.last_flush_time).seconds >= PITR_CONFIG['flush_interval_seconds']:
-                        should_flush = True
+                # Sleep until the open commit group's window closes, or the regular interval
+                deadline = self.group_deadline
+                if deadline is None:
+                    timeout = PITR_CONFIG.get('background_flush_interval', 5)
+                else:
+                    timeout = max(0.0, deadline - time.monotonic())
+                self.flush_event.wait(timeout)
+                self.flush_event.clear()
                 
-                if should_flush:
+                if self.flush_requested:
+                    self.logger.debug("Background flush triggered by buffer limits")
+                    self._drain()
+                elif self.group_deadline is not None and time.monotonic() >= self.group_deadline:
+                    self.logger.debug("Background flush triggered by group commit window")
+                    self._drain(committed_only=True)
+                elif self.change_buffer and (datetime.now() - self.last_flush_time).seconds >= PITR_CONFIG['flush_interval_seconds']:
                     self.logger.debug("Background flush triggered by interval")
-                    self.force_flush()
+                    self._drain()
             except Exception as e:
                 self.logger.error(f"Error in background flush thread: {e}")
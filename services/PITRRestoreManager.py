@@ -3,17 +3,35 @@ PITR Restore Manager
 Handles point-in-time restoration from CDC backups
 """
 
+import heapq
 import json
 import logging
 import psycopg2
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
-from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from .pitr_config import PITR_CONFIG, DB_CONFIG
 from .PITRBackupManager import PITRBackupManager
 from .TransactionLogManager import TransactionLogManager
+from .LSN import LSN, format_lsn, parse_lsn
+from .BulkApply import BulkApplier
+from .ParallelApply import ParallelApplier
+from .PreparedStatements import PreparedStatementCache
+from .TableKeys import TableKeyCache, key_condition
+from .ChangeCoalescer import coalesce
+from .BaseSnapshot import BaseSnapshotLoader, is_copy_snapshot
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    """Group an iterable into lists of up to size items"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
 
 
 class PITRRestoreManager:
@@ -29,6 +47,8 @@ class PITRRestoreManager:
     ):
         self.backup_manager = backup_manager or PITRBackupManager()
         self.transaction_manager = transaction_manager or TransactionLogManager()
+        # Key columns of the target tables, loaded when a restore connects
+        self.table_keys = TableKeyCache()
         self.logger = self._configure_logger()
     
     def _configure_logger(self) -> logging.Logger:
@@ -58,15 +78,11 @@ class PITRRestoreManager:
             Tuple of (is_valid, message, recovery_point)
         """
         # Find the nearest committed transaction before target time
-        recovery_points = self.transaction_manager.get_consistent_recovery_points(
-            end_time=target_timestamp
-        )
+        nearest_point = self.transaction_manager.get_recovery_point_before(target_timestamp)
         
-        if not recovery_points:
+        if not nearest_point:
             return False, "No recovery points found before target timestamp", None
         
-        # Get the last committed transaction before target
-        nearest_point = recovery_points[-1]
         point_time = datetime.fromisoformat(nearest_point['timestamp'])
         
         # Check if there are active transactions at target time
@@ -129,7 +145,8 @@ class PITRRestoreManager:
         target_timestamp: datetime,
         target_db: str = None,
         tables: List[str] = None,
-        dry_run: bool = False
+        dry_run: bool = False,
+        workers: int = None
     ) -> dict:
         """
         Restore database to a specific point in time
@@ -139,6 +156,7 @@ class PITRRestoreManager:
             target_db: Target database name (if None, uses source DB - DANGEROUS!)
             tables: List of specific tables to restore (if None, restores all)
             dry_run: If True, only simulate the restore
+            workers: Connections to apply changes on (default restore_workers)
         
         Returns:
             Dictionary with restore results
@@ -161,12 +179,18 @@ class PITRRestoreManager:
         preview = self.preview_restore(target_timestamp)
         
         # CHECK FOR BASE BACKUP
-        base_backup = self.backup_manager.get_latest_base_backup(before_timestamp=target_timestamp)
+        base_backup = self.backup_manager.get_latest_base_backup(
+            before_timestamp=target_timestamp,
+            max_lsn=recovery_point['lsn']
+        )
+        base_lsn = self._base_snapshot_lsn(base_backup)
         
         if dry_run:
             self.logger.info("Dry run mode - no changes will be made")
             if base_backup:
                 print(f"      [Dry Run] Would restore base backup: {base_backup['filename']}")
+                if base_lsn is not None:
+                    print(f"      [Dry Run] Would skip transactions committed at or before LSN {format_lsn(base_lsn)}")
             else:
                 print("      [Dry Run] WARNING: No base backup found before target time!")
                 
@@ -191,20 +215,20 @@ class PITRRestoreManager:
         else:
             self.logger.warning("No base backup found! Proceeding with incremental only (might be incomplete).")
         
-        # 2. Apply Incremental Changes
-        changes_to_apply = self._collect_changes_for_restore(
+        # 2. Apply Incremental Changes, streamed from the segments
+        changes_to_apply = self._stream_changes_for_restore(
             recovery_point,
-            tables
+            tables,
+            after_lsn=base_lsn
         )
         
-        self.logger.info(f"Collected {len(changes_to_apply)} changes to apply")
-        
         # Apply changes to target database
         try:
             applied_count = self._apply_changes(
                 changes_to_apply,
                 target_db or DB_CONFIG['dbname'],
-                tables
+                tables,
+                workers
             )
             
             self.logger.info(f"Successfully applied {applied_count} changes")
@@ -215,7 +239,8 @@ class PITRRestoreManager:
                 'changes_applied': applied_count,
                 'tables_restored': list(preview['tables_affected']),
                 'restore_timestamp': recovery_point['timestamp'],
-                'base_backup_restored': base_backup['filename'] if base_backup else None
+                'base_backup_restored': base_backup['filename'] if base_backup else None,
+                'base_snapshot_lsn': format_lsn(base_lsn) if base_lsn is not None else None
             }
         
         except Exception as e:
@@ -228,6 +253,10 @@ class PITRRestoreManager:
     def _restore_base_backup(self, metadata: dict, target_db: str):
         """
         Restore a base backup using pg_restore
+        
+        Custom and directory archives are restored with base_restore_jobs
+        parallel jobs (default: one per CPU); 'copy' snapshots are loaded
+        by BaseSnapshotLoader.
         """
         import subprocess
         import os
@@ -238,7 +267,16 @@ class PITRRestoreManager:
         if not os.path.exists(path):
             raise FileNotFoundError(f"Base backup file not found: {path}")
             
-        if os.path.getsize(path) == 0:
+        if metadata.get('format') == 'copy' or is_copy_snapshot(path):
+            BaseSnapshotLoader(target_db).restore(path)
+            self.logger.info("Base backup restored successfully")
+            return
+        
+        if os.path.isdir(path):
+            # Directory archive: one file per table and a table of contents
+            if not os.path.exists(os.path.join(path, 'toc.dat')):
+                raise ValueError(f"Base backup directory has no toc.dat: {path}")
+        elif os.path.getsize(path) == 0:
             raise ValueError(f"Base backup file is empty: {path}")
 
         # Determine command based on file extension/format
@@ -266,6 +304,7 @@ class PITRRestoreManager:
                 '-d', target_db,
                 '--clean', # Clean existing objects
                 '--if-exists',
+                '-j', str(PITR_CONFIG.get('base_restore_jobs') or os.cpu_count() or 1),
                 path
             ]
             
@@ -288,38 +327,38 @@ class PITRRestoreManager:
     
     def restore_to_lsn(
         self,
-        target_lsn: str,
+        target_lsn: LSN,
         target_db: str = None,
         tables: List[str] = None,
-        dry_run: bool = False
+        dry_run: bool = False,
+        workers: int = None
     ) -> dict:
         """
         Restore database to a specific LSN
         
+        Restores up to the last transaction that committed at or before
+        target_lsn.
+        
         Args:
-            target_lsn: Target LSN
+            target_lsn: Target LSN (int or 'hi/lo' text)
             target_db: Target database name
             tables: List of specific tables to restore
             dry_run: If True, only simulate the restore
+            workers: Connections to apply changes on (default restore_workers)
         
         Returns:
             Dictionary with restore results
         """
-        self.logger.info(f"Starting PITR restore to LSN {target_lsn}")
-        
-        # Find the transaction that includes this LSN
-        recovery_points = self.transaction_manager.get_consistent_recovery_points()
+        target_lsn = parse_lsn(target_lsn)
+        self.logger.info(f"Starting PITR restore to LSN {format_lsn(target_lsn)}")
         
-        target_point = None
-        for point in recovery_points:
-            if point['lsn'] == target_lsn:
-                target_point = point
-                break
+        # Find the last commit at or before this LSN
+        target_point = self.transaction_manager.get_recovery_point_for_lsn(target_lsn)
         
         if not target_point:
             return {
                 'success': False,
-                'error': f"No recovery point found for LSN {target_lsn}"
+                'error': f"No recovery point found for LSN {format_lsn(target_lsn)}"
             }
         
         # Convert to timestamp-based restore
@@ -329,89 +368,138 @@ class PITRRestoreManager:
             target_timestamp,
             target_db,
             tables,
-            dry_run
+            dry_run,
+            workers
         )
     
-    def _collect_changes_for_restore(
+    def _base_snapshot_lsn(self, base_backup: Optional[dict]) -> Optional[LSN]:
+        """
+        LSN up to which a base backup already holds the committed changes
+        
+        None unless the base has table data and was dumped from a slot's
+        exported snapshot; older and schema-only bases need every change.
+        """
+        if not base_backup or base_backup.get('schema_only', True) or not base_backup.get('snapshot_lsn'):
+            return None
+        return parse_lsn(base_backup['snapshot_lsn'])
+    
+    def _stream_changes_for_restore(
         self,
         recovery_point: dict,
-        tables: List[str] = None
-    ) -> List[dict]:
+        tables: List[str] = None,
+        after_lsn: LSN = None
+    ) -> Iterator[dict]:
         """
-        Collect all changes needed for restore up to recovery point
+        Stream all changes needed for restore up to recovery point
+        
+        Each segment is read lazily and filtered to the transactions that
+        committed by the recovery point. Segments are written in commit
+        order, so the per-segment streams are combined with a k-way merge
+        on (commit LSN, LSN): changes come out in commit order, in LSN
+        order within a transaction, holding one pending change per segment.
+        With restore_coalesce (off by default: folding reorders changes across
+        rows, which can break unique constraints on non-key columns), the
+        merged stream is folded to one net change per row (see ChangeCoalescer).
         
         Args:
             recovery_point: Recovery point metadata
             tables: Optional list of tables to filter
+            after_lsn: Skip transactions committed at or before this LSN
+                (already in the base snapshot)
         
         Returns:
-            List of changes to apply
+            Iterator over the changes to apply
         """
         target_time = datetime.fromisoformat(recovery_point['timestamp'])
+        target_lsn = recovery_point['lsn']
+        table_filter = set(tables) if tables else None
+        
+        # Every transaction that committed up to the recovery point, so each
+        # change is checked with an int comparison and a dict lookup
+        commit_lsns = self.transaction_manager.get_commit_lsns(target_lsn)
+        self.logger.info(f"{len(commit_lsns)} transactions committed up to LSN {format_lsn(target_lsn)}")
+        if after_lsn is not None:
+            # The base snapshot holds exactly the transactions committed by its LSN
+            commit_lsns = {txid: lsn for txid, lsn in commit_lsns.items() if lsn > after_lsn}
+            self.logger.info(
+                f"{len(commit_lsns)} of them committed after the base snapshot LSN {format_lsn(after_lsn)}"
+            )
         
         # Get all backups up to recovery point
         backups = self.backup_manager.list_backups_in_range(end_time=target_time)
         
-        all_changes = []
+        streams = [
+            self._stream_backup(backup['backup_id'], target_lsn, commit_lsns, table_filter)
+            for backup in backups
+        ]
+        merged = heapq.merge(*streams, key=lambda change: (commit_lsns[change['txid']], change['lsn']))
+        if PITR_CONFIG.get('restore_coalesce', False):
+            # One net change per row instead of its whole history; the stream
+            # is consumed after _apply_changes has loaded the table keys
+            return coalesce(merged, table_keys=self.table_keys)
+        return merged
+    
+    def _stream_backup(
+        self,
+        backup_id: str,
+        target_lsn: LSN,
+        commit_lsns: Dict[int, LSN],
+        table_filter: Optional[set]
+    ) -> Iterator[dict]:
+        """
+        Yield the changes of one segment that belong to the restore
         
-        for backup in backups:
-            try:
-                changes = self.backup_manager.get_changes_from_backup(backup['backup_id'])
+        A segment that cannot be read fails the restore: ending its stream
+        early would silently drop the rest of its changes.
+        """
+        try:
+            for change in self.backup_manager.iter_changes_from_backup(backup_id, end_lsn=target_lsn):
+                # Filter by table if specified
+                if table_filter and change['table'] not in table_filter:
+                    continue
                 
-                for change in changes:
-                    # Filter by timestamp
-                    change_time = datetime.fromisoformat(change['timestamp'])
-                    if change_time > target_time:
-                        continue
-                    
-                    # Filter by table if specified
-                    if tables and change['table'] not in tables:
-                        continue
-                    
-                    # Only include committed transactions
-                    if change['txid'] not in recovery_point.get('txid', [recovery_point['txid']]):
-                        # Check if transaction was committed before recovery point
-                        tx_info = self.transaction_manager.get_transaction_info(change['txid'])
-                        if not tx_info or tx_info['status'] != 'COMMITTED':
-                            continue
-                        
-                        tx_time = datetime.fromisoformat(tx_info['end_timestamp'])
-                        if tx_time > target_time:
-                            continue
-                    
-                    all_changes.append(change)
-            
-            except Exception as e:
-                self.logger.error(f"Error reading backup {backup['backup_id']}: {e}")
-        
-        # Sort by LSN to ensure correct order
-        all_changes.sort(key=lambda x: x['lsn'])
+                # Only include transactions committed by the recovery point
+                if change['txid'] not in commit_lsns:
+                    continue
+                
+                yield change
         
-        return all_changes
+        except Exception as e:
+            self.logger.error(f"Error reading backup {backup_id}: {e}")
+            raise RuntimeError(f"Error reading backup {backup_id}: {e}") from e
     
     def _apply_changes(
         self,
-        changes: List[dict],
+        changes: Iterable[dict],
         target_db: str,
-        tables: List[str] = None
+        tables: List[str] = None,
+        workers: int = None
     ) -> int:
         """
         Apply changes to target database
         
+        Changes are consumed in batches of restore_batch_size, in the order
+        given, so memory stays bounded however many changes are replayed.
+        Each batch goes through a BulkApplier (COPY and staged set-based
+        UPDATE/DELETE for runs of similar changes) and everything is
+        committed at the end. With more than one worker, a ParallelApplier
+        applies transactions with disjoint writesets concurrently instead,
+        committing as it goes.
+        
         Args:
-            changes: List of changes to apply
+            changes: Changes to apply, in replay order
             target_db: Target database name
             tables: Optional list of tables to filter
+            workers: Connections to apply changes on (default restore_workers)
         
         Returns:
             Number of changes applied
         """
-        # Group changes by table for efficient processing
-        changes_by_table = defaultdict(list)
-        for change in changes:
-            if tables and change['table'] not in tables:
-                continue
-            changes_by_table[change['table']].append(change)
+        table_filter = set(tables) if tables else None
+        if table_filter:
+            changes = (change for change in changes if change['table'] in table_filter)
+        batch_size = PITR_CONFIG.get('restore_batch_size', 1000)
+        workers = workers or PITR_CONFIG.get('restore_workers', 1)
         
         # Connect to target database
         conn_params = DB_CONFIG.copy()
@@ -420,39 +508,39 @@ class PITRRestoreManager:
         conn = psycopg2.connect(**conn_params)
         conn.autocommit = False
         
+        # Match rows on the target's key columns, not on their first column
+        self._load_table_keys(conn)
+        
+        if workers > 1:
+            conn.close()
+            applier = ParallelApplier(
+                lambda: psycopg2.connect(**conn_params),
+                self._apply_change,
+                workers,
+                table_keys=self.table_keys
+            )
+            applied_count = applier.apply(changes)
+            self.logger.info(
+                f"Committed {applied_count} changes on {workers} connections "
+                f"({applier.stats}, {applier.apply_stats}, keys: {self.table_keys.get_statistics()})"
+            )
+            return applied_count
+        
         applied_count = 0
         
         try:
             cursor = conn.cursor()
+            applier = BulkApplier(cursor, self._apply_change, table_keys=self.table_keys)
             
-            for table_name, table_changes in changes_by_table.items():
-                self.logger.info(f"Applying {len(table_changes)} changes to {table_name}")
-                
-                for change in table_changes:
-                    try:
-                        # If the change already has the SQL generated (SQL format backup)
-                        if 'sql' in change:
-                            cursor.execute(change['sql'])
-                        else:
-                            # Fallback to manual generation for JSON/JSONL formats
-                            if change['operation'] == 'INSERT':
-                                self._apply_insert(cursor, table_name, change['data'])
-                            elif change['operation'] == 'UPDATE':
-                                self._apply_update(cursor, table_name, change['data'], change.get('old_data'))
-                            elif change['operation'] == 'DELETE':
-                                self._apply_delete(cursor, table_name, change.get('old_data') or change['data'])
-                        
-                        applied_count += 1
-                    
-                    except Exception as e:
-                        self.logger.error(
-                            f"Error applying change to {table_name}: {e}\n"
-                            f"Change: {change}"
-                        )
-                        # Continue with other changes
+            for batch in _batched(changes, batch_size):
+                applied_count += applier.apply(batch)
+                self.logger.debug(f"Applied {applied_count} changes so far")
             
             conn.commit()
-            self.logger.info(f"Committed {applied_count} changes")
+            self.logger.info(
+                f"Committed {applied_count} changes ({applier.stats}, {applier.statements.stats}, "
+                f"keys: {self.table_keys.get_statistics()})"
+            )
         
         except Exception as e:
             conn.rollback()
@@ -464,44 +552,76 @@ class PITRRestoreManager:
         
         return applied_count
     
-    def _apply_insert(self, cursor, table_name: str, data: dict):
+    def _load_table_keys(self, conn):
+        """Reload the key columns of the target tables from its catalog"""
+        self.table_keys.invalidate()
+        try:
+            self.table_keys.load_from_catalog(conn)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            self.logger.warning(f"Could not load table keys, matching rows on their first column: {e}")
+    
+    def _apply_change(self, cursor, change: dict, statements: PreparedStatementCache = None):
+        """Apply a single change"""
+        table_name = change['table']
+        # If the change already has the SQL generated (SQL format backup)
+        if 'sql' in change:
+            cursor.execute(change['sql'])
+        else:
+            if statements is None:
+                statements = PreparedStatementCache(cursor, size=0)
+            # Fallback to manual generation for JSON/JSONL formats
+            if change['operation'] == 'INSERT':
+                self._apply_insert(statements, table_name, change['data'])
+            elif change['operation'] == 'UPDATE':
+                self._apply_update(statements, table_name, change['data'], change.get('old_data'))
+            elif change['operation'] == 'DELETE':
+                self._apply_delete(statements, table_name, change.get('old_data') or change['data'])
+            elif change['operation'] == 'TRUNCATE':
+                # Utility statement: cannot be prepared
+                cursor.execute(f"TRUNCATE TABLE {table_name}")
+    
+    def _apply_insert(self, statements: PreparedStatementCache, table_name: str, data: dict):
         """Apply INSERT operation"""
-        columns = list(data.keys())
+        columns = tuple(data.keys())
         values = [data[col] for col in columns]
         
-        placeholders = ', '.join(['%s'] * len(columns))
-        columns_str = ', '.join(columns)
+        def build():
+            placeholders = ', '.join(['%s'] * len(columns))
+            return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})"
         
-        query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders})"
-        cursor.execute(query, values)
+        statements.execute((table_name, 'INSERT', columns), build, values)
     
-    def _apply_update(self, cursor, table_name: str, new_data: dict, old_data: dict = None):
+    def _apply_update(self, statements: PreparedStatementCache, table_name: str, new_data: dict, old_data: dict = None):
         """Apply UPDATE operation"""
-        # Assume first column is primary key (this should be configurable)
-        pk_column = list(new_data.keys())[0]
-        pk_value = new_data[pk_column]
-        
-        set_clauses = []
-        values = []
+        # The row is found by its key before the update
+        key_row = old_data or new_data
+        key_columns = self.table_keys.key_columns(table_name, key_row)
+        
+        # Key columns are only set when the update changes them
+        set_columns = tuple(
+            col for col in new_data
+            if not (col in key_columns and new_data[col] == key_row[col])
+        )
+        if not set_columns:
+            return
         
-        for col, val in new_data.items():
-            if col != pk_column:
-                set_clauses.append(f"{col} = %s")
-                values.append(val)
+        where, params = key_condition(key_columns, [key_row[col] for col in key_columns])
         
-        values.append(pk_value)
+        def build():
+            set_clauses = ', '.join(f"{col} = %s" for col in set_columns)
+            return f"UPDATE {table_name} SET {set_clauses} WHERE {where}"
         
-        query = f"UPDATE {table_name} SET {', '.join(set_clauses)} WHERE {pk_column} = %s"
-        cursor.execute(query, values)
+        values = [new_data[col] for col in set_columns]
+        statements.execute((table_name, 'UPDATE', set_columns, where), build, values + params)
     
-    def _apply_delete(self, cursor, table_name: str, data: dict):
+    def _apply_delete(self, statements: PreparedStatementCache, table_name: str, data: dict):
         """Apply DELETE operation"""
-        # Assume first column is primary key
-        pk_column = list(data.keys())[0]
-        pk_value = data[pk_column]
+        key_columns = self.table_keys.key_columns(table_name, data)
+        where, params = key_condition(key_columns, [data[col] for col in key_columns])
         
-        query = f"DELETE FROM {table_name} WHERE {pk_column} = %s"
-        cursor.execute(query, [pk_value])
+        statements.execute((table_name, 'DELETE', where), lambda: f"DELETE FROM {table_name} WHERE {where}", params)
     
     def list_available_restore_points(
         self,
@@ -0,0 +1,375 @@
+"""
+Parallel Apply
+Replays a restore's change stream on several connections: transactions
+whose writesets (table and row key) do not overlap are applied
+concurrently, transactions that touch a common row in stream order
+"""
+
+import heapq
+import logging
+import threading
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .pitr_config import PITR_CONFIG
+from .BulkApply import BulkApplier, ChangeFailed
+from .TableKeys import TableKeyCache
+
+
+def _row_keys(change: dict, table_keys: TableKeyCache) -> Optional[List[tuple]]:
+    """
+    (key columns, key values) of the rows a change writes
+
+    An UPDATE that changes its key writes both keys. None when the rows are
+    not known: pre-generated SQL and TRUNCATE.
+    """
+    operation = change.get('operation')
+    if 'sql' in change or operation not in ('INSERT', 'UPDATE', 'DELETE'):
+        return None
+    if not (change.get('old_data') or change.get('data')):
+        return None
+    columns, values = table_keys.row_key(change)
+    keyed = [values]
+    if operation == 'UPDATE':
+        new_values = table_keys.new_key(change, columns, values)
+        if new_values != values:
+            keyed.append(new_values)
+    keys = []
+    for values in keyed:
+        try:
+            hash(values)
+        except TypeError:
+            values = repr(values)
+        keys.append((columns, values))
+    return keys
+
+
+class _Unit:
+    """Consecutive changes of one transaction and the writeset they cover"""
+
+    __slots__ = ('txid', 'seq', 'changes', 'rows', 'tables', 'wide_tables', 'barrier', 'pending', 'dependents')
+
+    def __init__(self, txid):
+        self.txid = txid
+        self.seq = 0
+        self.changes: List[dict] = []
+        # (table, key columns, key values) of the rows written
+        self.rows: Set[tuple] = set()
+        self.tables: Set[str] = set()
+        # Tables written without known rows (SQL statements, TRUNCATE)
+        self.wide_tables: Set[str] = set()
+        # Target unknown: orders against everything
+        self.barrier = False
+        # Earlier units this one waits for, and units waiting for it
+        self.pending = 0
+        self.dependents: List['_Unit'] = []
+
+    def add(self, change: dict, table_keys: TableKeyCache):
+        self.changes.append(change)
+        table = change.get('table')
+        if not table or table == 'unknown':
+            self.barrier = True
+            return
+        self.tables.add(table)
+        keys = _row_keys(change, table_keys)
+        if keys is None:
+            self.wide_tables.add(table)
+        else:
+            self.rows.update((table,) + key for key in keys)
+
+
+class ParallelApplier:
+    """
+    Applies an ordered change stream on a pool of connections.
+
+    The stream is cut into units: the consecutive changes of one transaction,
+    at most restore_batch_size of them. Each unit's writeset is the set of
+    (table, row key) pairs it writes; SQL statements and TRUNCATEs write
+    their whole table, and changes without a known table write everything.
+    A unit waits for every earlier unit in flight whose writeset overlaps
+    its own; units with nothing to wait for are ready and go to the next
+    free worker. Each worker has its own connection and BulkApplier, takes
+    several ready units at a time, and commits them together. Units with a
+    common row are therefore committed in stream order, and unrelated ones
+    in any order.
+
+    Writesets do not see constraints between rows (foreign keys, other
+    unique columns). If any change of a worker's group fails, the group is
+    rolled back and each of its units is replayed once every earlier unit
+    has committed, skipping (and logging) the changes that still fail, as
+    the serial restore does.
+
+    Unlike the serial restore, which commits once at the end, work is
+    committed as it goes: if the restore stops on an error, the units
+    committed so far stay applied.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        apply_change: Callable,
+        workers: int = None,
+        window: int = None,
+        batch_size: int = None,
+        table_keys: TableKeyCache = None
+    ):
+        """
+        Args:
+            connect: connect() opens a connection to the target database
+            apply_change: apply_change(cursor, change, statements) replays one change
+            workers: Number of connections
+            window: Most units scheduled and not yet committed
+            batch_size: Most changes per unit and per worker commit
+            table_keys: Key columns of the target tables
+        """
+        self.connect = connect
+        self.apply_change = apply_change
+        self.table_keys = table_keys if table_keys is not None else TableKeyCache()
+        self.workers = workers or PITR_CONFIG.get('restore_workers', 1)
+        self.window = window or PITR_CONFIG.get('restore_parallel_window', 4096)
+        self.batch_size = batch_size or PITR_CONFIG.get('restore_batch_size', 1000)
+        self.logger = logging.getLogger("ParallelApplier")
+
+        self.cond = threading.Condition()
+        self.inflight: Dict[int, _Unit] = {}
+        # (seq, unit) heaps: units free to run, and units to replay in order
+        self.ready: List[Tuple[int, _Unit]] = []
+        self.deferred: List[Tuple[int, _Unit]] = []
+        # Lowest seq not yet committed
+        self.low_water = 0
+        self.committed_above: Set[int] = set()
+
+        # Latest in-flight writer of each row / table, and in-flight units per table
+        self.row_writers: Dict[tuple, int] = {}
+        self.table_writers: Dict[str, int] = {}
+        self.table_units: Dict[str, Set[int]] = {}
+        self.barrier: Optional[int] = None
+
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.applied = 0
+
+        self.stats = {
+            'units': 0,
+            'groups': 0,
+            'deferred_units': 0,
+            'waits': 0
+        }
+        self.apply_stats: Dict[str, int] = {}
+
+    def apply(self, changes: Iterable[dict]) -> int:
+        """
+        Apply changes and wait for the workers to commit them
+
+        Returns:
+            Number of changes applied
+        """
+        threads = [
+            threading.Thread(target=self._worker, name=f"restore-apply-{n}", daemon=True)
+            for n in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for seq, unit in enumerate(self._units(changes)):
+                unit.seq = seq
+                with self.cond:
+                    while len(self.inflight) >= self.window and self.error is None:
+                        self.cond.wait()
+                    if self.error is not None:
+                        break
+                    self._schedule(unit)
+        except BaseException as e:
+            self._fail(e)
+            raise
+        finally:
+            with self.cond:
+                self.finished = True
+                self.cond.notify_all()
+            for thread in threads:
+                thread.join()
+
+        if self.error is not None:
+            raise self.error
+        return self.applied
+
+    # Scheduling
+
+    def _units(self, changes: Iterable[dict]) -> Iterator[_Unit]:
+        unit = None
+        for change in changes:
+            txid = change.get('txid')
+            if unit is None or txid != unit.txid or len(unit.changes) >= self.batch_size:
+                if unit is not None:
+                    yield unit
+                unit = _Unit(txid)
+            unit.add(change, self.table_keys)
+        if unit is not None:
+            yield unit
+
+    def _schedule(self, unit: _Unit):
+        """Register a unit's writeset and queue it behind the units it overlaps"""
+        seq = unit.seq
+        deps = set()
+        if unit.barrier:
+            deps.update(self.inflight)
+        else:
+            if self.barrier is not None:
+                deps.add(self.barrier)
+            for table in unit.wide_tables:
+                deps.update(self.table_units.get(table, ()))
+            for table in unit.tables:
+                writer = self.table_writers.get(table)
+                if writer is not None:
+                    deps.add(writer)
+            for row in unit.rows:
+                writer = self.row_writers.get(row)
+                if writer is not None:
+                    deps.add(writer)
+
+        self.inflight[seq] = unit
+        if unit.barrier:
+            self.barrier = seq
+        for table in unit.tables:
+            self.table_units.setdefault(table, set()).add(seq)
+        for table in unit.wide_tables:
+            self.table_writers[table] = seq
+        for row in unit.rows:
+            self.row_writers[row] = seq
+
+        self.stats['units'] += 1
+        unit.pending = len(deps)
+        for dep in deps:
+            self.inflight[dep].dependents.append(unit)
+        if deps:
+            self.stats['waits'] += 1
+        else:
+            heapq.heappush(self.ready, (seq, unit))
+            self.cond.notify()
+
+    def _release(self, unit: _Unit):
+        """Drop a committed unit's writeset and wake the units waiting for it"""
+        seq = unit.seq
+        del self.inflight[seq]
+        for row in unit.rows:
+            if self.row_writers.get(row) == seq:
+                del self.row_writers[row]
+        for table in unit.tables:
+            units = self.table_units[table]
+            units.discard(seq)
+            if not units:
+                del self.table_units[table]
+            if self.table_writers.get(table) == seq:
+                del self.table_writers[table]
+        if self.barrier == seq:
+            self.barrier = None
+
+        for dependent in unit.dependents:
+            dependent.pending -= 1
+            if dependent.pending == 0:
+                heapq.heappush(self.ready, (dependent.seq, dependent))
+
+        self.committed_above.add(seq)
+        while self.low_water in self.committed_above:
+            self.committed_above.remove(self.low_water)
+            self.low_water += 1
+
+    def _next_work(self) -> Tuple[Optional[List[_Unit]], bool]:
+        """
+        Wait for work
+
+        Returns:
+            (units, in_order): a deferred unit whose predecessors have all
+            committed, or a share of the ready units; (None, False) when
+            the stream is done or failed
+        """
+        with self.cond:
+            while True:
+                if self.error is not None:
+                    return None, False
+                if self.deferred and self.deferred[0][0] == self.low_water:
+                    return [heapq.heappop(self.deferred)[1]], True
+                if self.ready:
+                    # Leave a share of the ready units to the other workers
+                    share = max(1, len(self.ready) // self.workers)
+                    units, size = [], 0
+                    while self.ready and len(units) < share:
+                        unit = self.ready[0][1]
+                        if units and size + len(unit.changes) > self.batch_size:
+                            break
+                        heapq.heappop(self.ready)
+                        units.append(unit)
+                        size += len(unit.changes)
+                    return units, False
+                if self.finished and not self.inflight:
+                    return None, False
+                self.cond.wait()
+
+    def _fail(self, error: BaseException):
+        with self.cond:
+            if self.error is None:
+                self.error = error
+            self.cond.notify_all()
+
+    # Workers
+
+    def _worker(self):
+        try:
+            conn = self.connect()
+        except Exception as e:
+            self.logger.error(f"Could not open a restore connection: {e}")
+            self._fail(e)
+            return
+
+        applier = None
+        try:
+            conn.autocommit = False
+            cursor = conn.cursor()
+            # A failed restore is re-run, not recovered: don't wait for the WAL flush at each commit
+            cursor.execute("SET synchronous_commit TO off")
+            conn.commit()
+            applier = BulkApplier(cursor, self.apply_change, table_keys=self.table_keys)
+
+            while True:
+                units, in_order = self._next_work()
+                if units is None:
+                    break
+                # Out of order, a failure may be a constraint on rows of an
+                # uncommitted unit; in order, it is skipped as in a serial restore
+                applier.stop_on_error = not in_order
+                try:
+                    applied = applier.apply([change for unit in units for change in unit.changes])
+                except ChangeFailed as e:
+                    conn.rollback()
+                    applier.transaction_ended()
+                    self.logger.debug(f"Deferring {len(units)} units: {e}")
+                    with self.cond:
+                        self.stats['deferred_units'] += len(units)
+                        for unit in units:
+                            heapq.heappush(self.deferred, (unit.seq, unit))
+                        self.cond.notify_all()
+                    continue
+
+                conn.commit()
+                applier.transaction_ended()
+                with self.cond:
+                    self.applied += applied
+                    self.stats['groups'] += 1
+                    for unit in units:
+                        self._release(unit)
+                    self.cond.notify_all()
+
+        except Exception as e:
+            self.logger.error(f"Restore worker failed, changes committed so far remain applied: {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self._fail(e)
+
+        finally:
+            if applier is not None:
+                with self.cond:
+                    for key, value in {**applier.stats, **applier.statements.stats}.items():
+                        self.apply_stats[key] = self.apply_stats.get(key, 0) + value
+            conn.close()
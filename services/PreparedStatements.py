@@ -0,0 +1,131 @@
+"""
+Prepared Statements
+Keeps the row-level statements of a restore connection PREPAREd on the
+server, so changes that cannot be applied in bulk are parsed and planned
+once per statement shape instead of once per change
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Callable, Hashable, Sequence
+
+from .pitr_config import PITR_CONFIG
+
+
+# SQLSTATE classes of errors a schema change can cause: invalid prepared
+# statement, undefined / mistyped column or table, cached plan changed
+SCHEMA_ERROR_CLASSES = ('26', '42', '0A')
+
+
+def _numbered(query: str) -> str:
+    """query with its %s placeholders replaced by $1, $2, ..."""
+    parts = query.split('%s')
+    numbered = [parts[0]]
+    for n, part in enumerate(parts[1:], 1):
+        numbered.append(f"${n}{part}")
+    return ''.join(numbered)
+
+
+class PreparedStatementCache:
+    """
+    LRU cache of the prepared statements of one connection.
+
+    Statements are keyed by their shape, (table, operation, columns...),
+    with the table first. A miss PREPAREs the statement, a hit EXECUTEs the
+    prepared one with the change's values; beyond size statements, the
+    least recently used one is DEALLOCATEd.
+
+    Prepared statements belong to the session and survive ROLLBACK, so the
+    cache lives as long as its connection. When a statement fails with an
+    error a schema change can cause, every statement of its table is
+    dropped and prepared again on next use; the DEALLOCATEs are sent before
+    the next PREPARE, once the failed transaction has been rolled back.
+
+    With size 0 statements are executed directly, unprepared.
+    """
+
+    def __init__(self, cursor, size: int = None):
+        """
+        Args:
+            cursor: Cursor of the connection the statements belong to
+            size: Most statements kept prepared (restore_prepared_statements)
+        """
+        self.cursor = cursor
+        self.size = size if size is not None else PITR_CONFIG.get('restore_prepared_statements', 256)
+        self.logger = logging.getLogger("PreparedStatementCache")
+
+        # shape -> statement name, least recently used first
+        self.statements: 'OrderedDict[tuple, str]' = OrderedDict()
+        self.count = 0
+        # Names to DEALLOCATE before the next PREPARE
+        self.stale = []
+
+        self.stats = {
+            'statements_prepared': 0,
+            'statement_hits': 0,
+            'statements_evicted': 0,
+            'statements_invalidated': 0
+        }
+
+    def __len__(self) -> int:
+        return len(self.statements)
+
+    def execute(self, key: Hashable, build: Callable[[], str], params: Sequence):
+        """
+        Execute the statement of shape key
+
+        Args:
+            key: Statement shape, a tuple starting with the table name
+            build: build() returns the statement, with %s placeholders
+            params: Values of the placeholders
+        """
+        if self.size <= 0:
+            self.cursor.execute(build(), params)
+            return
+
+        name = self.statements.get(key)
+        if name is None:
+            name = self._prepare(key, build())
+        else:
+            self.statements.move_to_end(key)
+            self.stats['statement_hits'] += 1
+
+        try:
+            if params:
+                self.cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            else:
+                self.cursor.execute(f"EXECUTE {name}")
+        except Exception as e:
+            code = getattr(e, 'pgcode', None) or ''
+            if code[:2] in SCHEMA_ERROR_CLASSES:
+                if code[:2] == '26':
+                    # Gone already: nothing to deallocate
+                    self.statements.pop(key, None)
+                self.invalidate(key[0])
+            raise
+
+    def invalidate(self, table: str = None):
+        """
+        Drop the statements of a table (or all statements)
+
+        Args:
+            table: Table whose statements are dropped; None drops all
+        """
+        for key in [key for key in self.statements if table is None or key[0] == table]:
+            self.stale.append(self.statements.pop(key))
+            self.stats['statements_invalidated'] += 1
+
+    def _prepare(self, key: tuple, query: str) -> str:
+        while self.stale:
+            self.cursor.execute(f"DEALLOCATE {self.stale.pop()}")
+        while len(self.statements) >= self.size:
+            _, evicted = self.statements.popitem(last=False)
+            self.cursor.execute(f"DEALLOCATE {evicted}")
+            self.stats['statements_evicted'] += 1
+
+        name = f"cdc_stmt_{self.count}"
+        self.count += 1
+        self.cursor.execute(f"PREPARE {name} AS {_numbered(query)}")
+        self.statements[key] = name
+        self.stats['statements_prepared'] += 1
+        return name
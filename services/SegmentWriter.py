@@ -0,0 +1,178 @@
+"""
+Segment Writer
+Long-lived, buffered append handle for a CDC backup segment file
+"""
+
+import logging
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .pitr_config import PITR_CONFIG
+from .BlockCompression import BlockIndex, compress_block, index_path
+
+
+class SegmentWriter:
+    """
+    Keeps a backup segment open for appending with a large user-space buffer.
+
+    Writes only touch the buffer; data reaches the OS at flush() (or when the
+    buffer fills) and stable storage at fsync(). The writer counts the bytes
+    it appends so the segment size is known without stat(). close() flushes,
+    fsyncs and seals the segment; a sealed writer rejects further writes.
+
+    Compressed segments are written as independent gzip blocks (see
+    BlockCompression). A block is emitted when compression_block_size bytes
+    are pending, at end_block(), and at every flush so flushed data is
+    always decodable. The block index is saved next to the segment on close.
+    """
+
+    def __init__(self, path: Path, compressed: bool = False, buffer_size: int = None):
+        """
+        Args:
+            path: Segment file path (appended to if it already exists)
+            compressed: Write block-compressed gzip
+            buffer_size: User-space buffer size in bytes
+        """
+        self.path = Path(path)
+        self.compressed = compressed
+        self.buffer_size = buffer_size or PITR_CONFIG.get('segment_buffer_bytes', 1024 * 1024)
+        self.logger = logging.getLogger("SegmentWriter")
+        self.lock = threading.Lock()
+
+        self.file = open(self.path, 'ab', buffering=self.buffer_size)
+        # Size when opened; appended bytes are counted from here on
+        self.initial_size = self.file.tell()
+
+        # Compression state: uncompressed bytes waiting for the current block
+        self.block_size = PITR_CONFIG.get('compression_block_size', 64 * 1024)
+        self.pending = bytearray()
+        self.compressed_written = 0
+        self.index: Optional[BlockIndex] = self._open_index() if compressed else None
+
+        self.bytes_written = 0
+        self.write_count = 0
+        self.flush_count = 0
+        self.fsync_count = 0
+        self.sealed = False
+
+    def _open_index(self) -> Optional[BlockIndex]:
+        """Start a block index, continuing the blocks already in the file"""
+        if not self.initial_size:
+            return BlockIndex()
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            index = BlockIndex.scan(buf)
+        if index.compressed_size != self.initial_size:
+            # Not (entirely) block-compressed: keep appending blocks but write no index
+            self.logger.warning(f"{self.path.name} has no block structure, block index disabled")
+            return None
+        return index
+
+    @property
+    def is_new(self) -> bool:
+        """True if the segment was empty when opened and nothing was written yet"""
+        return self.initial_size == 0 and self.bytes_written == 0
+
+    @property
+    def size(self) -> int:
+        """
+        Segment size in bytes, without stat()
+
+        For compressed segments this is the compressed size plus the bytes
+        still pending for the current block.
+        """
+        if self.compressed:
+            return self.initial_size + self.compressed_written + len(self.pending)
+        return self.initial_size + self.bytes_written
+
+    def write(self, text: str):
+        """Append text to the segment buffer"""
+        self.write_bytes(text.encode('utf-8'))
+
+    def write_bytes(self, data: bytes):
+        """Append raw bytes to the segment buffer"""
+        with self.lock:
+            if self.sealed:
+                raise ValueError(f"Segment {self.path.name} is sealed")
+            if self.compressed:
+                self.pending += data
+                while len(self.pending) >= self.block_size:
+                    self._emit_block(bytes(self.pending[:self.block_size]))
+                    del self.pending[:self.block_size]
+            else:
+                self.file.write(data)
+            self.bytes_written += len(data)
+            self.write_count += 1
+
+    def end_block(self):
+        """Close the current compressed block so the next write starts a new one"""
+        with self.lock:
+            if self.compressed and self.pending and not self.sealed:
+                self._emit_block(bytes(self.pending))
+                self.pending.clear()
+
+    def _emit_block(self, data: bytes):
+        member = compress_block(data)
+        self.file.write(member)
+        self.compressed_written += len(member)
+        if self.index is not None:
+            self.index.add(len(member), len(data))
+
+    def flush(self):
+        """Hand buffered data to the OS"""
+        with self.lock:
+            self._flush_locked()
+
+    def fsync(self):
+        """Flush and force buffered data to stable storage"""
+        with self.lock:
+            if self.sealed:
+                return
+            self._flush_locked()
+            os.fsync(self.file.fileno())
+            self.fsync_count += 1
+
+    def close(self):
+        """Flush, fsync and seal the segment"""
+        with self.lock:
+            if self.sealed:
+                return
+            self._flush_locked()
+            os.fsync(self.file.fileno())
+            self.fsync_count += 1
+            self.file.close()
+            self.sealed = True
+
+            if self.index is not None:
+                try:
+                    self.index.save(index_path(self.path))
+                except Exception as e:
+                    # Readers rebuild the index by scanning block headers
+                    self.logger.warning(f"Could not write block index for {self.path.name}: {e}")
+
+        self.logger.debug(f"Sealed segment {self.path.name} ({self.size} bytes)")
+
+    def _flush_locked(self):
+        if self.sealed:
+            return
+        if self.pending:
+            self._emit_block(bytes(self.pending))
+            self.pending.clear()
+        self.file.flush()
+        self.flush_count += 1
+
+    def get_statistics(self) -> dict:
+        stats = {
+            'file': self.path.name,
+            'size_bytes': self.size,
+            'writes': self.write_count,
+            'flushes': self.flush_count,
+            'fsyncs': self.fsync_count,
+            'sealed': self.sealed
+        }
+        if self.compressed:
+            stats['uncompressed_bytes'] = self.bytes_written
+            stats['compressed_blocks'] = len(self.index) if self.index is not None else None
+        return stats
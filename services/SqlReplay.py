@@ -0,0 +1,395 @@
+"""
+SQL Replay
+Replays SQL-format CDC segments in-process over a pooled connection
+instead of starting psql for every file: statements are streamed from the
+segment, whole transactions are sent several at a time in one round trip,
+and a failed replay resumes after the last applied LSN
+"""
+
+import gzip
+import logging
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.pool
+
+from .pitr_config import PITR_CONFIG, DB_CONFIG
+from .LSN import LSN, PG_LSN_MARKER, format_lsn, parse_lsn, to_lsn
+
+
+# First line of every SQL segment written by PITRBackupManager
+SEGMENT_HEADER = "-- PostgreSQL CDC Incremental Backup"
+
+_META_PATTERN = re.compile(r"-- LSN: (.*?), TXID: ")
+# Characters that change the splitter's state
+_SPECIAL = re.compile(r"['\";\\]|--")
+
+
+def _open_text(path: Path):
+    """Open a segment for reading text, compressed or not"""
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def is_cdc_segment(path) -> bool:
+    """Whether path is a SQL segment written by the CDC (not a pg_dump script)"""
+    try:
+        with _open_text(Path(path)) as f:
+            return f.readline().strip() == SEGMENT_HEADER
+    except (OSError, UnicodeDecodeError):
+        return False
+
+
+def _is_escape_prefix(line: str, quote_at: int) -> bool:
+    """Whether the quote at quote_at opens an E'' literal"""
+    if quote_at == 0 or line[quote_at - 1] not in 'Ee':
+        return False
+    return quote_at == 1 or not (line[quote_at - 2].isalnum() or line[quote_at - 2] == '_')
+
+
+def split_statements(lines: Iterable[str]) -> Iterator[Tuple[str, Optional[LSN]]]:
+    """
+    Split SQL text into statements
+
+    Quoted literals (including E'' literals with backslash escapes) and
+    identifiers may contain semicolons and span lines. Comment lines are
+    dropped; the LSN of the last '-- LSN:' comment before a statement is
+    yielded with it, read as decimal halves until the PG_LSN_MARKER line.
+
+    Yields:
+        (statement, LSN or None)
+    """
+    buffer: List[str] = []
+    lsn = None
+    legacy = True
+    # None, "'" (string, escapes when escaped is set) or '"' (identifier)
+    quote = None
+    escaped = False
+
+    for line in lines:
+        if quote is None and not buffer:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            if stripped.startswith('--'):
+                match = _META_PATTERN.match(stripped)
+                if match:
+                    lsn = parse_lsn(match.group(1), legacy)
+                elif stripped == PG_LSN_MARKER:
+                    legacy = False
+                continue
+
+        start = 0
+        end = len(line)
+        pos = 0
+        while True:
+            match = _SPECIAL.search(line, pos)
+            if match is None:
+                break
+            token = match.group()
+            pos = match.end()
+            if quote is None:
+                if token == "'":
+                    quote = "'"
+                    escaped = _is_escape_prefix(line, match.start())
+                elif token == '"':
+                    quote = '"'
+                elif token == ';':
+                    buffer.append(line[start:pos])
+                    statement = ''.join(buffer).strip()
+                    buffer = []
+                    start = pos
+                    if statement:
+                        yield statement, lsn
+                elif token == '--':
+                    # Trailing comment: drop the rest of the line
+                    end = match.start()
+                    break
+            elif token == '\\':
+                if quote == "'" and escaped:
+                    pos += 1
+            elif token == quote:
+                if line.startswith(quote, pos):
+                    # Doubled quote
+                    pos += 1
+                else:
+                    quote = None
+
+        rest = line[start:end] if end == len(line) else line[start:end] + '\n'
+        if rest.strip() or quote is not None or buffer:
+            buffer.append(rest)
+
+    statement = ''.join(buffer).strip()
+    if statement:
+        yield statement, lsn
+
+
+class SqlReplayError(RuntimeError):
+    """Replaying a segment failed; it can be resumed after last_lsn"""
+
+    def __init__(self, message: str, path: Path, last_lsn: Optional[LSN]):
+        super().__init__(message)
+        self.path = path
+        self.last_lsn = last_lsn
+
+
+class _Transaction:
+    """Statements of one source transaction"""
+
+    __slots__ = ('statements', 'lsn')
+
+    def __init__(self):
+        self.statements: List[str] = []
+        # LSN of the transaction's last change: its position in the segment
+        self.lsn: Optional[LSN] = None
+
+
+class SqlSegmentReplayer:
+    """
+    Replays SQL segments into one database over pooled connections.
+
+    A segment is a header of session settings followed by one BEGIN/COMMIT
+    block per source transaction, in commit order, each change preceded by
+    a '-- LSN:' comment. Settings are applied to the session; transactions
+    are sent whole, sql_replay_batch_statements statements at a time in
+    one round trip, and each batch is committed with its transactions.
+
+    If a batch fails, it is rolled back and its transactions are replayed
+    one at a time to find the failing one, and the replay stops with a
+    SqlReplayError carrying the LSN of the last committed transaction.
+    Replaying again with start_lsn set to it skips everything up to and
+    including that transaction. A lost connection is replaced from the pool
+    and the replay resumes the same way, up to sql_replay_retries times.
+    """
+
+    def __init__(self, target_db: str, batch_statements: int = None, retries: int = None):
+        """
+        Args:
+            target_db: Database to replay into
+            batch_statements: Statements sent per round trip
+            retries: Reconnects allowed per segment
+        """
+        self.target_db = target_db
+        self.batch_statements = batch_statements or PITR_CONFIG.get('sql_replay_batch_statements', 1000)
+        self.retries = retries if retries is not None else PITR_CONFIG.get('sql_replay_retries', 3)
+        self.logger = logging.getLogger("SqlSegmentReplayer")
+
+        # Created on first use: the database may not exist yet
+        self.pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+        self.pool_lock = threading.Lock()
+
+        self.stats = {
+            'segments': 0,
+            'transactions': 0,
+            'statements': 0,
+            'round_trips': 0,
+            'reconnects': 0
+        }
+
+    def close(self):
+        """Close the pooled connections"""
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.closeall()
+                self.pool = None
+
+    def replay(
+        self,
+        path,
+        start_lsn: LSN = None,
+        progress: Callable[[int, LSN], None] = None
+    ) -> dict:
+        """
+        Replay a SQL segment
+
+        Args:
+            path: Segment file (.sql or .sql.gz)
+            start_lsn: Resume after the transaction ending at this LSN
+            progress: progress(transactions, last_lsn) is called after each commit
+
+        Returns:
+            Dictionary with the transactions and statements applied and the
+            LSN of the last one
+        """
+        path = Path(path)
+        result = {
+            'path': str(path),
+            'transactions': 0,
+            'statements': 0,
+            'last_lsn': to_lsn(start_lsn)
+        }
+        attempts = 0
+        while True:
+            conn = None
+            try:
+                conn = self._getconn()
+                self._replay(conn, path, result, progress)
+                self._putconn(conn)
+                break
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                if conn is not None:
+                    self._putconn(conn, close=True)
+                attempts += 1
+                if attempts > self.retries:
+                    raise SqlReplayError(f"Lost connection replaying {path.name}: {e}", path, result['last_lsn']) from e
+                self.stats['reconnects'] += 1
+                self.logger.warning(
+                    f"Lost connection replaying {path.name}, resuming after "
+                    f"{format_lsn(result['last_lsn']) if result['last_lsn'] else 'the start'}: {e}"
+                )
+            except BaseException:
+                if conn is not None:
+                    self._putconn(conn)
+                raise
+
+        self.stats['segments'] += 1
+        self.logger.info(
+            f"Replayed {path.name}: {result['transactions']} transactions, {result['statements']} statements"
+        )
+        if result['last_lsn'] is not None:
+            result['last_lsn'] = format_lsn(result['last_lsn'])
+        return result
+
+    def _getconn(self):
+        with self.pool_lock:
+            if self.pool is None:
+                conn_params = DB_CONFIG.copy()
+                conn_params['dbname'] = self.target_db
+                self.pool = psycopg2.pool.ThreadedConnectionPool(
+                    0, PITR_CONFIG.get('sql_replay_pool_size', 2), **conn_params
+                )
+            pool = self.pool
+        return pool.getconn()
+
+    def _putconn(self, conn, close: bool = False):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.putconn(conn, close=close or bool(conn.closed))
+
+    def _transactions(self, path: Path, after_lsn: Optional[LSN]) -> Iterator[Tuple[str, object]]:
+        """
+        Yield ('session', statement) and ('transaction', _Transaction) items
+
+        With after_lsn, transactions up to the one ending at after_lsn are
+        skipped; session settings are always yielded.
+        """
+        skipping = after_lsn is not None
+        transaction = None
+        with _open_text(path) as f:
+            for statement, lsn in split_statements(f):
+                keyword = statement.rstrip(';').strip().upper()
+                if keyword in ('BEGIN', 'START TRANSACTION'):
+                    transaction = _Transaction()
+                    continue
+                if keyword in ('COMMIT', 'END'):
+                    if transaction is not None:
+                        transaction.lsn = lsn
+                        if not skipping:
+                            yield 'transaction', transaction
+                        elif lsn is not None and lsn == after_lsn:
+                            skipping = False
+                    transaction = None
+                    continue
+                if transaction is not None:
+                    transaction.statements.append(statement)
+                elif lsn is None:
+                    yield 'session', statement
+                else:
+                    # Statement outside a transaction block: a transaction of its own
+                    single = _Transaction()
+                    single.statements.append(statement)
+                    single.lsn = lsn
+                    if not skipping:
+                        yield 'transaction', single
+                    elif lsn == after_lsn:
+                        skipping = False
+
+        if skipping:
+            raise SqlReplayError(
+                f"Resume LSN {format_lsn(after_lsn)} is not the end of a transaction in {path.name}",
+                path, after_lsn
+            )
+
+    def _replay(self, conn, path: Path, result: dict, progress: Optional[Callable]):
+        conn.autocommit = False
+        cursor = conn.cursor()
+        batch: List[_Transaction] = []
+        size = 0
+
+        for kind, item in self._transactions(path, result['last_lsn']):
+            if kind == 'session':
+                cursor.execute(item)
+                conn.commit()
+                continue
+            if not item.statements:
+                continue
+            batch.append(item)
+            size += len(item.statements)
+            if size >= self.batch_statements:
+                self._apply_batch(conn, cursor, path, batch, result, progress)
+                batch, size = [], 0
+
+        if batch:
+            self._apply_batch(conn, cursor, path, batch, result, progress)
+
+    def _apply_batch(
+        self,
+        conn,
+        cursor,
+        path: Path,
+        batch: List[_Transaction],
+        result: dict,
+        progress: Optional[Callable]
+    ):
+        try:
+            self._send(cursor, batch)
+            conn.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            raise
+        except psycopg2.Error as e:
+            conn.rollback()
+            self.logger.debug(f"Batch of {len(batch)} transactions failed, replaying them one by one: {e}")
+            for transaction in batch:
+                try:
+                    self._send(cursor, [transaction])
+                    conn.commit()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    raise
+                except psycopg2.Error as e:
+                    conn.rollback()
+                    raise SqlReplayError(
+                        f"Transaction ending at LSN {format_lsn(transaction.lsn) if transaction.lsn else '?'} "
+                        f"in {path.name} failed: {e}",
+                        path, result['last_lsn']
+                    ) from e
+                self._applied(result, [transaction], progress)
+            return
+        self._applied(result, batch, progress)
+
+    def _send(self, cursor, transactions: List[_Transaction]):
+        """Execute the statements of transactions in one round trip"""
+        cursor.execute('\n'.join(
+            statement for transaction in transactions for statement in transaction.statements
+        ))
+        self.stats['round_trips'] += 1
+
+    def _applied(self, result: dict, transactions: List[_Transaction], progress: Optional[Callable]):
+        statements = sum(len(transaction.statements) for transaction in transactions)
+        result['transactions'] += len(transactions)
+        result['statements'] += statements
+        self.stats['transactions'] += len(transactions)
+        self.stats['statements'] += statements
+        for transaction in reversed(transactions):
+            if transaction.lsn is not None:
+                result['last_lsn'] = transaction.lsn
+                break
+        if progress is not None:
+            progress(result['transactions'], result['last_lsn'])
+
+    def get_statistics(self) -> dict:
+        """Get replay statistics"""
+        return dict(self.stats)
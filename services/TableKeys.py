@@ -0,0 +1,185 @@
+"""
+Table Keys
+Caches the primary key (or replica identity) columns of each table, so
+row changes are matched on indexed key columns instead of on whatever
+column happens to come first in the row
+"""
+
+import logging
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+# Cached key meaning "match on every column of the old row"
+WHOLE_ROW = ()
+
+
+def key_condition(columns: Sequence[str], values: Sequence, alias: str = '') -> Tuple[str, List]:
+    """
+    WHERE condition matching a row's key, with %s placeholders
+
+    NULL values (possible only when matching on the whole row) are matched
+    with IS NULL.
+
+    Returns:
+        (condition, parameters)
+    """
+    prefix = f"{alias}." if alias else ''
+    clauses, params = [], []
+    for column, value in zip(columns, values):
+        if value is None:
+            clauses.append(f"{prefix}{column} IS NULL")
+        else:
+            clauses.append(f"{prefix}{column} = %s")
+            params.append(value)
+    return ' AND '.join(clauses), params
+
+
+class TableKeyCache:
+    """
+    Key columns of each table.
+
+    A table's key is its primary key, else the index of its replica
+    identity; tables with REPLICA IDENTITY FULL and neither are matched on
+    the whole old row. Keys are loaded once from pg_catalog and updated from
+    pgoutput Relation messages, which are resent after every schema change.
+
+    Tables the cache does not know (or rows missing a key column) fall back
+    to the first column of the row, the convention used before keys were
+    known.
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger("TableKeyCache")
+        # table -> key columns, or WHOLE_ROW
+        self.keys: Dict[str, Tuple[str, ...]] = {}
+        self.lock = threading.Lock()
+
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, table: str) -> bool:
+        return table in self.keys
+
+    def register(self, table: str, columns: Optional[Sequence[str]]):
+        """
+        Set a table's key
+
+        Args:
+            table: Qualified table name
+            columns: Key columns in index order; None or empty for the whole row
+        """
+        key = tuple(columns) if columns else WHOLE_ROW
+        with self.lock:
+            previous = self.keys.get(table)
+            self.keys[table] = key
+        if previous is not None and previous != key:
+            self.logger.info(f"Key of {table} changed: {previous or 'whole row'} -> {key or 'whole row'}")
+
+    def register_relation(self, relation):
+        """
+        Learn a table's key from a pgoutput Relation message
+
+        Relation messages flag the replica identity columns: the primary key
+        or identity index, or every column under REPLICA IDENTITY FULL, in
+        which case a key already loaded from the catalog is kept.
+        """
+        if relation.replica_identity in ('d', 'i') and relation.key_columns:
+            self.register(relation.table, relation.key_columns)
+        elif relation.replica_identity == 'f' and relation.table not in self.keys:
+            self.register(relation.table, None)
+
+    def invalidate(self, table: str = None):
+        """
+        Forget a table's key (or all keys)
+
+        Args:
+            table: Table to invalidate; None clears the whole cache
+        """
+        with self.lock:
+            if table is None:
+                self.keys.clear()
+            else:
+                self.keys.pop(table, None)
+            self.stats['invalidations'] += 1
+
+    def load_from_catalog(self, connection) -> int:
+        """
+        Load the key of every user table from pg_index / pg_attribute
+
+        Args:
+            connection: psycopg2 connection able to run catalog queries
+
+        Returns:
+            Number of tables loaded
+        """
+        # One row per table: primary key first, else the replica identity index
+        query = """
+            SELECT DISTINCT ON (c.oid)
+                   quote_ident(n.nspname) || '.' || quote_ident(c.relname),
+                   c.relreplident,
+                   ARRAY(
+                       SELECT quote_ident(a.attname)
+                       FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, position)
+                       JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = k.attnum
+                       ORDER BY k.position
+                   )
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_index i ON i.indrelid = c.oid AND (i.indisprimary OR i.indisreplident)
+            WHERE c.relkind IN ('r', 'p')
+              AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+              AND n.nspname NOT LIKE 'pg_toast%'
+            ORDER BY c.oid, i.indisprimary DESC NULLS LAST
+        """
+        keys: Dict[str, Tuple[str, ...]] = {}
+        with connection.cursor() as cur:
+            cur.execute(query)
+            for table, replica_identity, columns in cur.fetchall():
+                if columns:
+                    keys[table] = tuple(columns)
+                elif replica_identity == 'f':
+                    keys[table] = WHOLE_ROW
+
+        with self.lock:
+            self.keys.update(keys)
+        self.logger.info(f"Loaded keys of {len(keys)} tables from catalog")
+        return len(keys)
+
+    # Lookups
+
+    def key_columns(self, table: str, row: dict) -> Tuple[str, ...]:
+        """Columns identifying row in table"""
+        key = self.keys.get(table)
+        if key is not None:
+            if key == WHOLE_ROW:
+                self.stats['hits'] += 1
+                return tuple(row)
+            if all(column in row for column in key):
+                self.stats['hits'] += 1
+                return key
+        self.stats['misses'] += 1
+        return (next(iter(row)),) if row else ()
+
+    def row_key(self, change: dict) -> Tuple[Tuple[str, ...], tuple]:
+        """
+        Key columns and values of the row a change applies to
+
+        The row as it was before the change: old_data when present, else
+        data (an INSERT's new row, or an UPDATE that kept its key).
+        """
+        row = change.get('old_data') or change.get('data') or {}
+        columns = self.key_columns(change['table'], row)
+        return columns, tuple(row[column] for column in columns)
+
+    @staticmethod
+    def new_key(change: dict, columns: Sequence[str], values: Sequence) -> tuple:
+        """Key values of an UPDATE's row after the change"""
+        data = change.get('data') or {}
+        return tuple(data.get(column, value) for column, value in zip(columns, values))
+
+    def get_statistics(self) -> dict:
+        """Get key cache statistics"""
+        return {'tables_cached': len(self.keys), **self.stats}
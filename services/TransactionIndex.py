@@ -0,0 +1,277 @@
+"""
+Transaction Index
+Per-day index over the transaction log: txid hash plus commit LSN and commit
+time arrays searched with bisect, with full records left in the log file
+"""
+
+import json
+import logging
+import os
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .LSN import to_lsn
+
+
+INDEX_SUFFIX = '.idx'
+
+_EPOCH = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+# Entry fields
+_LSN, _TIME, _TXID, _STATUS, _CHANGES, _OFFSET = range(6)
+
+
+def timestamp_to_us(value) -> int:
+    """Microseconds since 1970 for an ISO string or naive datetime"""
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    return (value.replace(tzinfo=None) - _EPOCH) // _ONE_MICROSECOND
+
+
+def index_path(log_file: Path) -> Path:
+    """Path of the on-disk index kept next to a day's log file"""
+    return log_file.with_name(log_file.name + INDEX_SUFFIX)
+
+
+class TransactionIndex:
+    """
+    Index of the transactions completed in one day's log file.
+
+    Every completed transaction is a compact entry (end LSN, end time in µs,
+    txid, status, change count, byte offset of its log line). A txid hash
+    points at the entries, and committed entries are also kept ordered by
+    commit LSN and by commit time so range and point lookups are bisects.
+    Full records are not kept in memory: they are read back from the log by
+    offset when a lookup returns them.
+
+    A finished day is saved as a sidecar index, so loading it again does not
+    parse the log.
+    """
+
+    def __init__(self, log_file: Path):
+        self.log_file = Path(log_file)
+        self.logger = logging.getLogger("TransactionIndex")
+
+        self.entries: List[tuple] = []
+        self.by_txid: Dict[int, int] = {}
+        self.lsn_keys: List[int] = []
+        self.lsn_positions: List[int] = []
+        self.time_keys: List[int] = []
+        self.time_positions: List[int] = []
+
+        self.committed = 0
+        self.rolled_back = 0
+        self.total_changes = 0
+        # Size of the log file covered by the entries
+        self.log_size = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, record: dict, offset: int) -> int:
+        """
+        Index a completed transaction
+
+        Args:
+            record: COMMITTED or ROLLED_BACK log record
+            offset: Byte offset of the record's line in the log file
+
+        Returns:
+            Position of the entry
+        """
+        committed = record['status'] == 'COMMITTED'
+        entry = (
+            to_lsn(record.get('end_lsn'), legacy=True) or 0,
+            timestamp_to_us(record['end_timestamp']),
+            record['txid'],
+            committed,
+            record.get('changes_count', 0),
+            offset
+        )
+        return self._add_entry(entry)
+
+    def _add_entry(self, entry: tuple) -> int:
+        position = len(self.entries)
+        self.entries.append(entry)
+        self.by_txid[entry[_TXID]] = position
+
+        if entry[_STATUS]:
+            self.committed += 1
+            # Commits arrive in commit order, so these are nearly always appends
+            self._insert(self.lsn_keys, self.lsn_positions, entry[_LSN], position)
+            self._insert(self.time_keys, self.time_positions, entry[_TIME], position)
+        else:
+            self.rolled_back += 1
+        self.total_changes += entry[_CHANGES]
+        return position
+
+    @staticmethod
+    def _insert(keys: List[int], positions: List[int], key: int, position: int):
+        if not keys or key >= keys[-1]:
+            keys.append(key)
+            positions.append(position)
+        else:
+            index = bisect_right(keys, key)
+            keys.insert(index, key)
+            positions.insert(index, position)
+
+    # Lookups
+
+    def get(self, txid: int) -> Optional[dict]:
+        """Full record of a completed transaction"""
+        position = self.by_txid.get(txid)
+        if position is None:
+            return None
+        return self.read_records([position])[0]
+
+    def commits_in_time_range(self, start_time: datetime = None, end_time: datetime = None) -> List[int]:
+        """Positions of commits with start_time <= commit time <= end_time, in time order"""
+        low = bisect_left(self.time_keys, timestamp_to_us(start_time)) if start_time is not None else 0
+        high = bisect_right(self.time_keys, timestamp_to_us(end_time)) if end_time is not None else len(self.time_keys)
+        return self.time_positions[low:high]
+
+    def last_commit_before(self, end_time: datetime) -> Optional[int]:
+        """Position of the last commit with commit time <= end_time"""
+        index = bisect_right(self.time_keys, timestamp_to_us(end_time))
+        return self.time_positions[index - 1] if index else None
+
+    def commit_lsns(self, max_lsn: int) -> Dict[int, int]:
+        """txid -> commit LSN of the commits with commit LSN <= max_lsn"""
+        entries = self.entries
+        return {
+            entries[position][_TXID]: entries[position][_LSN]
+            for position in self.lsn_positions[:bisect_right(self.lsn_keys, max_lsn)]
+        }
+
+    def ends_at_or_after(self, txids: Iterable[int], min_lsn: int) -> Dict[int, Tuple[int, bool]]:
+        """txid -> (end LSN, committed) of the given transactions that ended at or after min_lsn"""
+        ended = {}
+        for txid in txids:
+            position = self.by_txid.get(txid)
+            if position is not None and self.entries[position][_LSN] >= min_lsn:
+                entry = self.entries[position]
+                ended[txid] = (entry[_LSN], entry[_STATUS])
+        return ended
+
+    def commit_time_us(self, position: int) -> int:
+        return self.entries[position][_TIME]
+
+    def last_commit_at_or_before(self, lsn: int) -> Optional[int]:
+        """Position of the last commit with commit LSN <= lsn"""
+        index = bisect_right(self.lsn_keys, lsn)
+        return self.lsn_positions[index - 1] if index else None
+
+    def summary(self) -> dict:
+        """Time, LSN and txid ranges and counts of the day"""
+        txids = self.by_txid.keys()
+        return {
+            'log_size': self.log_size,
+            'transactions': len(self.entries),
+            'committed': self.committed,
+            'rolled_back': self.rolled_back,
+            'changes': self.total_changes,
+            'first_commit_us': self.time_keys[0] if self.time_keys else None,
+            'last_commit_us': self.time_keys[-1] if self.time_keys else None,
+            'first_commit_lsn': self.lsn_keys[0] if self.lsn_keys else None,
+            'last_commit_lsn': self.lsn_keys[-1] if self.lsn_keys else None,
+            'min_txid': min(txids) if txids else None,
+            'max_txid': max(txids) if txids else None
+        }
+
+    def read_records(self, positions: Iterable[int]) -> List[dict]:
+        """Full records of entries, read from the log file in offset order"""
+        positions = list(positions)
+        loaded = {}
+        if positions:
+            with open(self.log_file, 'rb') as f:
+                for position in sorted(set(positions)):
+                    f.seek(self.entries[position][_OFFSET])
+                    loaded[position] = json.loads(f.readline())
+        return [loaded[p] for p in positions]
+
+    def recovery_points(self, positions: Iterable[int]) -> List[dict]:
+        """Recovery point dicts for commit entries"""
+        positions = list(positions)
+        points = []
+        for position, record in zip(positions, self.read_records(positions)):
+            entry = self.entries[position]
+            points.append({
+                'txid': entry[_TXID],
+                'timestamp': record['end_timestamp'],
+                'lsn': entry[_LSN],
+                'changes_count': entry[_CHANGES],
+                'tables_affected': record.get('tables_affected', [])
+            })
+        return points
+
+    # Persistence
+
+    @classmethod
+    def build(cls, log_file: Path) -> Tuple['TransactionIndex', Dict[int, dict]]:
+        """
+        Index a log file by reading it once
+
+        Returns:
+            The index and the transactions still ACTIVE at the end of the file
+        """
+        index = cls(log_file)
+        active: Dict[int, dict] = {}
+        offset = 0
+        with open(log_file, 'rb') as f:
+            for line in f:
+                line_offset = offset
+                offset += len(line)
+                if not line.strip():
+                    continue
+                if not line.endswith(b'\n'):
+                    # Torn last line of a crashed writer
+                    offset = line_offset
+                    break
+                record = json.loads(line)
+                if record['status'] == 'ACTIVE':
+                    active[record['txid']] = record
+                else:
+                    active.pop(record['txid'], None)
+                    index.add(record, line_offset)
+        index.log_size = offset
+        return index, active
+
+    def save(self):
+        """Write the sidecar index atomically"""
+        path = index_path(self.log_file)
+        tmp_path = path.with_name(path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'log_size': self.log_size, 'entries': self.entries}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, log_file: Path) -> 'TransactionIndex':
+        """
+        Load a finished day's index, from its sidecar when it is current
+
+        The sidecar is (re)written when the log has to be parsed.
+        """
+        log_file = Path(log_file)
+        path = index_path(log_file)
+        if path.exists():
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data['log_size'] == log_file.stat().st_size:
+                    index = cls(log_file)
+                    for entry in data['entries']:
+                        index._add_entry(tuple(entry))
+                    index.log_size = data['log_size']
+                    return index
+            except Exception as e:
+                logging.getLogger("TransactionIndex").warning(f"Rebuilding index of {log_file.name}: {e}")
+
+        index, _ = cls.build(log_file)
+        try:
+            index.save()
+        except Exception as e:
+            index.logger.warning(f"Could not save index of {log_file.name}: {e}")
+        return index
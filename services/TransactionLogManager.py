@@ -6,19 +6,37 @@ Tracks transaction boundaries and metadata for PITR consistency
 import json
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Optional, Set
-from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+from collections import OrderedDict, defaultdict
 import threading
 
 from .pitr_config import PITR_CONFIG
+from .LSN import LSN, MAX_LSN, format_lsn, parse_lsn, to_lsn
+from .TransactionIndex import TransactionIndex, index_path, timestamp_to_us
+from .BinaryTransactionLog import BinaryTransactionLog, BinaryTransactionLogWriter, tables_path
 
 
 class TransactionLogManager:
     """
     Manages transaction metadata for ensuring PITR consistency.
     Tracks BEGIN, COMMIT, ROLLBACK events and maintains transaction state.
+    
+    Completed transactions are not kept in memory: each day's log file has a
+    TransactionIndex (txid hash, commit LSN and commit time arrays) and full
+    records are read back from the log on demand. Today's index is always
+    loaded; indexes of older days are loaded when a lookup reaches them and
+    kept in an LRU of transaction_index_cache_days days.
+    
+    Completed transactions are also appended in batches to a fixed-width
+    binary log (transactions_YYYYMMDD.txb, see BinaryTransactionLog). A
+    finished day whose binary log is complete is searched through mmap
+    instead of indexing its JSON log.
+    
+    A summary of every finished day (commit time and LSN range, txid range,
+    counts) is kept in transaction_log_summary.json and read at startup, so
+    a query only loads the days whose ranges it touches.
     """
     
     def __init__(self, log_dir: str = None):
@@ -29,11 +47,25 @@ class TransactionLogManager:
         
         # In-memory transaction tracking
         self.active_transactions: Dict[int, dict] = {}  # txid -> metadata
-        self.completed_transactions: List[dict] = []
         self.transaction_lock = threading.Lock()
         
-        # Current transaction log file
+        # Current transaction log file and its index (guarded by transaction_lock)
         self.current_log_file = self._get_current_log_file()
+        self.current_index = TransactionIndex(self.current_log_file)
+        
+        # Opened on the first write, so read-only users (restore tools) never append
+        self.log_handle = None
+        self.binary_log: Optional[BinaryTransactionLogWriter] = None
+        self.binary_log_enabled = PITR_CONFIG.get('binary_transaction_log', True)
+        
+        # Indexes of older days, least recently used first
+        self.day_indexes: OrderedDict = OrderedDict()
+        self.index_cache_days = PITR_CONFIG.get('transaction_index_cache_days', 7)
+        self.index_lock = threading.Lock()
+        
+        # Per-day summaries of finished days (guarded by index_lock)
+        self.summary_file = self.log_dir / "transaction_log_summary.json"
+        self.day_summaries: Dict[str, dict] = self._load_summaries()
         
         # Load existing state
         self._load_state()
@@ -59,29 +91,72 @@ class TransactionLogManager:
     def _get_current_log_file(self) -> Path:
         """Get current transaction log file path"""
         date_str = datetime.now().strftime('%Y%m%d')
-        return self.log_dir / f"transactions_{date_str}.jsonl"
+        return self._log_file_for(date_str)
+    
+    def _log_file_for(self, day: str) -> Path:
+        return self.log_dir / f"transactions_{day}.jsonl"
+    
+    def _binary_log_file_for(self, day: str) -> Path:
+        return self.log_dir / f"transactions_{day}.txb"
+    
+    @staticmethod
+    def _day_of(log_file: Path) -> str:
+        return log_file.stem[len('transactions_'):]
+    
+    def _load_summaries(self) -> Dict[str, dict]:
+        """Read the day summaries, dropping those of changed or removed logs"""
+        if not self.summary_file.exists():
+            return {}
+        try:
+            with open(self.summary_file, 'r') as f:
+                summaries = json.load(f)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable {self.summary_file.name}: {e}")
+            return {}
+        
+        valid = {}
+        for day, summary in summaries.items():
+            log_file = self._log_file_for(day)
+            if log_file.exists() and log_file.stat().st_size == summary.get('log_size'):
+                valid[day] = summary
+        return valid
+    
+    def _save_summaries(self):
+        """Write the day summaries atomically; the caller holds index_lock"""
+        tmp_file = self.summary_file.with_name(self.summary_file.name + '.tmp')
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(self.day_summaries, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, self.summary_file)
+        except Exception as e:
+            self.logger.warning(f"Could not save {self.summary_file.name}: {e}")
+    
+    def _summarize(self, day: str, index):
+        """Record and persist the summary of a finished day"""
+        summary = index.summary()
+        with self.index_lock:
+            if self.day_summaries.get(day) != summary:
+                self.day_summaries[day] = summary
+                self._save_summaries()
     
     def _load_state(self):
         """Load existing transaction state from disk"""
         if self.current_log_file.exists():
             try:
-                with open(self.current_log_file, 'r') as f:
-                    for line in f:
-                        if line.strip():
-                            tx_data = json.loads(line)
-                            if tx_data['status'] == 'ACTIVE':
-                                self.active_transactions[tx_data['txid']] = tx_data
-                            else:
-                                self.completed_transactions.append(tx_data)
+                self.current_index, active = TransactionIndex.build(self.current_log_file)
+                for tx_data in active.values():
+                    # Older logs store decimal 'hi/lo' text
+                    tx_data['start_lsn'] = to_lsn(tx_data.get('start_lsn'), legacy=True)
+                    self.active_transactions[tx_data['txid']] = tx_data
                 
                 self.logger.info(
                     f"Loaded {len(self.active_transactions)} active and "
-                    f"{len(self.completed_transactions)} completed transactions"
+                    f"{len(self.current_index)} completed transactions"
                 )
             except Exception as e:
                 self.logger.error(f"Error loading transaction state: {e}")
     
-    def begin_transaction(self, txid: int, lsn: str, timestamp: datetime = None):
+    def begin_transaction(self, txid: int, lsn: Optional[LSN], timestamp: datetime = None):
         """
         Record the beginning of a transaction
         
@@ -91,23 +166,30 @@ class TransactionLogManager:
             timestamp: Transaction start timestamp
         """
         with self.transaction_lock:
-            if txid in self.active_transactions:
-                self.logger.warning(f"Transaction {txid} already active, ignoring BEGIN")
-                return
-            
-            tx_metadata = {
-                'txid': txid,
-                'start_lsn': lsn,
-                'start_timestamp': (timestamp or datetime.now()).isoformat(),
-                'status': 'ACTIVE',
-                'changes_count': 0,
-                'tables_affected': set()
-            }
-            
-            self.active_transactions[txid] = tx_metadata
-            self._write_transaction_log(tx_metadata)
-            
-            self.logger.debug(f"Transaction {txid} started at LSN {lsn}")
+            self._begin_locked(txid, lsn, timestamp)
+    
+    def _begin_locked(self, txid: int, lsn: Optional[LSN], timestamp: datetime = None):
+        """begin_transaction body; the caller holds transaction_lock"""
+        if txid in self.active_transactions:
+            self.logger.warning(f"Transaction {txid} already active, ignoring BEGIN")
+            return
+        
+        tx_metadata = {
+            'txid': txid,
+            'start_lsn': to_lsn(lsn),
+            'start_timestamp': (timestamp or datetime.now()).isoformat(),
+            'status': 'ACTIVE',
+            'changes_count': 0,
+            'tables_affected': set()
+        }
+        
+        self.active_transactions[txid] = tx_metadata
+        self._write_transaction_log(tx_metadata)
+        
+        start_lsn = tx_metadata['start_lsn']
+        self.logger.debug(
+            f"Transaction {txid} started at LSN {format_lsn(start_lsn) if start_lsn is not None else 'unknown'}"
+        )
     
     def add_change_to_transaction(self, txid: int, table_name: str):
         """
@@ -123,7 +205,7 @@ class TransactionLogManager:
                 self.logger.warning(
                     f"Transaction {txid} not found, auto-creating"
                 )
-                self.begin_transaction(txid, "unknown", datetime.now())
+                self._begin_locked(txid, None, datetime.now())
             
             tx = self.active_transactions[txid]
             tx['changes_count'] += 1
@@ -132,7 +214,7 @@ class TransactionLogManager:
             else:
                 tx['tables_affected'] = {table_name}
     
-    def commit_transaction(self, txid: int, lsn: str, timestamp: datetime = None):
+    def commit_transaction(self, txid: int, lsn: LSN, timestamp: datetime = None):
         """
         Record transaction commit
         
@@ -147,20 +229,19 @@ class TransactionLogManager:
                 return
             
             tx = self.active_transactions.pop(txid)
-            tx['end_lsn'] = lsn
+            tx['end_lsn'] = parse_lsn(lsn)
             tx['end_timestamp'] = (timestamp or datetime.now()).isoformat()
             tx['status'] = 'COMMITTED'
             tx['tables_affected'] = list(tx['tables_affected'])  # Convert set to list for JSON
             
-            self.completed_transactions.append(tx)
             self._write_transaction_log(tx)
             
             self.logger.info(
-                f"Transaction {txid} committed at LSN {lsn} "
+                f"Transaction {txid} committed at LSN {format_lsn(tx['end_lsn'])} "
                 f"({tx['changes_count']} changes)"
             )
     
-    def rollback_transaction(self, txid: int, lsn: str, timestamp: datetime = None):
+    def rollback_transaction(self, txid: int, lsn: LSN, timestamp: datetime = None):
         """
         Record transaction rollback
         
@@ -175,35 +256,219 @@ class TransactionLogManager:
                 return
             
             tx = self.active_transactions.pop(txid)
-            tx['end_lsn'] = lsn
+            tx['end_lsn'] = parse_lsn(lsn)
             tx['end_timestamp'] = (timestamp or datetime.now()).isoformat()
             tx['status'] = 'ROLLED_BACK'
             tx['tables_affected'] = list(tx['tables_affected'])
             
-            self.completed_transactions.append(tx)
             self._write_transaction_log(tx)
             
-            self.logger.info(f"Transaction {txid} rolled back at LSN {lsn}")
+            self.logger.info(f"Transaction {txid} rolled back at LSN {format_lsn(tx['end_lsn'])}")
     
     def _write_transaction_log(self, tx_data: dict):
-        """Write transaction metadata to log file"""
+        """Write transaction metadata to log file and index completed transactions"""
         try:
             # Check if we need to rotate to a new log file
             current_file = self._get_current_log_file()
             if current_file != self.current_log_file:
-                self.current_log_file = current_file
+                self._rotate_index(current_file)
             
-            with open(self.current_log_file, 'a') as f:
-                # Convert sets to lists for JSON serialization
-                tx_copy = tx_data.copy()
-                if 'tables_affected' in tx_copy and isinstance(tx_copy['tables_affected'], set):
-                    tx_copy['tables_affected'] = list(tx_copy['tables_affected'])
-                
-                f.write(json.dumps(tx_copy) + '\n')
+            if self.log_handle is None:
+                self._open_logs()
+            
+            f = self.log_handle
+            offset = f.tell()
+            # Convert sets to lists for JSON serialization
+            tx_copy = tx_data.copy()
+            if 'tables_affected' in tx_copy and isinstance(tx_copy['tables_affected'], set):
+                tx_copy['tables_affected'] = list(tx_copy['tables_affected'])
+            
+            f.write((json.dumps(tx_copy) + '\n').encode('utf-8'))
+            f.flush()
+            self.current_index.log_size = f.tell()
+            
+            if tx_copy['status'] != 'ACTIVE':
+                self.current_index.add(tx_copy, offset)
+                if self.binary_log is not None:
+                    self.binary_log.append(tx_copy)
         
         except Exception as e:
             self.logger.error(f"Error writing transaction log: {e}")
     
+    def _open_logs(self):
+        """
+        Open today's JSON log and binary log for appending
+        
+        Completed transactions missing from the binary log (its last batch
+        was lost in a crash) are re-appended from the JSON log.
+        """
+        self.log_handle = open(self.current_log_file, 'ab')
+        if not self.binary_log_enabled:
+            return
+        
+        try:
+            self.binary_log = BinaryTransactionLogWriter(
+                self._binary_log_file_for(self._day_of(self.current_log_file))
+            )
+            missing = range(len(self.binary_log), len(self.current_index))
+            if missing:
+                for record in self.current_index.read_records(missing):
+                    self.binary_log.append(record)
+                self.binary_log.flush()
+                self.logger.info(f"Recovered {len(missing)} transactions into the binary transaction log")
+        except Exception as e:
+            self.logger.error(f"Binary transaction log disabled for today: {e}")
+            self.binary_log = None
+    
+    def _close_logs(self):
+        """Close today's logs; the binary log records the JSON log size it covers"""
+        if self.log_handle is not None:
+            self.log_handle.close()
+            self.log_handle = None
+        if self.binary_log is not None:
+            try:
+                self.binary_log.close(self.current_index.log_size)
+            except Exception as e:
+                self.logger.error(f"Error closing binary transaction log: {e}")
+            self.binary_log = None
+    
+    def close(self):
+        """Flush and close the transaction logs"""
+        with self.transaction_lock:
+            self._close_logs()
+    
+    def _rotate_index(self, new_log_file: Path):
+        """Close the finished day's logs and start the index of new_log_file"""
+        finished = self.current_index
+        has_binary_log = self.binary_log is not None
+        self._close_logs()
+        if finished.log_file.exists():
+            if not has_binary_log:
+                try:
+                    finished.save()
+                except Exception as e:
+                    self.logger.warning(f"Could not save index of {finished.log_file.name}: {e}")
+            day = self._day_of(finished.log_file)
+            self._summarize(day, finished)
+            self._cache_day_index(day, finished)
+        
+        self.current_log_file = new_log_file
+        self.current_index = TransactionIndex(new_log_file)
+    
+    def _cache_day_index(self, day: str, index):
+        with self.index_lock:
+            self.day_indexes[day] = index
+            self.day_indexes.move_to_end(day)
+            while len(self.day_indexes) > self.index_cache_days:
+                self.day_indexes.popitem(last=False)
+    
+    def _log_days(self) -> List[str]:
+        """Days that have a transaction log, oldest first"""
+        return sorted(self._day_of(log_file) for log_file in self.log_dir.glob("transactions_*.jsonl"))
+    
+    def _day_index(self, day: str):
+        """
+        Index of a finished day, loaded on first use
+        
+        Returns the day's BinaryTransactionLog when it covers the whole JSON
+        log, else a TransactionIndex of the JSON log (or None).
+        """
+        with self.index_lock:
+            index = self.day_indexes.get(day)
+            if index is not None:
+                self.day_indexes.move_to_end(day)
+                return index
+        
+        log_file = self._log_file_for(day)
+        if not log_file.exists():
+            return None
+        index = self._load_binary_log(day, log_file.stat().st_size)
+        try:
+            index = index or TransactionIndex.load(log_file)
+        except Exception as e:
+            self.logger.error(f"Error indexing {log_file.name}: {e}")
+            return None
+        if day not in self.day_summaries:
+            self._summarize(day, index)
+        self._cache_day_index(day, index)
+        return index
+    
+    def _load_binary_log(self, day: str, log_size: int) -> Optional[BinaryTransactionLog]:
+        path = self._binary_log_file_for(day)
+        if not path.exists():
+            return None
+        try:
+            binary_log = BinaryTransactionLog(path)
+        except Exception as e:
+            self.logger.warning(f"Unreadable binary transaction log {path.name}: {e}")
+            return None
+        if binary_log.log_size != log_size:
+            # Not closed cleanly, or still being written by another process
+            binary_log.close()
+            return None
+        return binary_log
+    
+    def _search_days(self, days: List[str], search: Callable) -> Iterator[tuple]:
+        """
+        Run search(index) over the index of each day
+        
+        Today's index is searched under transaction_lock since commits
+        extend it. Yields (index, result) pairs in the order of days.
+        """
+        current_day = self._day_of(self.current_log_file)
+        for day in days:
+            if day == current_day:
+                with self.transaction_lock:
+                    index = self.current_index
+                    result = search(index)
+            else:
+                index = self._day_index(day)
+                if index is None:
+                    continue
+                result = search(index)
+            yield index, result
+    
+    def _may_hold(self, day: str, test: Callable) -> bool:
+        """
+        Check a finished day's summary before loading the day
+        
+        Today and days without a summary yet are always searched.
+        """
+        if day == self._day_of(self.current_log_file):
+            return True
+        summary = self.day_summaries.get(day)
+        return summary is None or test(summary)
+    
+    def _days_between(self, start_time: datetime = None, end_time: datetime = None) -> List[str]:
+        """
+        Log days that can hold commits within [start_time, end_time]
+        
+        Days with a summary are selected by their commit time range. Others
+        go by file name, which is the local write date while commit
+        timestamps come from the server, so a day of slack is allowed on
+        each side.
+        """
+        low = (start_time - timedelta(days=1)).strftime('%Y%m%d') if start_time else None
+        high = (end_time + timedelta(days=1)).strftime('%Y%m%d') if end_time else None
+        start_us = timestamp_to_us(start_time) if start_time else None
+        end_us = timestamp_to_us(end_time) if end_time else None
+        
+        def overlaps(summary: dict) -> bool:
+            return (
+                summary['committed'] > 0
+                and (start_us is None or summary['last_commit_us'] >= start_us)
+                and (end_us is None or summary['first_commit_us'] <= end_us)
+            )
+        
+        days = []
+        for day in self._log_days():
+            if day in self.day_summaries and day != self._day_of(self.current_log_file):
+                if overlaps(self.day_summaries[day]):
+                    days.append(day)
+            elif (low is None or day >= low) and (high is None or day <= high):
+                days.append(day)
+        return days
+    
     def get_consistent_recovery_points(
         self, 
         start_time: datetime = None, 
@@ -221,37 +486,134 @@ class TransactionLogManager:
         """
         recovery_points = []
         
-        for tx in self.completed_transactions:
-            if tx['status'] != 'COMMITTED':
-                continue
-            
-            tx_time = datetime.fromisoformat(tx['end_timestamp'])
-            
-            if start_time and tx_time < start_time:
-                continue
-            if end_time and tx_time > end_time:
-                continue
-            
-            recovery_points.append({
-                'txid': tx['txid'],
-                'timestamp': tx['end_timestamp'],
-                'lsn': tx['end_lsn'],
-                'changes_count': tx['changes_count'],
-                'tables_affected': tx['tables_affected']
-            })
+        for index, positions in self._search_days(
+            self._days_between(start_time, end_time),
+            lambda index: index.commits_in_time_range(start_time, end_time)
+        ):
+            recovery_points.extend(index.recovery_points(positions))
         
+        # Each day is already in time order; only the day boundaries may interleave
         return sorted(recovery_points, key=lambda x: x['timestamp'])
     
+    def get_recovery_point_before(self, end_time: datetime) -> Optional[dict]:
+        """
+        Get the last transaction-consistent recovery point at or before end_time
+        
+        Days are searched by the latest commit time they can contribute
+        (their last commit, capped at end_time); the search stops once the
+        best match is at least as late as what the remaining days can offer.
+        Days without a summary can offer anything and are searched first.
+        """
+        end_us = timestamp_to_us(end_time)
+        candidates = []
+        for day in self._days_between(end_time=end_time):
+            summary = self.day_summaries.get(day)
+            if day == self._day_of(self.current_log_file) or summary is None:
+                bound = end_us
+            else:
+                bound = min(summary['last_commit_us'], end_us)
+            candidates.append((bound, day))
+        candidates.sort(reverse=True)
+        
+        best = None
+        best_time = None
+        for bound, day in candidates:
+            if best_time is not None and best_time >= bound:
+                break
+            for index, position in self._search_days([day], lambda index: index.last_commit_before(end_time)):
+                if position is not None and (best_time is None or index.commit_time_us(position) > best_time):
+                    best = (index, position)
+                    best_time = index.commit_time_us(position)
+        
+        if best is None:
+            return None
+        index, position = best
+        return index.recovery_points([position])[0]
+    
+    def get_recovery_point_for_lsn(self, lsn: LSN) -> Optional[dict]:
+        """
+        Get the last transaction that committed at or before an LSN
+        
+        Commit LSNs increase from one day's log to the next, so the newest day
+        with a commit at or before lsn holds the answer. Summaries rule out
+        days that start after lsn without loading them.
+        """
+        lsn = parse_lsn(lsn)
+        days = [
+            day for day in reversed(self._log_days())
+            if self._may_hold(day, lambda summary: summary['committed'] > 0 and summary['first_commit_lsn'] <= lsn)
+        ]
+        for index, position in self._search_days(days, lambda index: index.last_commit_at_or_before(lsn)):
+            if position is not None:
+                return index.recovery_points([position])[0]
+        return None
+    
+    def get_commit_lsns(self, max_lsn: LSN = None) -> Dict[int, LSN]:
+        """
+        Get txid -> commit LSN of all transactions that committed at or before an LSN
+        
+        One pass over the commit LSN index of each day that can hold such
+        commits; restores use it for O(1) commit checks and commit ordering.
+        Without max_lsn, every logged commit is returned.
+        """
+        max_lsn = parse_lsn(max_lsn) if max_lsn is not None else MAX_LSN
+        days = [
+            day for day in self._log_days()
+            if self._may_hold(day, lambda summary: summary['committed'] > 0 and summary['first_commit_lsn'] <= max_lsn)
+        ]
+        commit_lsns = {}
+        for _, day_commits in self._search_days(days, lambda index: index.commit_lsns(max_lsn)):
+            commit_lsns.update(day_commits)
+        return commit_lsns
+    
+    def get_commit_lsns_of(self, txids: Iterable[int], min_lsn: LSN = None) -> Dict[int, LSN]:
+        """
+        Get txid -> commit LSN of the given transactions
+        
+        txids wrap and are only unique within a day's log, so each txid is
+        matched to the first transaction of that id to end at or after
+        min_lsn (e.g. the first LSN of the changes it is looked up for), and
+        left out if that one rolled back. Only days whose txid range holds
+        one of them are loaded, and only the given txids are kept.
+        """
+        pending = set(txids)
+        if not pending:
+            return {}
+        min_lsn = parse_lsn(min_lsn) if min_lsn is not None else 0
+        low, high = min(pending), max(pending)
+        days = [
+            day for day in self._log_days()
+            if self._may_hold(day, lambda summary: summary['transactions'] > 0 and summary['min_txid'] <= high and summary['max_txid'] >= low)
+        ]
+        commit_lsns = {}
+        # Oldest day first: the first end found is the earliest one
+        for _, ended in self._search_days(days, lambda index: index.ends_at_or_after(pending, min_lsn)):
+            for txid, (lsn, committed) in ended.items():
+                pending.discard(txid)
+                if committed:
+                    commit_lsns[txid] = lsn
+            if not pending:
+                break
+        return commit_lsns
+    
     def get_transaction_info(self, txid: int) -> Optional[dict]:
         """Get information about a specific transaction"""
         # Check active transactions
-        if txid in self.active_transactions:
-            return self.active_transactions[txid].copy()
+        with self.transaction_lock:
+            if txid in self.active_transactions:
+                return self.active_transactions[txid].copy()
         
-        # Check completed transactions
-        for tx in self.completed_transactions:
-            if tx['txid'] == txid:
-                return tx.copy()
+        # Check completed transactions, newest day first
+        days = [
+            day for day in reversed(self._log_days())
+            if self._may_hold(day, lambda summary: summary['transactions'] > 0 and summary['min_txid'] <= txid <= summary['max_txid'])
+        ]
+        for index, record in self._search_days(days, lambda index: index.get(txid)):
+            if record is not None:
+                # Older logs store decimal 'hi/lo' text
+                record['start_lsn'] = to_lsn(record.get('start_lsn'), legacy=True)
+                record['end_lsn'] = to_lsn(record.get('end_lsn'), legacy=True)
+                return record
         
         return None
     
@@ -275,6 +637,12 @@ class TransactionLogManager:
             if log_file.stat().st_mtime < cutoff_date:
                 try:
                     log_file.unlink()
+                    index_path(log_file).unlink(missing_ok=True)
+                    binary_log_file = self._binary_log_file_for(self._day_of(log_file))
+                    binary_log_file.unlink(missing_ok=True)
+                    tables_path(binary_log_file).unlink(missing_ok=True)
+                    with self.index_lock:
+                        self.day_indexes.pop(self._day_of(log_file), None)
                     removed_count += 1
                     self.logger.info(f"Removed old transaction log: {log_file.name}")
                 except Exception as e:
@@ -284,15 +652,13 @@ class TransactionLogManager:
             self.logger.info(f"Cleaned up {removed_count} old transaction log files")
     
     def get_statistics(self) -> dict:
-        """Get transaction statistics"""
+        """Get transaction statistics (today's log)"""
         with self.transaction_lock:
-            committed = sum(1 for tx in self.completed_transactions if tx['status'] == 'COMMITTED')
-            rolled_back = sum(1 for tx in self.completed_transactions if tx['status'] == 'ROLLED_BACK')
-            
+            index = self.current_index
             return {
                 'active_transactions': len(self.active_transactions),
-                'completed_transactions': len(self.completed_transactions),
-                'committed_transactions': committed,
-                'rolled_back_transactions': rolled_back,
-                'total_changes': sum(tx['changes_count'] for tx in self.completed_transactions)
+                'completed_transactions': len(index),
+                'committed_transactions': index.committed,
+                'rolled_back_transactions': index.rolled_back,
+                'total_changes': index.total_changes
             }
@@ -18,6 +18,7 @@ PITR_CONFIG = {
     'backup_dir': str(BACKUP_BASE_DIR),
     'transaction_log_dir': str(TRANSACTION_LOG_DIR),
     'metadata_dir': str(METADATA_DIR),
+    'catalog_db': None,  # SQLite backup catalog (None = metadata_dir/backup_catalog.db; imports backup_catalog.json once)
     
     # Retention settings
     'retention_days': 30,  # Keep backups for 30 days
@@ -26,18 +27,61 @@ PITR_CONFIG = {
     # Storage settings
     'compression_enabled': False,  # Disabled for direct restorability via psql
     'compression_level': 6,
-    'backup_format': 'sql',  # 'sql' for direct restorability, 'jsonl' for structured
-    'base_backup_format': 'custom',  # 'custom' (pg_dump -Fc) for pg_restore compatibility
+    'compression_block_size': 64 * 1024,  # Uncompressed bytes per independent gzip block of a compressed segment
+    'decompress_workers': None,  # Threads decompressing blocks on read (None = CPU count)
+    'backup_format': 'sql',  # 'sql' for direct restorability, 'jsonl' for structured, 'binary' for indexed
+    'binary_block_size': 64 * 1024,  # Block size of 'binary' segments (unit of the footer index)
+    'base_backup_format': 'custom',  # 'custom' (pg_dump -Fc) for pg_restore compatibility, 'directory' (pg_dump -Fd) for parallel dump and restore, 'plain' for psql, 'copy' for table data via parallel COPY workers
+    'base_backup_jobs': 4,  # pg_dump -j jobs of 'directory' base snapshots, COPY workers of 'copy' ones (one table per job)
+    'base_backup_schema_only': None,  # True: schema only; False: include table data (what -j parallelizes); None: data for 'directory' snapshots only
+    'base_restore_jobs': None,  # pg_restore -j jobs for custom / directory base snapshots, COPY loaders for 'copy' ones (None = CPU count)
+    'base_backup_export_snapshot': True,  # Dump the snapshot exported by a temporary replication slot and record its LSN
+    'base_copy_compression': True,  # Block-compress the per-table files of 'copy' base snapshots
+    'segment_buffer_bytes': 1024 * 1024,  # User-space write buffer of the open backup segment
 
     
     # Transaction settings
-    'batch_size': 20,  # Number of changes to batch before writing (reduced for responsiveness)
+    'batch_size': 1000,  # Changes of an open transaction buffered before spilling to disk
     'flush_interval_seconds': 5,  # Force flush every N seconds (checked on next change)
     'background_flush_interval': 5,  # Background check for flushes every N seconds
+    'transaction_index_cache_days': 7,  # Older days' transaction log indexes kept in memory (LRU)
+    'binary_transaction_log': True,  # Also append completed transactions to fixed-width transactions_YYYYMMDD.txb
+    'transaction_log_batch_records': 64,  # Binary transaction log records written per batch
+    
+    # Group commit settings
+    'group_commit_durability': 'window',  # 'commit' = fsync every commit, 'window' = fsync once per group
+    'group_commit_window_ms': 10,  # Max time a commit waits for its group to be written
+    'group_commit_max_transactions': 100,  # Write the group early at this many transactions
+    'group_commit_max_bytes': 4 * 1024 * 1024,  # ... or at this many buffered bytes
+    'buffer_backpressure_factor': 4,  # Producers drain inline past this many times group_commit_max_bytes
+    
+    # Capture pipeline settings (reader -> parser -> writer threads)
+    'pipeline_enabled': True,  # False parses and writes on the replication reader thread
+    'pipeline_parse_queue_size': 10000,  # Raw messages waiting for the parser
+    'pipeline_write_queue_size': 10000,  # Parsed events waiting for the writer
+    
+    # LSN checkpoint settings
+    'lsn_checkpoint_file': 'last_lsn.txt',  # Highest LSN durably stored in backups
+    'lsn_checkpoint_interval_seconds': 1,  # How often a changed checkpoint is written
+    
+    # Capture parser settings
+    'parser_preload_catalog': True,  # Compile column layouts from pg_catalog at startup
+    'parser_max_layouts_per_table': 8,  # Cached layouts per table (full row, old-key, ...)
     
     # Recovery settings
     'enable_transaction_consistency': True,  # Only recover to transaction boundaries
     'verify_lsn_continuity': True,  # Verify LSN sequence is continuous
+    'restore_batch_size': 1000,  # Changes streamed to the apply stage per batch during restore
+    'restore_bulk_min_rows': 16,  # Shortest run of similar changes applied with COPY / staged UPDATE / DELETE
+    'restore_prepared_statements': 256,  # Row-level statements kept PREPAREd per restore connection (LRU); 0 disables
+    'restore_changes_per_second': 20000,  # Bulk apply throughput assumed by restore time estimates
+    'restore_coalesce': False,  # Fold each row's changes into one net change before applying a restore (can break unique constraints on non-key columns)
+    'restore_coalesce_window': 100000,  # Changes folded together before the pending net changes are flushed
+    'restore_workers': 1,  # Restore connections; > 1 applies transactions with disjoint writesets in parallel
+    'restore_parallel_window': 4096,  # Transactions scheduled ahead of the oldest uncommitted one in a parallel restore
+    'sql_replay_batch_statements': 1000,  # Statements of whole transactions sent per round trip when replaying SQL segments
+    'sql_replay_retries': 3,  # Reconnects per SQL segment replay before giving up (resumes after the last applied LSN)
+    'sql_replay_pool_size': 2,  # Pooled connections per SQL replay target database
     
     # Logging
     'log_level': 'INFO',
@@ -64,5 +108,6 @@ REPLICATION_CONFIG = {
     'slot_name': 'vstatetest_slot_temp_v2',  # Changed to bypass lock
     'output_plugin': 'test_decoding',  # or 'pgoutput' for native logical replication
     'publication_name': 'cdc_publication',  # if using pgoutput
+    'proto_version': 1,  # pgoutput protocol version (binary decoder supports v1)
     'temporary': True  # New flag to indicate temporary slot
 }
@@ -0,0 +1,97 @@
+import os
+import sys
+import tempfile
+import logging
+from datetime import datetime, timedelta
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.BinarySegment import BinarySegmentReader, BinarySegmentWriter
+from services.SegmentWriter import SegmentWriter
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("BinarySegmentTest")
+
+START = datetime(2026, 3, 1, 12, 0, 0)
+
+
+def make_changes(count):
+    changes = []
+    for n in range(count):
+        table = 'public.orders' if n % 3 else 'public."Line Items"'
+        changes.append({
+            'lsn': 0x1000000 + n * 40,
+            'txid': 500 + n // 4,
+            'timestamp': (START + timedelta(seconds=n)).isoformat(),
+            'table': table,
+            'operation': ('INSERT', 'UPDATE', 'DELETE')[n % 3],
+            'data': {'id': n, 'payload': 'x' * (n % 50)},
+            'old_data': {'id': n} if n % 3 else None
+        })
+    return changes
+
+
+def write_segment(path, changes, seal=True, compressed=False):
+    writer = SegmentWriter(path, compressed=compressed)
+    binary_writer = BinarySegmentWriter(writer, block_size=512)
+    for change in changes:
+        binary_writer.append(change)
+    if seal:
+        binary_writer.seal()
+    writer.close()
+
+
+def test_round_trip():
+    """Sealed, unsealed and block-compressed segments read back every change"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_binary_')
+    changes = make_changes(200)
+
+    for name, seal, compressed in (('sealed.bin', True, False), ('unsealed.bin', False, False), ('sealed.bin.gz', True, True)):
+        path = os.path.join(work_dir, name)
+        write_segment(path, changes, seal=seal, compressed=compressed)
+        with BinarySegmentReader(path) as reader:
+            assert reader.sealed == seal
+            assert len(reader.blocks) > 1
+            assert list(reader.read_changes()) == changes, name
+        logger.info(f"{name}: {len(changes)} changes round-tripped")
+
+
+def test_range_reads():
+    """LSN, time and table ranges only decode the blocks that can match"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_binary_')
+    changes = make_changes(200)
+    path = os.path.join(work_dir, 'segment.bin')
+    write_segment(path, changes)
+
+    with BinarySegmentReader(path) as reader:
+        low, high = changes[50]['lsn'], changes[59]['lsn']
+        assert list(reader.read_changes(start_lsn=low, end_lsn=high)) == changes[50:60]
+        assert len(reader.select_blocks(start_lsn=low, end_lsn=high)) < len(reader.blocks)
+
+        end_time = START + timedelta(seconds=9)
+        assert list(reader.read_changes(end_time=end_time)) == changes[:10]
+
+        tables = ['public."Line Items"']
+        assert list(reader.read_changes(tables=tables)) == [c for c in changes if c['table'] in tables]
+    logger.info("Range reads match the filtered changes")
+
+
+def test_rejects_other_files():
+    """A file without the segment header is refused"""
+    path = os.path.join(tempfile.mkdtemp(prefix='cdc_binary_'), 'other.bin')
+    with open(path, 'wb') as f:
+        f.write(b'not a segment at all')
+    try:
+        BinarySegmentReader(path)
+    except ValueError:
+        logger.info("Foreign file rejected")
+        return
+    raise AssertionError("a file without the segment header was read")
+
+
+if __name__ == "__main__":
+    test_round_trip()
+    test_range_reads()
+    test_rejects_other_files()
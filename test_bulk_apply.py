@@ -0,0 +1,156 @@
+import os
+import sys
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.BulkApply import BulkApplier, ChangeFailed, _array_literal, _copy_value
+from services.TableKeys import TableKeyCache
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("BulkApplyTest")
+
+
+class RecordingCursor:
+    """Cursor that records statements and COPY data; fails statements containing fail_on"""
+
+    def __init__(self, fail_on=None):
+        self.statements = []
+        self.copied = []
+        self.fail_on = fail_on
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError(f"failed: {query}")
+
+    def copy_expert(self, query, source):
+        self.execute(query)
+        self.copied.append(source.read())
+
+
+def insert(table, row_id, **data):
+    return {'table': table, 'operation': 'INSERT', 'data': {'id': row_id, **data}, 'old_data': None}
+
+
+def update(table, row_id, **data):
+    return {'table': table, 'operation': 'UPDATE', 'data': {'id': row_id, **data}, 'old_data': {'id': row_id}}
+
+
+def delete(table, row_id):
+    return {'table': table, 'operation': 'DELETE', 'data': {'id': row_id}, 'old_data': {'id': row_id}}
+
+
+def make_applier(cursor, applied=None, min_rows=3, **kwargs):
+    table_keys = TableKeyCache()
+    table_keys.register('public.a', ['id'])
+    table_keys.register('public.b', ['id'])
+
+    def apply_change(cur, change, statements):
+        if applied is not None:
+            applied.append(change)
+        cur.execute(f"{change['operation']} {change['table']} {change['data']['id']}")
+
+    return BulkApplier(cursor, apply_change, min_rows=min_rows, table_keys=table_keys, **kwargs)
+
+
+def test_copy_values():
+    """Values are written in COPY text format; lists as array literals"""
+    assert _copy_value(None) == '\\N'
+    assert _copy_value(True) == 't'
+    assert _copy_value('a\tb\nc\\d') == 'a\\tb\\nc\\\\d'
+    assert _copy_value({'k': 1}) == '{"k": 1}'
+    assert _array_literal([1, None, True, 'x "y"', [2, 3]]) == '{1,NULL,t,"x \\"y\\"",{2,3}}'
+    assert _copy_value(['a\\b', 'c']) == '{"a\\\\\\\\b","c"}'
+    logger.info("COPY values formatted")
+
+
+def test_runs():
+    """Runs break at another table or kind, and at a row updated twice"""
+    applier = make_applier(RecordingCursor())
+    changes = [
+        insert('public.a', 1, v=1), insert('public.a', 2, v=2),
+        insert('public.a', 3, w=3),
+        update('public.a', 1, v=5), update('public.a', 2, v=6), update('public.a', 1, v=7),
+        delete('public.b', 1), delete('public.b', 2),
+        {'table': 'public.b', 'operation': 'TRUNCATE', 'data': {}, 'old_data': None}
+    ]
+    runs = [[change['data'].get('id') for change in run] for _, run in applier._runs(changes)]
+    assert runs == [[1, 2], [3], [1, 2], [1], [1, 2], [None]], runs
+    logger.info("Runs built")
+
+
+def test_bulk_statements():
+    """Long runs become COPY and staged UPDATE / DELETE"""
+    cursor = RecordingCursor()
+    applier = make_applier(cursor)
+    changes = (
+        [insert('public.a', n, v=n) for n in range(5)]
+        + [update('public.a', n, v=n * 10) for n in range(5)]
+        + [delete('public.a', n) for n in range(5)]
+    )
+    assert applier.apply(changes) == 15
+    assert 'COPY public.a (id, v) FROM STDIN' in cursor.statements
+    assert cursor.copied[0] == ''.join(f"{n}\t{n}\n" for n in range(5))
+    assert any(s.startswith('UPDATE public.a AS t SET v = s.v FROM cdc_stage_') for s in cursor.statements)
+    assert any(s.startswith('DELETE FROM public.a AS t USING cdc_stage_') for s in cursor.statements)
+    assert applier.stats['copy_runs'] == 1 and applier.stats['update_runs'] == 1 and applier.stats['delete_runs'] == 1
+    logger.info("Bulk statements issued")
+
+
+def test_single_changes_share_a_savepoint():
+    """Short runs in a row are applied under one savepoint, not one per change"""
+    cursor = RecordingCursor()
+    applier = make_applier(cursor)
+    changes = [insert('public.a', 1), update('public.b', 2), delete('public.a', 3)]
+    assert applier.apply(changes) == 3
+    assert cursor.statements == [
+        'SAVEPOINT cdc_changes', 'INSERT public.a 1', 'UPDATE public.b 2', 'DELETE public.a 3',
+        'RELEASE SAVEPOINT cdc_changes'
+    ], cursor.statements
+    logger.info("One savepoint for consecutive single changes")
+
+
+def test_failed_change_skipped():
+    """A failing change is skipped on its own; with stop_on_error it raises"""
+    changes = [insert('public.a', 1), update('public.b', 2), delete('public.a', 3)]
+
+    cursor = RecordingCursor(fail_on='UPDATE public.b 2')
+    applier = make_applier(cursor)
+    assert applier.apply(changes) == 2
+    assert applier.stats['failed_changes'] == 1
+    assert 'ROLLBACK TO SAVEPOINT cdc_change' in cursor.statements
+
+    applier = make_applier(RecordingCursor(fail_on='UPDATE public.b 2'), stop_on_error=True)
+    try:
+        applier.apply(changes)
+    except ChangeFailed as e:
+        assert e.change is changes[1]
+    else:
+        raise AssertionError("stop_on_error did not raise")
+    logger.info("Failed change skipped or raised")
+
+
+def test_failed_bulk_run_replayed():
+    """A failing bulk statement rolls back its run and replays it change by change"""
+    cursor = RecordingCursor(fail_on='COPY')
+    applied = []
+    applier = make_applier(cursor, applied)
+    changes = [insert('public.a', n) for n in range(4)]
+    assert applier.apply(changes) == 4
+    assert applied == changes
+    assert applier.stats['failed_runs'] == 1
+    assert 'ROLLBACK TO SAVEPOINT cdc_bulk_run' in cursor.statements
+    logger.info("Failed bulk run replayed")
+
+
+if __name__ == "__main__":
+    test_copy_values()
+    test_runs()
+    test_bulk_statements()
+    test_single_changes_share_a_savepoint()
+    test_failed_change_skipped()
+    test_failed_bulk_run_replayed()
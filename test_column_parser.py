@@ -0,0 +1,66 @@
+import os
+import sys
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ColumnParser import ColumnParser
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ColumnParserTest")
+
+ROW = "id[integer]:7 name[text]:'It''s here' price[numeric]:9.5 active[boolean]:true note[text]:null"
+
+
+def test_parse_converts_types():
+    """test_decoding values are converted by column type"""
+    parser = ColumnParser()
+    row = parser.parse('public.items', ROW)
+    assert row == {'id': 7, 'name': "It's here", 'price': 9.5, 'active': True, 'note': None}
+    assert parser.parse(None, ROW) == row
+    assert parser.parse('public.items', '  ') == {}
+    logger.info("Values converted by type")
+
+
+def test_layout_cache():
+    """The first row compiles a layout; later rows of the same shape hit it"""
+    parser = ColumnParser()
+    parser.parse('public.items', ROW)
+    again = parser.parse('public.items', "id[integer]:8 name[text]:'x' price[numeric]:1 active[boolean]:false note[text]:'n'")
+    assert again == {'id': 8, 'name': 'x', 'price': 1.0, 'active': False, 'note': 'n'}
+    assert parser.stats['misses'] == 1 and parser.stats['hits'] == 1
+
+    # An old-key tuple is a second live layout of the same table
+    assert parser.parse('public.items', 'id[integer]:8') == {'id': 8}
+    assert len(parser.layouts['public.items']) == 2
+    logger.info("Layouts cached per table")
+
+
+def test_type_change_invalidates():
+    """A column seen with another type drops the table's cached layouts"""
+    parser = ColumnParser()
+    parser.parse('public.items', ROW)
+    parser.parse('public.items', 'id[integer]:1')
+    row = parser.parse('public.items', "id[bigint]:9000000000 name[text]:'x'")
+    assert row == {'id': 9000000000, 'name': 'x'}
+    assert parser.stats['invalidations'] == 1
+    assert len(parser.layouts['public.items']) == 1
+    logger.info("Type change invalidated the layouts")
+
+
+def test_registered_layout():
+    """Layouts loaded ahead of time (e.g. from the catalog) are used directly"""
+    parser = ColumnParser()
+    parser.register_layout('public.items', [('id', 'integer'), ('qty', 'smallint')])
+    assert parser.parse('public.items', 'id[integer]:1 qty[smallint]:2') == {'id': 1, 'qty': 2}
+    assert parser.stats['hits'] == 1 and parser.stats['misses'] == 0
+    logger.info("Registered layout used")
+
+
+if __name__ == "__main__":
+    test_parse_converts_types()
+    test_layout_cache()
+    test_type_change_invalidates()
+    test_registered_layout()
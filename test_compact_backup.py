@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import tempfile
+import logging
+from datetime import datetime, timedelta
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.pitr_config import PITR_CONFIG
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("CompactBackupTest")
+
+
+def test_compact_keeps_final_transaction():
+    """A segment's last transaction commits past its end_lsn and must survive compaction"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_compact_')
+    PITR_CONFIG['metadata_dir'] = os.path.join(work_dir, 'metadata')
+    PITR_CONFIG['backup_format'] = 'jsonl'
+
+    from services.PITRBackupManager import PITRBackupManager
+    from services.TransactionLogManager import TransactionLogManager
+
+    transaction_manager = TransactionLogManager(os.path.join(work_dir, 'transactions'))
+    backup_manager = PITRBackupManager(os.path.join(work_dir, 'backups'), transaction_manager)
+
+    # Three transactions; each commits at the LSN after its last change
+    lsn = 0
+    for txid in (1, 2, 3):
+        transaction_manager.begin_transaction(txid, lsn + 1)
+        for row in range(2):
+            lsn += 1
+            backup_manager.track_change(
+                lsn, txid, datetime.now(), 'public.compact_test', 'INSERT',
+                {'id': txid * 10 + row, 'value': f'v{txid}'}
+            )
+        lsn += 1
+        backup_manager.end_transaction(lsn)
+        transaction_manager.commit_transaction(txid, lsn)
+    backup_manager.shutdown()
+
+    backup_id = [backup['backup_id'] for backup in backup_manager.backup_catalog][0]
+    metadata = backup_manager.get_backup_metadata(backup_id)
+    assert metadata['end_lsn'] < lsn, "the last commit should lie past the segment's end_lsn"
+
+    result = backup_manager.compact_backup(backup_id)
+    logger.info(f"Compacted: {result}")
+
+    backup_manager.backup_catalog.add({
+        **metadata,
+        'backup_id': f'{backup_id}_compacted',
+        'filename': os.path.basename(result['path'])
+    })
+    compacted = backup_manager.get_changes_from_backup(f'{backup_id}_compacted')
+
+    assert result['changes_out'] == 6
+    assert {change['txid'] for change in compacted} == {1, 2, 3}
+    assert {change['data']['id'] for change in compacted if change['txid'] == 3} == {30, 31}
+    logger.info("Final transaction kept in the compacted segment")
+
+
+
+def test_compact_drops_rolled_back_reused_txid():
+    """A txid committed on an earlier day does not revive its rolled-back reuse"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_compact_')
+    PITR_CONFIG['metadata_dir'] = os.path.join(work_dir, 'metadata')
+    PITR_CONFIG['backup_format'] = 'jsonl'
+
+    from services.PITRBackupManager import PITRBackupManager
+    from services.TransactionLogManager import TransactionLogManager
+
+    # Yesterday's log: txid 4 committed long before the segment
+    log_dir = os.path.join(work_dir, 'transactions')
+    os.makedirs(log_dir)
+    yesterday = datetime.now() - timedelta(days=1)
+    record = {
+        'txid': 4, 'start_lsn': 40, 'start_timestamp': yesterday.isoformat(),
+        'status': 'COMMITTED', 'changes_count': 1, 'tables_affected': ['public.compact_test'],
+        'end_lsn': 50, 'end_timestamp': yesterday.isoformat()
+    }
+    with open(os.path.join(log_dir, f"transactions_{yesterday.strftime('%Y%m%d')}.jsonl"), 'w') as f:
+        f.write(json.dumps(record) + '\n')
+
+    transaction_manager = TransactionLogManager(log_dir)
+    backup_manager = PITRBackupManager(os.path.join(work_dir, 'backups'), transaction_manager)
+
+    # Today txid 5 commits and the wrapped txid 4 rolls back
+    lsn = 100
+    for txid, commit in ((5, True), (4, False)):
+        transaction_manager.begin_transaction(txid, lsn + 1)
+        lsn += 1
+        backup_manager.track_change(
+            lsn, txid, datetime.now(), 'public.compact_test', 'INSERT', {'id': txid, 'value': f'v{txid}'}
+        )
+        lsn += 1
+        backup_manager.end_transaction(lsn)
+        if commit:
+            transaction_manager.commit_transaction(txid, lsn)
+        else:
+            transaction_manager.rollback_transaction(txid, lsn)
+    backup_manager.shutdown()
+
+    backup_id = [backup['backup_id'] for backup in backup_manager.backup_catalog][0]
+    result = backup_manager.compact_backup(backup_id)
+    logger.info(f"Compacted: {result}")
+
+    assert result['changes_in'] == 1 and result['changes_out'] == 1
+    logger.info("Rolled-back reuse of a txid dropped from the compacted segment")
+
+
+if __name__ == "__main__":
+    test_compact_keeps_final_transaction()
+    test_compact_drops_rolled_back_reused_txid()
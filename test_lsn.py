@@ -0,0 +1,71 @@
+import os
+import sys
+import tempfile
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.LSN import MAX_LSN, PG_LSN_MARKER, format_lsn, parse_lsn, to_lsn
+from services.SqlReplay import split_statements
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("LSNTest")
+
+
+def test_hex_round_trip():
+    """LSNs format and parse as pg_lsn text"""
+    for lsn in (0, 1, 0x3000060, 0x16B3748, (0x1A << 32) | 0xFFFFFFFF, MAX_LSN):
+        assert parse_lsn(format_lsn(lsn)) == lsn
+    assert format_lsn(0x3000060) == '0/3000060'
+    assert format_lsn((0x1A << 32) | 0xB2) == '1A/B2'
+    assert parse_lsn('0/3000060') == 0x3000060
+    assert parse_lsn(' 1a/b2 ') == (0x1A << 32) | 0xB2
+    assert parse_lsn(42) == 42
+    logger.info("pg_lsn text round-trips")
+
+
+def test_legacy_decimal():
+    """Decimal halves are only read as such when asked to"""
+    assert parse_lsn('0/33148448', legacy=True) == 33148448
+    assert parse_lsn('0/33148448') == 0x33148448
+    assert parse_lsn('2/10', legacy=True) == (2 << 32) | 10
+    logger.info("Legacy decimal LSNs read with legacy=True")
+
+
+def test_to_lsn():
+    """to_lsn passes ints and None through and maps bad text to None"""
+    assert to_lsn(None) is None
+    assert to_lsn(7) == 7
+    assert to_lsn('0/A') == 10
+    assert to_lsn('0/A', legacy=True) is None
+    assert to_lsn('not an lsn') is None
+    logger.info("to_lsn handles missing and bad values")
+
+
+def test_sql_segment_marker():
+    """SQL segments are read as pg_lsn only below the marker line"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_lsn_')
+    statement = "INSERT INTO public.t (id) VALUES (1);\n"
+
+    new_segment = os.path.join(work_dir, 'new.sql')
+    with open(new_segment, 'w') as f:
+        f.write(f"-- CDC Backup\n{PG_LSN_MARKER}\n-- LSN: 0/100, TXID: 5, TS: 2026-03-01T12:00:00\n{statement}")
+    old_segment = os.path.join(work_dir, 'old.sql')
+    with open(old_segment, 'w') as f:
+        f.write(f"-- CDC Backup\n-- LSN: 0/100, TXID: 5, TS: 2026-03-01T12:00:00\n{statement}")
+
+    with open(new_segment) as f:
+        new_lsns = [lsn for _, lsn in split_statements(f)]
+    with open(old_segment) as f:
+        old_lsns = [lsn for _, lsn in split_statements(f)]
+    assert new_lsns == [0x100] and old_lsns == [100], (new_lsns, old_lsns)
+    logger.info("SQL segment LSNs read by their marker")
+
+
+if __name__ == "__main__":
+    test_hex_round_trip()
+    test_legacy_decimal()
+    test_to_lsn()
+    test_sql_segment_marker()
@@ -0,0 +1,153 @@
+import os
+import sys
+import threading
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.ParallelApply import ParallelApplier
+from services.TableKeys import TableKeyCache
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ParallelApplyTest")
+
+
+class FakeCursor:
+    def execute(self, query, params=None):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = True
+
+    def cursor(self):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def change(txid, table, row_id, operation='UPDATE', **data):
+    return {
+        'txid': txid, 'table': table, 'operation': operation,
+        'data': {'id': row_id, **data}, 'old_data': {'id': row_id}
+    }
+
+
+def make_applier(apply_change=None, **kwargs):
+    table_keys = TableKeyCache()
+    table_keys.register('public.a', ['id'])
+    table_keys.register('public.b', ['id'])
+    return ParallelApplier(
+        FakeConnection, apply_change or (lambda cursor, c, statements: None),
+        table_keys=table_keys, **kwargs
+    )
+
+
+def schedule(applier, changes):
+    units = list(applier._units(changes))
+    with applier.cond:
+        for seq, unit in enumerate(units):
+            unit.seq = seq
+            applier._schedule(unit)
+    return units
+
+
+def test_units():
+    """Units are cut at each transaction and at batch_size changes"""
+    applier = make_applier(batch_size=2)
+    changes = [change(1, 'public.a', n) for n in range(3)] + [change(2, 'public.a', 9)]
+    units = list(applier._units(changes))
+    assert [(unit.txid, len(unit.changes)) for unit in units] == [(1, 2), (1, 1), (2, 1)]
+    logger.info("Units cut by transaction and size")
+
+
+def test_writeset_conflicts():
+    """Units wait for earlier units writing a common row or a whole table"""
+    applier = make_applier()
+    units = schedule(applier, [
+        change(1, 'public.a', 1),
+        change(2, 'public.a', 2),
+        change(3, 'public.b', 1),
+        change(4, 'public.a', 1),
+        {'txid': 5, 'table': 'public.b', 'operation': 'TRUNCATE', 'data': {}, 'old_data': None},
+        change(6, 'public.b', 7),
+        {'txid': 7, 'sql': 'SELECT 1', 'table': 'unknown'},
+        change(8, 'public.a', 3)
+    ])
+    ready = sorted(seq for seq, _ in applier.ready)
+    assert ready == [0, 1, 2], ready
+    # Same row as unit 0
+    assert units[3].pending == 1 and units[3] in units[0].dependents
+    # A TRUNCATE waits for every in-flight unit of its table
+    assert units[4].pending == 1 and units[4] in units[2].dependents
+    # Rows of a truncated table wait for the TRUNCATE
+    assert units[5].pending == 1 and units[5] in units[4].dependents
+    # A change without a known table waits for everything before it
+    assert units[6].pending == 6
+    assert units[7].pending == 1 and units[7] in units[6].dependents
+
+    with applier.cond:
+        applier._release(units[0])
+    assert 3 in [seq for seq, _ in applier.ready]
+    assert applier.low_water == 1
+    logger.info("Writeset conflicts ordered")
+
+
+def test_key_change_writes_both_keys():
+    """An UPDATE that moves a row conflicts on its old and new key"""
+    applier = make_applier()
+    moved = change(1, 'public.a', 1)
+    moved['data']['id'] = 2
+    units = schedule(applier, [moved, change(2, 'public.a', 1), change(3, 'public.a', 2)])
+    assert units[1].pending == 1 and units[2].pending == 1
+    logger.info("Key change conflicts on both keys")
+
+
+def test_apply_keeps_row_order():
+    """Changes of one row are applied in stream order across workers"""
+    lock = threading.Lock()
+    applied = []
+
+    def apply_change(cursor, c, statements):
+        with lock:
+            applied.append((c['data']['id'], c['data']['v']))
+
+    changes = [change(n, 'public.a', n % 5, v=n) for n in range(200)]
+    applier = make_applier(apply_change, workers=4, batch_size=10)
+    assert applier.apply(changes) == 200
+    for row_id in range(5):
+        versions = [v for key, v in applied if key == row_id]
+        assert versions == sorted(versions) and len(versions) == 40
+    logger.info(f"Row order kept: {applier.stats}")
+
+
+def test_failing_change_skipped_in_order():
+    """A change that keeps failing is deferred, then skipped in stream order"""
+    def apply_change(cursor, c, statements):
+        if c['data']['id'] == 3:
+            raise RuntimeError("constraint violation")
+
+    changes = [change(n, 'public.a', n) for n in range(10)]
+    applier = make_applier(apply_change, workers=2)
+    assert applier.apply(changes) == 9
+    assert applier.stats['deferred_units'] >= 1
+    assert applier.apply_stats['failed_changes'] == 1
+    logger.info("Failing change skipped")
+
+
+if __name__ == "__main__":
+    test_units()
+    test_writeset_conflicts()
+    test_key_change_writes_both_keys()
+    test_apply_keeps_row_order()
+    test_failing_change_skipped_in_order()
@@ -0,0 +1,119 @@
+import os
+import sys
+import struct
+import logging
+from datetime import datetime
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.PgOutputDecoder import PgOutputDecoder, quote_ident
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("PgOutputDecoderTest")
+
+# 2024-01-02 03:04:05 UTC in microseconds since 2000-01-01
+COMMIT_TS = 757566245 * 1000000
+
+
+def relation_message(relid, namespace, name, columns, replica_identity=b'd'):
+    """Relation message; columns are (name, type OID, is key)"""
+    body = struct.pack('!I', relid) + namespace.encode() + b'\0' + name.encode() + b'\0'
+    body += replica_identity + struct.pack('!h', len(columns))
+    for column, type_oid, is_key in columns:
+        body += bytes([1 if is_key else 0]) + column.encode() + b'\0' + struct.pack('!Ii', type_oid, -1)
+    return b'R' + body
+
+
+def tuple_data(*values):
+    """TupleData: None is a null, ... an unchanged TOAST value, anything else text"""
+    body = struct.pack('!h', len(values))
+    for value in values:
+        if value is None:
+            body += b'n'
+        elif value is Ellipsis:
+            body += b'u'
+        else:
+            text = str(value).encode()
+            body += b't' + struct.pack('!i', len(text)) + text
+    return body
+
+
+# Messages as captured from a pgoutput stream (protocol version 1)
+BEGIN = b'B' + struct.pack('!qqI', 0x16B3748, COMMIT_TS, 742)
+RELATION = relation_message(16390, 'public', 'Order Items', [
+    ('id', 23, True), ('user', 25, False), ('qty', 20, False), ('paid', 16, False), ('note', 25, False)
+])
+INSERT = b'I' + struct.pack('!I', 16390) + b'N' + tuple_data(1, "O'Brien", 3, 't', None)
+UPDATE = (
+    b'U' + struct.pack('!I', 16390) + b'K' + tuple_data(1, None, None, None, None)
+    + b'N' + tuple_data(2, "O'Brien", 4, 'f', Ellipsis)
+)
+DELETE = b'D' + struct.pack('!I', 16390) + b'K' + tuple_data(2, None, None, None, None)
+TRUNCATE = b'T' + struct.pack('!ibI', 1, 1, 16390)
+COMMIT = b'C' + struct.pack('!bqqq', 0, 0x16B3748, 0x16B3778, COMMIT_TS)
+
+
+def test_quote_ident():
+    """Identifiers are quoted like PostgreSQL's quote_ident()"""
+    assert quote_ident('orders') == 'orders'
+    assert quote_ident('order_items_2') == 'order_items_2'
+    assert quote_ident('Orders') == '"Orders"'
+    assert quote_ident('order items') == '"order items"'
+    assert quote_ident('user') == '"user"'
+    assert quote_ident('int') == '"int"'
+    assert quote_ident('name') == 'name'
+    assert quote_ident('say "hi"') == '"say ""hi"""'
+    logger.info("quote_ident matches PostgreSQL")
+
+
+def test_decode_transaction():
+    """A captured transaction decodes into BEGIN, changes and COMMIT"""
+    decoder = PgOutputDecoder()
+
+    begin = decoder.decode(BEGIN)
+    assert begin['type'] == 'BEGIN' and begin['txid'] == 742 and begin['final_lsn'] == 0x16B3748
+    assert isinstance(begin['commit_time'], datetime)
+
+    relation = decoder.decode(RELATION)['relation']
+    assert relation.table == 'public."Order Items"'
+    assert relation.columns == ['id', '"user"', 'qty', 'paid', 'note']
+    assert relation.key_columns == ['id']
+
+    insert = decoder.decode(INSERT)
+    assert insert['table'] == 'public."Order Items"' and insert['operation'] == 'INSERT'
+    assert insert['data'] == {'id': 1, '"user"': "O'Brien", 'qty': 3, 'paid': True, 'note': None}
+
+    update = decoder.decode(UPDATE)
+    assert update['old_data'] == {'id': 1}
+    # The unchanged TOAST value is left out so it is not overwritten
+    assert update['data'] == {'id': 2, '"user"': "O'Brien", 'qty': 4, 'paid': False}
+
+    delete = decoder.decode(DELETE)
+    assert delete['operation'] == 'DELETE' and delete['old_data'] == {'id': 2}
+
+    truncate = decoder.decode(TRUNCATE)
+    assert truncate['tables'] == ['public."Order Items"'] and truncate['cascade']
+
+    commit = decoder.decode(COMMIT)
+    assert commit['type'] == 'COMMIT' and commit['end_lsn'] == 0x16B3778
+    logger.info("Captured transaction decoded")
+
+
+def test_unknown_relation_raises():
+    """Row messages for a relation never announced fail instead of being dropped"""
+    decoder = PgOutputDecoder()
+    for message in (INSERT, TRUNCATE):
+        try:
+            decoder.decode(message)
+        except KeyError:
+            continue
+        raise AssertionError(f"{message[:1]!r} for an unknown relation was decoded")
+    logger.info("Unknown relation OIDs raise")
+
+
+if __name__ == "__main__":
+    test_quote_ident()
+    test_decode_transaction()
+    test_unknown_relation_raises()
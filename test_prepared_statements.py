@@ -0,0 +1,133 @@
+import os
+import sys
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.PreparedStatements import PreparedStatementCache, _numbered
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("PreparedStatementsTest")
+
+
+class SchemaError(Exception):
+    """Error carrying a SQLSTATE, like psycopg2's"""
+
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+class RecordingCursor:
+    """Cursor that records statements; raises queued errors on EXECUTE"""
+
+    def __init__(self):
+        self.statements = []
+        self.errors = []
+
+    def execute(self, query, params=None):
+        self.statements.append((query, tuple(params) if params else None))
+        if query.startswith('EXECUTE') and self.errors:
+            raise self.errors.pop(0)
+
+
+def update_sql():
+    return "UPDATE public.a SET v = %s WHERE id = %s"
+
+
+def test_numbered():
+    """%s placeholders become $1, $2, ..."""
+    assert _numbered(update_sql()) == "UPDATE public.a SET v = $1 WHERE id = $2"
+    assert _numbered("DELETE FROM public.a") == "DELETE FROM public.a"
+    logger.info("Placeholders numbered")
+
+
+def test_prepare_then_execute():
+    """A miss prepares the statement, a hit only executes it"""
+    cursor = RecordingCursor()
+    cache = PreparedStatementCache(cursor, size=4)
+    key = ('public.a', 'UPDATE', ('v',), ('id',))
+    cache.execute(key, update_sql, [1, 2])
+    cache.execute(key, update_sql, [3, 4])
+    assert cursor.statements == [
+        ("PREPARE cdc_stmt_0 AS UPDATE public.a SET v = $1 WHERE id = $2", None),
+        ("EXECUTE cdc_stmt_0 (%s, %s)", (1, 2)),
+        ("EXECUTE cdc_stmt_0 (%s, %s)", (3, 4))
+    ], cursor.statements
+    assert cache.stats['statements_prepared'] == 1 and cache.stats['statement_hits'] == 1
+    logger.info("Prepared once, executed twice")
+
+
+def test_lru_eviction():
+    """Beyond size statements the least recently used is deallocated"""
+    cursor = RecordingCursor()
+    cache = PreparedStatementCache(cursor, size=2)
+    cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    cache.execute(('public.a', 2), lambda: "SELECT 2", [])
+    cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    cache.execute(('public.a', 3), lambda: "SELECT 3", [])
+    assert ("DEALLOCATE cdc_stmt_1", None) in cursor.statements
+    assert set(cache.statements) == {('public.a', 1), ('public.a', 3)}
+    assert cache.stats['statements_evicted'] == 1
+    logger.info("Least recently used statement evicted")
+
+
+def test_schema_error_invalidates_table():
+    """A schema error drops the table's statements; they are deallocated before the next PREPARE"""
+    cursor = RecordingCursor()
+    cache = PreparedStatementCache(cursor, size=8)
+    cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    cache.execute(('public.a', 2), lambda: "SELECT 2", [])
+    cache.execute(('public.b', 1), lambda: "SELECT 3", [])
+
+    cursor.errors.append(SchemaError('42703'))
+    try:
+        cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    except SchemaError:
+        pass
+    else:
+        raise AssertionError("the error was not raised")
+    assert set(cache.statements) == {('public.b', 1)}
+    assert cache.stats['statements_invalidated'] == 2
+
+    # Nothing is sent inside the failed transaction
+    sent = len(cursor.statements)
+    cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    after = [query for query, _ in cursor.statements[sent:]]
+    assert sorted(after[:2]) == ["DEALLOCATE cdc_stmt_0", "DEALLOCATE cdc_stmt_1"], after
+    assert after[2:] == ["PREPARE cdc_stmt_3 AS SELECT 1", "EXECUTE cdc_stmt_3"], after
+    logger.info("Schema error invalidated the table's statements")
+
+
+def test_other_errors_keep_statements():
+    """Errors unrelated to the schema (e.g. unique violation) keep the statement"""
+    cursor = RecordingCursor()
+    cache = PreparedStatementCache(cursor, size=8)
+    cursor.errors.append(SchemaError('23505'))
+    try:
+        cache.execute(('public.a', 1), lambda: "SELECT 1", [])
+    except SchemaError:
+        pass
+    assert ('public.a', 1) in cache.statements and not cache.stale
+    logger.info("Statement kept after a data error")
+
+
+def test_unprepared():
+    """With size 0 statements are executed directly"""
+    cursor = RecordingCursor()
+    cache = PreparedStatementCache(cursor, size=0)
+    cache.execute(('public.a', 1), update_sql, [1, 2])
+    assert cursor.statements == [(update_sql(), (1, 2))]
+    assert len(cache) == 0
+    logger.info("Executed unprepared")
+
+
+if __name__ == "__main__":
+    test_numbered()
+    test_prepare_then_execute()
+    test_lru_eviction()
+    test_schema_error_invalidates_table()
+    test_other_errors_keep_statements()
+    test_unprepared()
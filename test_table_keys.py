@@ -0,0 +1,97 @@
+import os
+import sys
+import logging
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.PgOutputDecoder import RelationInfo
+from services.TableKeys import TableKeyCache, key_condition
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("TableKeysTest")
+
+INT4 = 23
+
+
+def relation(replica_identity, key_columns=()):
+    columns = [(1 if name in key_columns else 0, name, INT4, -1) for name in ('note', 'tenant', 'id')]
+    return RelationInfo(16384, 'public', 'orders', replica_identity, columns)
+
+
+def test_registered_key():
+    """Rows match on the registered key, in key order"""
+    keys = TableKeyCache()
+    keys.register('public.orders', ['tenant', 'id'])
+    change = {'table': 'public.orders', 'data': {'note': 'x', 'id': 5, 'tenant': 2}, 'old_data': None}
+    assert keys.row_key(change) == (('tenant', 'id'), (2, 5))
+    assert keys.stats['hits'] == 1
+    logger.info("Registered key used")
+
+
+def test_first_column_fallback():
+    """Unknown tables, and rows missing a key column, match on the first column"""
+    keys = TableKeyCache()
+    change = {'table': 'public.other', 'data': {'note': 'x', 'id': 5}, 'old_data': None}
+    assert keys.row_key(change) == (('note',), ('x',))
+
+    keys.register('public.orders', ['id'])
+    change = {'table': 'public.orders', 'data': {'note': 'x', 'id': 5}, 'old_data': {'note': 'x'}}
+    assert keys.row_key(change) == (('note',), ('x',))
+    assert keys.stats['misses'] == 2
+    logger.info("First column used without a key")
+
+
+def test_whole_row_and_new_key():
+    """Whole-row keys take every old column; new_key reads the updated values"""
+    keys = TableKeyCache()
+    keys.register('public.orders', None)
+    change = {
+        'table': 'public.orders', 'operation': 'UPDATE',
+        'data': {'note': 'y', 'tenant': 2, 'id': 6},
+        'old_data': {'note': 'x', 'tenant': 2, 'id': 5}
+    }
+    columns, values = keys.row_key(change)
+    assert columns == ('note', 'tenant', 'id') and values == ('x', 2, 5)
+    assert keys.new_key(change, columns, values) == ('y', 2, 6)
+    logger.info("Whole-row key and new key")
+
+
+def test_register_relation():
+    """Relation messages set the key unless FULL would replace a known key"""
+    keys = TableKeyCache()
+    keys.register_relation(relation('d', ('id',)))
+    assert keys.keys['public.orders'] == ('id',)
+
+    # FULL keeps a key loaded earlier
+    keys.register_relation(relation('f', ('note', 'tenant', 'id')))
+    assert keys.keys['public.orders'] == ('id',)
+
+    keys.register_relation(relation('i', ('tenant', 'id')))
+    assert keys.keys['public.orders'] == ('tenant', 'id')
+
+    keys.invalidate('public.orders')
+    keys.register_relation(relation('f', ('note', 'tenant', 'id')))
+    assert keys.keys['public.orders'] == ()
+
+    # NOTHING carries no key
+    keys.invalidate()
+    keys.register_relation(relation('n'))
+    assert 'public.orders' not in keys
+    logger.info("Relation messages registered")
+
+
+def test_key_condition():
+    """NULL key values match with IS NULL and take no parameter"""
+    assert key_condition(['a', 'b'], [1, None]) == ('a = %s AND b IS NULL', [1])
+    assert key_condition(['id'], [7], alias='t') == ('t.id = %s', [7])
+    logger.info("Key conditions built")
+
+
+if __name__ == "__main__":
+    test_registered_key()
+    test_first_column_fallback()
+    test_whole_row_and_new_key()
+    test_register_relation()
+    test_key_condition()
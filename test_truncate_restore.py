@@ -0,0 +1,91 @@
+import os
+import sys
+import struct
+import tempfile
+import logging
+from datetime import datetime
+
+# Add current directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from services.pitr_config import PITR_CONFIG
+
+# Configure logging to stdout
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("TruncateRestoreTest")
+
+
+class RecordingCursor:
+    """Cursor that records the statements a restore sends"""
+
+    def __init__(self):
+        self.statements = []
+        self.rowcount = -1
+
+    def execute(self, query, params=None):
+        self.statements.append(query)
+
+    def copy_expert(self, query, source):
+        self.statements.append(query)
+
+
+def relation_message(relid, namespace, name, columns):
+    """pgoutput Relation message for int4 columns, the first one the key"""
+    body = struct.pack('!I', relid) + namespace.encode() + b'\0' + name.encode() + b'\0'
+    body += b'd' + struct.pack('!h', len(columns))
+    for n, column in enumerate(columns):
+        body += bytes([1 if n == 0 else 0]) + column.encode() + b'\0' + struct.pack('!Ii', 23, -1)
+    return b'R' + body
+
+
+def truncate_message(*relids):
+    return b'T' + struct.pack(f'!ib{len(relids)}I', len(relids), 0, *relids)
+
+
+def test_truncate_replayed():
+    """A TRUNCATE captured from pgoutput reaches the restored database"""
+    work_dir = tempfile.mkdtemp(prefix='cdc_truncate_')
+    PITR_CONFIG['metadata_dir'] = os.path.join(work_dir, 'metadata')
+
+    from services.PgOutputDecoder import PgOutputDecoder
+    from services.PITRBackupManager import PITRBackupManager
+    from services.PITRRestoreManager import PITRRestoreManager
+    from services.TransactionLogManager import TransactionLogManager
+    from services.BulkApply import BulkApplier
+
+    decoder = PgOutputDecoder()
+    decoder.decode(relation_message(16384, 'public', 'items', ['id', 'qty']))
+    event = decoder.decode(truncate_message(16384))
+    assert event['tables'] == ['public.items']
+
+    for backup_format in ('jsonl', 'binary'):
+        PITR_CONFIG['backup_format'] = backup_format
+        transaction_manager = TransactionLogManager(os.path.join(work_dir, backup_format, 'transactions'))
+        backup_manager = PITRBackupManager(os.path.join(work_dir, backup_format, 'backups'), transaction_manager)
+
+        # As CDCProcessor._apply_event records it
+        transaction_manager.begin_transaction(7, 100)
+        backup_manager.track_change(
+            100, 7, datetime.now(), 'public.items', 'INSERT', {'id': 1, 'qty': 5}
+        )
+        for table_name in event['tables']:
+            backup_manager.track_change(101, 7, datetime.now(), table_name, 'TRUNCATE', {})
+        backup_manager.end_transaction(102)
+        transaction_manager.commit_transaction(7, 102)
+        backup_manager.shutdown()
+
+        backup_id = [backup['backup_id'] for backup in backup_manager.backup_catalog][0]
+        changes = backup_manager.get_changes_from_backup(backup_id)
+        assert [change['operation'] for change in changes] == ['INSERT', 'TRUNCATE']
+
+        restore_manager = PITRRestoreManager(backup_manager, transaction_manager)
+        cursor = RecordingCursor()
+        applier = BulkApplier(cursor, restore_manager._apply_change, stop_on_error=True)
+        assert applier.apply(changes) == 2
+
+        assert "TRUNCATE TABLE public.items" in cursor.statements, cursor.statements
+        logger.info(f"{backup_format}: TRUNCATE replayed")
+
+
+if __name__ == "__main__":
+    test_truncate_replayed()